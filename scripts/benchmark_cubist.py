@@ -0,0 +1,60 @@
+"""
+Benchmark the compiled cubist rule evaluation against evaluating each
+rule in turn. Rules are randomly generated, so no cubist install is
+needed.
+
+.. example::
+
+    python benchmark_cubist.py --rows 1000000 --committees 20 --rules 100
+"""
+import argparse
+import time
+
+import numpy as np
+
+from uncoverml.cubist import Cubist, CompiledRules, Rule
+
+
+def random_rule(rnd, m):
+    lines = ['="1" cover="10" mean="1.0"']
+    for att in rnd.choice(m, rnd.randint(1, 4), replace=False):
+        lines.append('type="2" att="f.tif_{}" cut="{}" result="{}"'.format(
+            att, rnd.rand(), rnd.choice(['<', '>', '<=', '>='])))
+    terms = ' '.join('att="f.tif_{}" coeff="{}"'.format(a, rnd.randn())
+                     for a in rnd.choice(m, min(m, 5), replace=False))
+    lines.append('coeff="{}" {}'.format(rnd.randn(), terms))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--features', type=int, default=30)
+    parser.add_argument('--committees', type=int, default=20)
+    parser.add_argument('--rules', type=int, default=100)
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = np.random.RandomState(0)
+    x = rnd.rand(args.rows, args.features)
+    cube = Cubist()
+    cube.models = [[Rule(random_rule(rnd, args.features), args.features)
+                    for _ in range(args.rules)]
+                   for _ in range(args.committees)]
+
+    start = time.time()
+    y_rules = cube.predict_rules(x)
+    t_rules = time.time() - start
+
+    compiled = CompiledRules(cube.models, n_jobs=args.jobs)
+    start = time.time()
+    y_compiled = compiled.predict(x)
+    t_compiled = time.time() - start
+
+    print("Rule by rule: {:.2f}s".format(t_rules))
+    print("Compiled:     {:.2f}s ({:.1f}x)".format(t_compiled, t_rules / t_compiled))
+    print("Max abs difference: {:.3g}".format(np.max(np.abs(y_rules - y_compiled))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree import DecisionTreeRegressor
+
+from uncoverml import bundle, geoio
+from uncoverml.models import bootstrap_model
+
+
+class BootstrappedTree(bootstrap_model(DecisionTreeRegressor)):
+    pass
+
+
+def _data():
+    rnd = np.random.RandomState(1)
+    x = rnd.rand(2000, 3)
+    y = x.dot([1., 2., 3.]) + rnd.randn(2000)
+    return x, y
+
+
+def test_bundle(tmpdir):
+    x, y = _data()
+    model = RandomForestRegressor(n_estimators=5, random_state=1).fit(x, y)
+    path = str(tmpdir.join('forest.model'))
+    bundle.save_bundle(path, model, ['feature sets'], 'final transform')
+
+    assert bundle.is_bundle(path)
+    assert os.listdir(os.path.join(path, bundle.ARRAYS))
+    loaded, feature_sets, final_transform = bundle.load_bundle(path)
+    assert feature_sets == ['feature sets']
+    assert final_transform == 'final transform'
+    assert np.array_equal(loaded.predict(x), model.predict(x))
+
+    # saving again replaces the bundle
+    model = RandomForestRegressor(n_estimators=2, random_state=2).fit(x, y)
+    bundle.save_bundle(path, model, None, None)
+    assert len(bundle.load_bundle(path)[0].estimators_) == 2
+
+
+def test_bundle_lazy_members(tmpdir):
+    x, y = _data()
+    model = BootstrappedTree(n_models=4, parallel=False)
+    model.fit(x, y, None)
+    path = str(tmpdir.join('bootstrap.model'))
+    bundle.save_bundle(path, model, None, None)
+
+    loaded, _, _ = bundle.load_bundle(path)
+    assert isinstance(loaded.models, bundle.LazyMembers)
+    assert len(loaded.models) == 4 and loaded.models.n_loaded == 0
+    y_pred = loaded.predict(x, bootstrap_predictions=2)
+    assert loaded.models.n_loaded == 2
+    assert np.array_equal(y_pred, model.predict(x, bootstrap_predictions=2))
+    assert isinstance(loaded.models[0].tree_.value, np.ndarray)
+
+    # members are plain lists again once pickled
+    restored = pickle.loads(pickle.dumps(loaded))
+    assert isinstance(restored.models, list) and len(restored.models) == 4
+    assert np.array_equal(restored.predict(x), model.predict(x))
+
+
+def test_export_model(tmpdir):
+    x, y = _data()
+    model = DecisionTreeRegressor(random_state=1).fit(x, y)
+    for model_bundle in (False, True):
+        config = SimpleNamespace(
+            model_file=str(tmpdir.join('{}.model'.format(model_bundle))),
+            model_bundle=model_bundle, feature_sets=[], final_transform=None)
+        geoio.export_model(model, config)
+        assert os.path.isdir(config.model_file) == model_bundle
+        loaded, _, _ = geoio.load_model(config.model_file)
+        assert np.array_equal(loaded.predict(x), model.predict(x))
+
+    # the formats replace each other at the same path
+    config.model_file = str(tmpdir.join('model'))
+    for model_bundle in (True, False, True):
+        config.model_bundle = model_bundle
+        geoio.export_model(model, config)
+        assert os.path.isdir(config.model_file) == model_bundle
+        loaded, _, _ = geoio.load_model(config.model_file)
+        assert np.array_equal(loaded.predict(x), model.predict(x))
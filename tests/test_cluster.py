@@ -0,0 +1,68 @@
+import numpy as np
+
+from uncoverml import cluster
+
+
+def _blobs(n, k, d, seed):
+    rnd = np.random.RandomState(seed)
+    centres = rnd.rand(k, d) * 20
+    classes = rnd.randint(0, k, n)
+    x = centres[classes] + rnd.randn(n, d) * 0.5
+    return x, classes, centres
+
+
+def test_minibatch_kmeans():
+    x, _, centres = _blobs(3000, 4, 3, 1)
+    np.random.seed(2)
+    model = cluster.KMeans(4, 5)
+
+    def batches():
+        return np.array_split(x, 6)
+
+    model.learn_minibatch(x[::10], batches, max_epochs=20, tolerance=1e-3)
+    nearest = np.argmin(((model.centres[:, np.newaxis] - centres)**2).sum(-1),
+                        axis=1)
+    assert np.array_equal(np.sort(nearest), np.arange(4))
+    assert np.allclose(model.centres, centres[nearest], atol=0.1)
+
+
+def test_minibatch_kmeans_is_running_mean():
+    x, _, _ = _blobs(500, 3, 2, 3)
+    C = x[:3].copy()
+    # a single batch and epoch is one Lloyd step
+    C_mini = cluster.run_minibatch_kmeans(lambda: [x], C, max_epochs=1)
+    classes, _ = cluster.compute_class(x, C)
+    assert np.allclose(C_mini, cluster.kmeans_step(x, C, classes))
+
+
+def _lloyd(X, C, training_data=None):
+    classes, _ = cluster.compute_class(X, C, training_data)
+    while True:
+        C = cluster.kmeans_step(X, C, classes)
+        classes_new, cost = cluster.compute_class(X, C)
+        if np.all(classes_new == classes):
+            return C, classes, cost
+        classes = classes_new
+
+
+def test_run_kmeans_matches_lloyd():
+    x, _, _ = _blobs(5000, 12, 4, 4)
+    C_init = x[:12].copy()
+    C_ref, classes_ref, _ = _lloyd(x, C_init)
+    C, classes = cluster.run_kmeans(x, C_init, 12)
+    assert np.array_equal(classes, classes_ref)
+    assert np.allclose(C, C_ref)
+
+
+def test_bounded_assignment():
+    rnd = np.random.RandomState(5)
+    x, _, _ = _blobs(2500, 6, 3, 6)
+    C = x[:6].copy()
+    assignment = cluster.BoundedAssignment(x, C)
+    for _ in range(5):
+        C = C + rnd.randn(*C.shape) * 0.3
+        classes, cost = assignment.update(C)
+        classes_ref, cost_ref = cluster.compute_class(x, C)
+        assert np.array_equal(classes, classes_ref)
+        assert np.isclose(cost, cost_ref)
+        assert assignment.n_searched < x.shape[0]
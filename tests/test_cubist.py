@@ -1,5 +1,6 @@
 
 import numpy as np
+import pytest
 from sklearn.metrics import r2_score
 
 from uncoverml.cubist import Cubist, MultiCubist
@@ -93,3 +94,187 @@ def test_multicibist_mpi(mpisync):
     score = r2_score(y, y_pred_p)
 
     assert 0.5 < score < 0.8
+
+
+def _random_rule(rnd, m, categorical):
+    """
+    Build the text of a cubist rule in the format found in .model files.
+    """
+    lines = ['="{}" cover="10" mean="1.0"'.format(rnd.randint(0, 4))]
+    for _ in range(rnd.randint(0, 4)):
+        att = rnd.randint(0, m)
+        if att in categorical:
+            elts = ','.join('"{}"'.format(v) for v in rnd.choice(5, 2, replace=False))
+            lines.append('type="3" att="f.tif_{}" elts={}'.format(att, elts))
+        else:
+            op = rnd.choice(['<', '>', '>=', '<='])
+            lines.append('type="2" att="f.tif_{}" cut="{}" result="{}"'.format(
+                att, rnd.rand(), op))
+    terms = ' '.join('att="f.tif_{}" coeff="{}"'.format(a, rnd.randn())
+                     for a in rnd.choice(m, 3, replace=False))
+    lines.append('coeff="{}" {}'.format(rnd.randn(), terms))
+    return '\n'.join(lines) + '\n'
+
+
+def test_compiled_rules():
+    from uncoverml.cubist import Rule, CompiledRules
+    rnd = np.random.RandomState(1)
+    n, m = 1000, 6
+    categorical = [4, 5]
+    x = rnd.rand(n, m)
+    x[:, categorical] = rnd.randint(0, 5, (n, 2))
+
+    predictor = Cubist()
+    predictor.models = [[Rule(_random_rule(rnd, m, categorical), m)
+                         for _ in range(rnd.randint(1, 8))]
+                        for _ in range(4)]
+    predictor._trained = True
+
+    y_ref = predictor.predict_rules(x)
+    assert np.allclose(predictor.compiled_rules.predict(x), y_ref)
+    chunked = CompiledRules(predictor.models, chunk_size=77, n_jobs=3)
+    assert np.allclose(chunked.predict(x), y_ref)
+    assert np.allclose(predictor.predict(x), y_ref.mean(axis=1))
+
+
+def test_parse_model():
+    from uncoverml.cubist import parse_model, Rule
+    rnd = np.random.RandomState(2)
+    m = 6
+    members = [[_random_rule(rnd, m, [4, 5]) for _ in range(r)]
+               for r in (3, 1)]
+    header = ['id="Cubist 2.07 GPL Edition"',
+              'prec="3" globalmean="1.2" extrap="1" insts="0"',
+              'att="t" mean="1.2" sd="0.3"',
+              'entries="2"']
+    body = ['rules="{}"\n'.format(len(rules)) +
+            ''.join('conds="{}" cover="10" mean="1.0"\n'.format(
+                len(r.splitlines()) - 2) + r.split('\n', 1)[1]
+                for r in rules)
+            for rules in members]
+    models = parse_model('\n'.join(header) + '\n' + ''.join(body), m)
+
+    assert [len(model) for model in models] == [3, 1]
+    for model, rules in zip(models, members):
+        for parsed, text in zip(model, rules):
+            expected = Rule(text, m)
+            assert parsed.bias == expected.bias
+            assert np.all(parsed.coefficients == expected.coefficients)
+            assert parsed.conditions == expected.conditions
+
+
+def test_bootstrap_random_state(monkeypatch):
+    from uncoverml import cubist
+    written = []
+    monkeypatch.setattr(cubist, 'write_data',
+                        lambda filename, data: written.append(data))
+    monkeypatch.setattr(Cubist, '_run_cubist', lambda self, filestem: None)
+    monkeypatch.setattr(cubist, 'read_data', lambda filename: '')
+    monkeypatch.setattr(cubist, 'parse_model', lambda text, m: [])
+
+    for seed in (1, 1, 2):
+        Cubist(bootstrap=50, random_state=np.random.RandomState(seed)).fit(x, y)
+    assert len(written[0]) == len(y) // 2
+    assert np.array_equal(written[0], written[1])
+    assert not np.array_equal(written[0], written[2])
+
+
+def test_multicubist_seeds(tmpdir, monkeypatch):
+    import threading
+    seeds = []
+    lock = threading.Lock()
+
+    def fit(self, x, y):
+        with lock:
+            seeds.append(self.seed)
+        self.models = []
+    monkeypatch.setattr(Cubist, 'fit', fit)
+    monkeypatch.setattr(MultiCubist, '_compile', lambda self, trees: None)
+
+    fitted = []
+    for n_jobs in (1, 3):
+        seeds = []
+        np.random.seed(n_jobs)
+        MultiCubist(outdir=str(tmpdir), trees=6, seed=4,
+                    n_jobs=n_jobs).fit(x, y)
+        fitted.append(sorted(seeds))
+    assert len(fitted[0]) == 6
+    assert fitted[0] == fitted[1]
+
+
+def test_multicubist_legacy_pickle(tmpdir):
+    import os
+    import pickle
+    from uncoverml.cubist import Rule
+    rnd = np.random.RandomState(4)
+    m = 6
+    x = rnd.rand(50, m)
+    x[:, 5] = rnd.randint(0, 5, 50)
+    temp_dir = str(tmpdir.mkdir('results'))
+    cubes = []
+    for t in range(2):
+        c = Cubist()
+        c.models = [[Rule(_random_rule(rnd, m, [5]), m) for _ in range(3)]]
+        c._trained = True
+        cubes.append(c)
+        with open(os.path.join(temp_dir, 'cube_{}.pk'.format(t)), 'wb') as f:
+            pickle.dump(c, f)
+
+    # the state of a MultiCubist from before its rules were compiled
+    predictor = MultiCubist.__new__(MultiCubist)
+    predictor.__dict__.update(temp_dir=temp_dir, trees=2, parallel=True,
+                              _trained=True)
+    y_ref = np.hstack([c.predict_rules(x) for c in cubes]).mean(axis=1)
+    assert np.allclose(predictor.predict(x), y_ref)
+
+
+def test_write_data(tmpdir):
+    from uncoverml.cubist import write_data
+    data = np.random.randn(123, 4)
+    data[3, 2] = 1e-300
+    filename = str(tmpdir.join('cubist.data'))
+    write_data(filename, data, chunk_size=50)
+    assert np.array_equal(np.loadtxt(filename, delimiter=','), data)
+
+
+@pytest.mark.parametrize('mmap_rules', [False, True])
+def test_multicubist_compiled(tmpdir, mmap_rules):
+    import pickle
+    from uncoverml.cubist import Rule
+    rnd = np.random.RandomState(3)
+    n, m = 500, 6
+    categorical = [5]
+    x = rnd.rand(n, m)
+    x[:, categorical] = rnd.randint(0, 5, (n, 1))
+
+    trees = [[[Rule(_random_rule(rnd, m, categorical), m)
+               for _ in range(rnd.randint(1, 6))]
+              for _ in range(2)]
+             for _ in range(3)]
+    predictor = MultiCubist(outdir=str(tmpdir), trees=3, committee_members=2,
+                            mmap_rules=mmap_rules)
+    predictor._compile(trees)
+    predictor._trained = True
+
+    singles = []
+    for t in trees:
+        c = Cubist()
+        c.models = t
+        c._trained = True
+        singles.append(c.predict_rules(x))
+    y_ref = np.hstack(singles)
+    assert np.allclose(predictor.predict(x), y_ref.mean(axis=1))
+
+    restored = pickle.loads(pickle.dumps(predictor))
+    assert isinstance(restored.compiled_rules.coefficients, np.memmap) \
+        == mmap_rules
+    assert np.allclose(restored.predict(x), y_ref.mean(axis=1))
+
+    if mmap_rules:
+        # every fit gets its own rules directory
+        other = MultiCubist(outdir=str(tmpdir), trees=1, committee_members=2,
+                            mmap_rules=True)
+        other._compile(trees[:1])
+        assert other.rules_dir != predictor.rules_dir
+        assert restored.rules_dir == predictor.rules_dir
+        assert np.allclose(predictor.predict(x), y_ref.mean(axis=1))
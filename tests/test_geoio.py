@@ -145,6 +145,40 @@ def test_pix2latlong(pix_size_single, origin_point, is_flipped,
     assert np.all(lonlats == true_d)
 
 
+@pytest.mark.parametrize('pixsize', [0.1, 1. / 3, 0.00025])
+def test_image_geometry(pixsize):
+    from uncoverml.image import ImageGeometry, image_geometry
+    res, origin = (300, 200), (130.123, -31.7)
+    geometry = ImageGeometry(res, origin, (pixsize, pixsize))
+    corners = [np.array([o + float(k) * pixsize for k in range(r + 1)])
+               for r, o in zip(res, origin)]
+
+    rnd = np.random.RandomState(1)
+    points = []
+    for c in corners:
+        p = np.concatenate([c[:201], np.nextafter(c[:201], -np.inf),
+                            np.nextafter(c[:201], np.inf),
+                            rnd.uniform(c[0] - 1, c[-1] + 1, 200)])
+        points.append(p)
+    lonlat = np.column_stack(points)
+    xy = geometry.lonlat2pix(lonlat)
+    for axis, c in enumerate(corners):
+        expected = np.searchsorted(c, lonlat[:, axis], side='right') - 1
+        expected[lonlat[:, axis] == c[-1]] -= 1
+        assert np.all(xy[:, axis] == expected)
+
+    pix = np.column_stack([np.arange(201), np.arange(201)])
+    assert np.all(geometry.pix2lonlat(pix) ==
+                  np.column_stack([corners[0][:201], corners[1][:201]]))
+    with pytest.raises(ValueError):
+        geometry.pix2lonlat(np.array([[301, 0]]))
+
+    src = geoio.ArrayImageSource(np.ma.zeros(res + (1,)), np.array(origin),
+                                 crs, np.array([pixsize, pixsize]))
+    assert Image(src, 0, 3)._geometry is Image(src, 2, 3)._geometry
+    assert image_geometry(src) is image_geometry(src)
+
+
 def test_load_shapefile(shapefile):
     true_lonlats, filename = shapefile
     for i in range(10):
@@ -276,6 +310,43 @@ def test_covariate_cropping(sirsam_covariate_paths):
 
     os.remove(out)
     
+@pytest.mark.parametrize('crop_box, pixel_coordinates', [
+    ((None, None, None, None), False),
+    ((0, 0, 10, 10), True),
+    ((3, None, 50, 20), True),
+    ((121.365, -27.45, 121.4, -27.4), False)])
+def test_virtual_cropping(sirsam_covariate_paths, crop_box, pixel_coordinates):
+    cov = sirsam_covariate_paths[0]
+    full = Image(geoio.RasterioImageSource(cov, (None,) * 4))
+    cropped = Image(geoio.RasterioImageSource(cov, crop_box, pixel_coordinates))
+    (row_start, row_stop), (col_start, col_stop) = cropped.source.window
+    assert cropped.resolution[:2] == (col_stop - col_start, row_stop - row_start)
+    if pixel_coordinates:
+        xmin, ymin, xmax, ymax = crop_box
+        assert (col_start, col_stop) == (xmin, xmax)
+        assert row_start == (0 if ymax is None else full.yres - ymax)
+    elif crop_box[0] is not None:
+        # same as the cropped copy written by crop_tif
+        assert cropped.resolution[:2] == (43, 61)
+
+    # the cropped image is the matching window of the full image, in the
+    # same place
+    start = np.array([[col_start, full.yres - row_stop]])
+    assert np.allclose(full.pix2lonlat(start), cropped.pix2lonlat([[0, 0]]))
+    assert np.array_equal(
+        cropped.data(),
+        full.data()[col_start:col_stop, full.yres - row_stop:full.yres - row_start])
+
+    geoio.configure_crop(crop_box, pixel_coordinates)
+    try:
+        assert geoio.RasterioImageSource(cov).window == cropped.source.window
+    finally:
+        geoio.configure_crop(None)
+
+    with pytest.raises(ValueError):
+        geoio.RasterioImageSource(cov, (300, 0, 310, 10), True)
+
+
 def test_target_cropping(sirsam_target_path):
     crop_box = None, None, None, None
     coords, _, _ = geoio.load_shapefile(sirsam_target_path, 'Na_log', None, crop_box)
@@ -291,3 +362,227 @@ def test_target_cropping(sirsam_target_path):
 
     assert all(_in_crop_box(c) for c in coords)
 
+
+def test_dataset_pool_reuse(sirsam_covariate_paths, monkeypatch):
+    pool = geoio.DatasetPool(max_open=1)
+    monkeypatch.setattr(geoio, 'dataset_pool', pool)
+    cov_a, cov_b = sirsam_covariate_paths[:2]
+
+    src = geoio.RasterioImageSource(cov_a)
+    src.data(0, 10, 0, 10)
+    geoio.RasterioImageSource(cov_a).data(0, 5, 0, 5)
+    assert pool.misses == 1
+    assert pool.hits == 3
+
+    # Opening a second file evicts the least recently used handle
+    geoio.RasterioImageSource(cov_b)
+    assert len(pool) == 1
+    src.data(0, 10, 0, 10)
+    assert pool.misses == 3
+
+    # Borrowed handles are never evicted
+    with pool.dataset(cov_a) as ds_a:
+        with pool.dataset(cov_b):
+            assert len(pool) == 2
+        assert not ds_a.closed
+    assert len(pool) == 1
+
+    pool.close()
+    assert len(pool) == 0
+
+
+def test_dataset_pool_threads(sirsam_covariate_paths, monkeypatch):
+    import threading
+    pool = geoio.DatasetPool()
+    monkeypatch.setattr(geoio, 'dataset_pool', pool)
+    cov = sirsam_covariate_paths[0]
+    expected = geoio.RasterioImageSource(cov).data(0, 100, 0, 100)
+    barrier = threading.Barrier(2)
+    handles = {}
+    results = {}
+
+    def read(i):
+        with pool.dataset(cov) as ds:
+            handles[i] = ds
+            # both threads hold a handle to the file at the same time
+            barrier.wait()
+            results[i] = [geoio.RasterioImageSource(cov).data(0, 100, 0, 100)
+                          for _ in range(5)]
+            barrier.wait()
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert handles[0] is not handles[1]
+    for i in range(2):
+        for data in results[i]:
+            np.testing.assert_array_equal(data, expected)
+    pool.close()
+
+
+def test_dataset_pool_partitions(sirsam_covariate_paths, monkeypatch):
+    from types import SimpleNamespace
+    pool = geoio.DatasetPool()
+    monkeypatch.setattr(geoio, 'dataset_pool', pool)
+    monkeypatch.setattr(geoio, 'io_threads', 2)
+    paths = sirsam_covariate_paths[:4]
+    config = SimpleNamespace(feature_sets=[SimpleNamespace(files=paths)],
+                             n_subchunks=2, patchsize=0)
+
+    geoio.image_subchunks(0, config, log=False)
+    misses, hits = pool.misses, pool.hits
+    assert len(pool) == misses
+    # the next partition's new reader threads reuse the same handles
+    geoio.image_subchunks(1, config, log=False)
+    assert pool.misses == misses
+    assert pool.hits >= hits + 2 * len(paths)
+    pool.close()
+    assert len(pool) == 0
+
+
+@pytest.mark.parametrize('io_threads', [1, 4])
+def test_iterate_sources_threads(sirsam_covariate_paths, monkeypatch, io_threads):
+    from types import SimpleNamespace
+    monkeypatch.setattr(geoio, 'io_threads', io_threads)
+    paths = sirsam_covariate_paths
+    config = SimpleNamespace(feature_sets=[SimpleNamespace(files=paths[:5]),
+                                           SimpleNamespace(files=paths[5:])],
+                             patchsize=0, subsample_fraction=0.1)
+
+    results = geoio.unsupervised_feature_sets(config)
+    assert [list(r.keys()) for r in results] == \
+        [sorted(os.path.basename(p) for p in fs.files)
+         for fs in config.feature_sets]
+    for fs, r in zip(config.feature_sets, results):
+        for path in fs.files:
+            # the same rows are sampled from every file
+            src = geoio.RasterioImageSource(path)
+            x = geoio.features.extract_subchunks(src, 0, 1, 0)
+            x = x[np.random.RandomState(1).rand(x.shape[0]) < 0.1]
+            assert np.all(r[os.path.basename(path)] == x)
+
+
+def test_cached_point_features(sirsam_covariate_paths, tmpdir, monkeypatch):
+    from uncoverml import features, targets
+    cov = str(tmpdir.join('cov.tif'))
+    with open(sirsam_covariate_paths[0], 'rb') as src, open(cov, 'wb') as dst:
+        dst.write(src.read())
+    src = geoio.RasterioImageSource(cov)
+    img = Image(src)
+    rnd = np.random.RandomState(1)
+    xy = np.column_stack((rnd.randint(0, img.xres, 50),
+                          rnd.randint(0, img.yres, 50)))
+    lonlat = img.pix2lonlat(xy) + 0.5 * np.array([img.pixsize_x, img.pixsize_y])
+    t = targets.Targets(lonlat, np.zeros(len(lonlat)))
+    cache_dir = str(tmpdir.join('cache'))
+
+    calls = []
+    extract = features.extract_point_features
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return extract(*args, **kwargs)
+    monkeypatch.setattr(features, 'extract_point_features', counted)
+
+    first = geoio.cached_point_features(src, t, 0, cache_dir)
+    second = geoio.cached_point_features(src, t, 0, cache_dir)
+    assert len(calls) == 1
+    assert np.all(first.data == second.data)
+    assert np.all(np.ma.getmaskarray(first) == np.ma.getmaskarray(second))
+
+    # a different patchsize, different targets or a modified file miss
+    geoio.cached_point_features(src, t, 1, cache_dir)
+    t2 = targets.Targets(lonlat[:10], np.zeros(10))
+    geoio.cached_point_features(src, t2, 0, cache_dir)
+    stat = os.stat(cov)
+    os.utime(cov, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    geoio.cached_point_features(src, t, 0, cache_dir)
+    assert len(calls) == 4
+
+
+def test_training_store(tmpdir):
+    from uncoverml import targets
+    rnd = np.random.RandomState(1)
+    x = np.ma.MaskedArray(rnd.randn(20, 3), mask=rnd.rand(20, 3) < 0.2)
+    fields = {'weight': rnd.rand(20),
+              'name': np.array(['t{}'.format(i) for i in range(20)], dtype=object)}
+    t = targets.Targets(rnd.rand(20, 2), rnd.randn(20), othervals=fields)
+    keep = rnd.rand(20) < 0.7
+
+    store = str(tmpdir.join('store'))
+    training_data = geoio.write_training_store(store, t, x, keep)
+    for data in (training_data, geoio.open_training_store(store)):
+        assert np.all(data.x_all.data == x.data[keep])
+        assert np.all(data.x_all.mask == x.mask[keep])
+        assert np.all(data.targets_all.observations == t.observations[keep])
+        assert np.all(data.targets_all.positions == t.positions[keep])
+        assert np.all(data.targets_all.fields['weight'] == fields['weight'][keep])
+        assert list(data.targets_all.fields['name']) == list(fields['name'][keep])
+        assert not data.x_all.data.flags.writeable
+    geoio.deallocate_shared_training_data(training_data)
+
+
+@pytest.mark.parametrize('min_block_size', [1, 16, 256])
+def test_point_features_match_strips(sirsam_covariate_paths, min_block_size):
+    from uncoverml import features, targets
+    src = geoio.RasterioImageSource(sirsam_covariate_paths[0])
+    img = Image(src)
+    rnd = np.random.RandomState(1)
+    xy = np.column_stack((rnd.randint(0, img.xres, 200),
+                          rnd.randint(0, img.yres, 200)))
+    lonlat = img.pix2lonlat(xy) + 0.5 * np.array([img.pixsize_x, img.pixsize_y])
+    ordind = np.lexsort(lonlat.T)
+    t = targets.Targets(lonlat[ordind], np.zeros(len(lonlat)))
+
+    strips = features.extract_features(src, t, n_subchunks=3, patchsize=0)
+    points = features.extract_point_features(src, t, patchsize=0,
+                                             min_block_size=min_block_size)
+    assert points.shape == strips.shape
+    assert np.all(points.data == strips.data)
+    assert np.all(points.mask == strips.mask)
+
+
+def test_point_features_patch_edges(array_image_src):
+    from uncoverml import features, targets
+    img = Image(array_image_src)
+    xy = np.array([[0, 0], [10, 20], [999, 499]])
+    lonlat = img.pix2lonlat(xy) + 1e-6
+    t = targets.Targets(lonlat, np.zeros(3))
+    x = features.extract_point_features(array_image_src, t, patchsize=1,
+                                        min_block_size=64)
+    assert x.shape == (3, 3, 3, 2)
+    data = array_image_src._data
+    assert np.all(x[1] == data[9:12, 19:22])
+    # Corners of the image have masked patch pixels outside the image
+    assert np.all(x.mask[0, 0, :]) and np.all(x.mask[0, :, 0])
+    assert np.all(x[0, 1:, 1:] == data[0:2, 0:2])
+    assert np.all(x.mask[2, 2, :]) and not x.mask[2, 1, 1].any()
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_image_writer(tmpdir, parallel):
+    res_x, res_y, n_subchunks = 20, 15, 3
+    bbox = np.array([[0., 10.], [-5., 10.]])
+    outpath = os.path.join(str(tmpdir), 'pred_{}.tif')
+    writer = geoio.ImageWriter((res_x, res_y, 2), bbox, crs, n_subchunks,
+                               outpath, 2, band_tags=['Prediction', 'Variance'],
+                               parallel=parallel)
+    data = np.random.rand(res_x, res_y, 2).astype(np.float32)
+    mask = np.zeros_like(data, dtype=bool)
+    mask[3, 4] = True
+    for i, rows in enumerate(np.array_split(np.arange(res_y), n_subchunks)):
+        x = np.ma.masked_array(data[:, rows], mask=mask[:, rows])
+        writer.write(x.reshape(-1, 2), i)
+    writer.close()
+
+    assert not os.path.exists(os.path.join(str(tmpdir), 'pred_parts'))
+    for band, tag in enumerate(['prediction', 'variance']):
+        with rasterio.open(outpath.format(tag)) as f:
+            out = f.read(1)
+            assert f.tags(1)['image_type'] in ('Prediction', 'Variance')
+        expected = np.where(mask[:, :, band], geoio.ImageWriter.nodata_value,
+                            data[:, :, band]).T
+        assert np.all(out == expected)
@@ -156,3 +156,53 @@ def test_apply_multiple_masked(masked_data):
     yr = apply_multiple_masked(predict, (Xt, yt_masked))
     assert np.ma.all(yt_masked == yr)
     assert apply_multiple_masked(fit, (Xt, yt_masked)) is None
+
+
+@pytest.mark.parametrize('transform', ['log', 'sqrt', 'logistic', 'rank'])
+def test_quadrature_moments(transform):
+    from scipy.integrate import fixed_quad
+    from uncoverml.models import _quadrature_moments, _normpdf, QUADORDER
+    from uncoverml.transforms import target
+
+    rnd = np.random.RandomState(1)
+    y = rnd.rand(200) + 0.1
+    trans = target.transforms[transform]()
+    trans.fit(y)
+    y_t = trans.transform(y)
+    Ey_t = rnd.choice(y_t, 50)
+    Vy_t = (0.1 * rnd.rand(50) * np.std(y_t)) ** 2
+
+    Ey, Vy = _quadrature_moments(trans, Ey_t, Vy_t, chunk_size=16)
+
+    def expec(x, mu, std):
+        return trans.itransform(x) * _normpdf(x, mu, std)
+
+    def var(x, Ex, mu, std):
+        return (trans.itransform(x) - Ex) ** 2 * _normpdf(x, mu, std)
+
+    for i, (mu, v) in enumerate(zip(Ey_t, Vy_t)):
+        std = np.sqrt(v)
+        a, b = mu - 3 * std, mu + 3 * std
+        Ei, _ = fixed_quad(expec, a, b, n=QUADORDER, args=(mu, std))
+        Vi, _ = fixed_quad(var, a, b, n=QUADORDER, args=(Ei, mu, std))
+        assert np.isclose(Ey[i], Ei)
+        assert np.isclose(Vy[i], Vi)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_ensemble_moments(n_jobs):
+    from uncoverml.models import _ensemble_moments, RandomForestRegressor
+    rnd = np.random.RandomState(1)
+    X = rnd.randn(300, 4)
+    y = X[:, 0] + rnd.randn(300)
+    rf = RandomForestRegressor(n_estimators=7, n_jobs=n_jobs, random_state=1)
+    rf.fit(X, y)
+    y_trees = np.array([dt.predict(X) for dt in rf.estimators_]).T
+
+    Ey, Vy = _ensemble_moments(rf.estimators_, X, n_jobs, chunk_size=64)
+    assert np.allclose(Ey, y_trees.mean(axis=1))
+    assert np.allclose(Vy, y_trees.var(axis=1))
+
+    Ey, Vy, _, _ = rf.predict_dist(X)
+    assert np.allclose(Ey, rf.predict(X))
+    assert np.allclose(Vy, y_trees.var(axis=1))
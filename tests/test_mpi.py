@@ -66,6 +66,18 @@ def test_covariance(mpisync, masked_array):
     assert np.allclose(c_true, c)
 
 
+def test_moments_empty_node(mpisync, masked_array):
+    x, x_all = masked_array
+    # the last node contributes no rows
+    partial = None if mpiops.chunk_index == mpiops.chunks - 1 \
+        and mpiops.chunks > 1 else mpiops._local_moments(x, True)
+    n, mean, _, _ = mpiops.reduce_moments(partial, cross=True)
+    rows = mpiops.comm.allgather(x if partial is not None else x[:0])
+    x_used = np.ma.concatenate(rows, axis=0)
+    assert np.array_equal(n, x_used.count(axis=0))
+    assert np.allclose(mean, np.ma.mean(x_used, axis=0).data)
+
+
 class DummySettings:
     def __init__(self):
         pass
@@ -94,3 +106,34 @@ def test_random_full_points():
     Xp = mpiops.random_full_points(X, 200)
 
     assert Xp.shape[0] <= 100
+
+
+@pytest.mark.parametrize('masked', [True, False])
+def test_create_shared_array(mpisync, masked):
+    rnd = np.random.RandomState(1)
+    data = rnd.randn(50, 3).astype(np.float32)
+    mask = rnd.rand(50, 3) < 0.2
+    x = np.ma.MaskedArray(data=data, mask=mask) if masked else data
+
+    shared, win = mpiops.create_shared_array(
+        x if mpiops.chunk_index == 0 else None)
+    assert np.array_equal(np.ma.getdata(shared), data)
+    assert shared.dtype == data.dtype
+    if masked:
+        assert np.array_equal(np.ma.getmaskarray(shared), mask)
+    else:
+        assert not np.ma.isMaskedArray(shared)
+    if mpiops.chunk_index == 0:
+        assert not shared.flags.writeable
+    shared = None
+    mpiops.comm.barrier()
+    win.Free()
+
+
+def test_task_counter(mpisync):
+    counter = mpiops.TaskCounter()
+    mine = [counter.next() for _ in range(5)]
+    counter.free()
+    claimed = np.concatenate(mpiops.comm.allgather(mine))
+    assert np.array_equal(np.sort(claimed), np.arange(5 * mpiops.chunks))
+    assert mine == sorted(mine)
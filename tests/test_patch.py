@@ -23,3 +23,39 @@ def test_point_patches(make_points):
     patches = np.array(list(patch.point_patches(timg, pwidth, points)))
 
     assert np.allclose(patches, tpatch)
+
+
+def test_grid_patch_view():
+    img = np.arange(60.).reshape(5, 4, 3)
+    patches = patch.grid_patches(img, 0)
+    assert patches.shape == (20, 1, 1, 3)
+    assert np.shares_memory(patches, img)
+    assert np.all(patches[:, 0, 0] == img.reshape(-1, 3))
+
+
+@pytest.mark.parametrize('max_patches', [1, 7, 1000])
+def test_iter_grid_patches(max_patches):
+    img = np.random.RandomState(1).rand(9, 8, 2)
+    expected = patch.grid_patches(img, 1)
+    blocks = list(patch.iter_grid_patches(img, 1, max_patches))
+    assert np.all(np.concatenate([b for _, b in blocks]) == expected)
+    assert [s for s, _ in blocks] == \
+        list(np.cumsum([0] + [len(b) for _, b in blocks])[:-1])
+    for _, b in blocks:
+        assert len(b) <= max(max_patches, 6)
+
+
+def test_all_patches_nomask():
+    from uncoverml.geoio import ArrayImageSource
+    from uncoverml.image import Image
+    data = np.arange(24.).reshape(4, 6, 1)
+    src = ArrayImageSource(np.ma.MaskedArray(data), np.array([0., 0.]),
+                           'WGS84', np.array([1., 1.]))
+    x = patch.all_patches(Image(src), 0)
+    assert x.mask is np.ma.nomask
+    assert np.all(x.data[:, 0, 0, 0] == data.ravel())
+
+    src = ArrayImageSource(np.ma.masked_equal(data, 5.), np.array([0., 0.]),
+                           'WGS84', np.array([1., 1.]))
+    x = patch.all_patches(Image(src), 0)
+    assert x.mask.sum() == 1 and x.mask[5, 0, 0, 0]
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from uncoverml import geoio, predict
+
+
+def test_prefetch_partitions(sirsam_covariate_paths):
+    config = SimpleNamespace(
+        feature_sets=[SimpleNamespace(files=sirsam_covariate_paths[:3])],
+        patchsize=0, n_subchunks=3)
+    timings = {}
+
+    prefetched = list(predict._prefetch_partitions(config, 1, timings))
+    assert [i for i, _ in prefetched] == [0, 1, 2]
+    for i, chunk_sets in prefetched:
+        expected = geoio.image_subchunks(i, config)
+        assert list(chunk_sets[0].keys()) == list(expected[0].keys())
+        for k, v in expected[0].items():
+            assert np.all(chunk_sets[0][k] == v)
+    assert timings['read'] > 0
+
+
+def test_prefetch_partitions_error(monkeypatch):
+    config = SimpleNamespace(n_subchunks=3)
+
+    def image_subchunks(i, config, log=True):
+        if i == 1:
+            raise IOError('unreadable')
+        return i
+
+    monkeypatch.setattr(geoio, 'image_subchunks', image_subchunks)
+    partitions = predict._prefetch_partitions(config, 2, {})
+    assert next(partitions) == (0, 0)
+    with pytest.raises(IOError):
+        next(partitions)
+
+
+def test_render_partitions_lon_lat_imputers(monkeypatch):
+    config = SimpleNamespace(n_subchunks=2)
+    calls = []
+
+    def render_partition(model, i, image_out, config, chunk_sets, timings,
+                         lon_lat_imputers):
+        calls.append(lon_lat_imputers)
+        lon_lat_imputers.setdefault('lat.tif', i)
+
+    monkeypatch.setattr(predict, 'render_partition', render_partition)
+    for _ in range(2):
+        predict.render_partitions(None, None, config)
+
+    # the partitions of one call share the imputers, other calls do not
+    assert calls[0] is calls[1] and calls[2] is calls[3]
+    assert calls[0] is not calls[2]
+    assert calls[2] == {'lat.tif': 0}
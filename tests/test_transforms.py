@@ -1,6 +1,6 @@
 from scipy.stats import bernoulli
 
-from uncoverml.transforms.onehot import sets
+from uncoverml.transforms.onehot import sets, one_hot
 from uncoverml.transforms.impute import (GaussImputer,
                                          NearestNeighboursImputer, MeanImputer)
 from uncoverml.transforms.linear import (CentreTransform, StandardiseTransform,
@@ -271,12 +271,107 @@ def test_WhitenTransform_caching(make_random_data):
     x_zero_white = whitener(x_zero)
 
     # Compute the transformation
-    trans = x_zero_white.dot( np.linalg.pinv(x_zero) )
+    trans = np.linalg.pinv(x_zero).dot(x_zero_white)
 
     # Verify that the whitener applies the same transformation
     x_produced = whitener(x)
-    x_trans = trans.dot(x_produced)
-    x_expected = trans.dot(x)
+    x_expected = x.dot(trans)
 
-    assert np.all(np.equal(x_trans, x_expected))
+    assert np.allclose(x_produced, x_expected)
 
+
+
+def test_NearestNeighbourImputer_batched(make_missing_data):
+    X = make_missing_data
+    imputer = NearestNeighboursImputer(nodes=100, k=3, chunk_size=7)
+    Ximp = imputer(X.copy())
+
+    # reference: average the neighbours of each row one at a time
+    missing = np.ma.count_masked(X, axis=1) > 0
+    tree = imputer.kdtree
+    expected = X.data.copy()
+    for i in np.flatnonzero(missing):
+        _, ind = tree.query(X.data[i], k=3)
+        expected[i, X.mask[i]] = tree.data[ind].mean(axis=0)[X.mask[i]]
+    assert np.allclose(Ximp.data, expected)
+
+    # the tree is kept for later calls
+    imputer(X.copy())
+    assert imputer.kdtree is tree
+
+
+def test_GaussImputer_conditional(make_missing_data):
+    from scipy.linalg import solve
+
+    X = make_missing_data
+    imputer = GaussImputer(cache_size=1)
+    Ximp = imputer(X.copy())
+
+    # reference: condition the Gaussian on the observed values row by row
+    expected = X.data.copy()
+    for i in np.flatnonzero(np.ma.getmaskarray(X).any(axis=1)):
+        a = X.mask[i]
+        b = ~a
+        Laa = imputer.prec[np.ix_(a, a)]
+        Lab = imputer.prec[np.ix_(a, b)]
+        expected[i, a] = imputer.mean[a] - \
+            solve(Laa, Lab.dot(X.data[i, b] - imputer.mean[b]))
+    assert np.allclose(Ximp.data, expected)
+    assert len(imputer._conditionals) == 1
+
+    # later calls reuse the statistics and give the same result
+    assert np.allclose(imputer(X.copy()).data, expected)
+
+
+@pytest.mark.parametrize('project', [False, True])
+def test_one_hot(project):
+    rnd = np.random.RandomState(SEED)
+    data = rnd.randint(0, 6, size=(40, 3, 3, 2))
+    x = np.ma.MaskedArray(data, mask=rnd.rand(*data.shape) < 0.1)
+    # value 5 is missing from the sets so it is encoded as zeros
+    x_set = [np.arange(5), np.array([0, 2, 4])]
+    matrices = [rnd.randn(len(k), 4) for k in x_set] if project else None
+
+    out = one_hot(x, x_set, matrices, dtype=np.float32)
+
+    # reference: set each value of each channel in turn
+    dims = [4, 4] if project else [len(k) for k in x_set]
+    expected = np.zeros(data.shape[:3] + (sum(dims),), dtype=np.float32)
+    start = 0
+    for d, (dim_set, n) in enumerate(zip(x_set, dims)):
+        dim_out = expected[..., start:start + n]
+        for i, val in enumerate(dim_set):
+            if project:
+                dim_out[data[..., d] == val] = matrices[d][i]
+            else:
+                dim_out[..., i][data[..., d] == val] = 0.5
+        assert np.all(out.mask[..., start:start + n] ==
+                      x.mask[..., d:d + 1])
+        start += n
+    assert out.dtype == np.float32
+    assert np.array_equal(out.data, expected)
+
+
+def test_TransformSet_accumulate(make_missing_data):
+    from uncoverml.transforms import TransformSet
+    X = make_missing_data
+    x_log = np.ma.MaskedArray(X.data + 5., mask=X.mask)
+
+    def transform_set():
+        return TransformSet(GaussImputer(), [LogTransform(),
+                                             StandardiseTransform(),
+                                             WhitenTransform(keep_fraction=1.)])
+
+    # fitted on all of the data at once
+    expected = transform_set()(x_log.copy())
+
+    # fitted on the data in pieces, one transform per pass
+    ts = transform_set()
+    passes = 0
+    while not ts.fitted:
+        for chunk in np.array_split(np.arange(len(X)), 7):
+            ts.accumulate(x_log[chunk].copy())
+        ts.finalise()
+        passes += 1
+    assert passes == 4
+    assert np.allclose(ts(x_log.copy()), expected)
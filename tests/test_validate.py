@@ -0,0 +1,40 @@
+import itertools
+import threading
+
+import numpy as np
+import pytest
+
+from uncoverml import validate
+
+
+def test_fold_indices():
+    _, cv_assigns = validate.split_cfold(103, 5, seed=1)
+    folds = validate.fold_indices(cv_assigns, 5)
+    assert len(folds) == 5
+    for k, (train, test) in enumerate(folds):
+        assert np.array_equal(train, np.flatnonzero(cv_assigns != k))
+        assert np.array_equal(test, np.flatnonzero(cv_assigns == k))
+
+
+@pytest.mark.parametrize('n_threads', [1, 3])
+def test_schedule(n_threads):
+    claimers = set()
+
+    def claim(counter=itertools.count()):
+        claimers.add(threading.get_ident())
+        return next(counter)
+
+    results = validate._schedule(lambda task: task ** 2, 7, claim, n_threads)
+    assert results == {k: k ** 2 for k in range(7)}
+    # tasks are only claimed from the calling thread
+    assert claimers == {threading.get_ident()}
+
+
+def test_schedule_error():
+    def run(task):
+        if task == 2:
+            raise ValueError('fold failed')
+        return task
+
+    with pytest.raises(ValueError):
+        validate._schedule(run, 4, itertools.count().__next__, 2)
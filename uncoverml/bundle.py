@@ -0,0 +1,214 @@
+"""
+Model bundles: a directory format for trained models that loads quickly
+on many nodes.
+
+A bundle holds a manifest, the pickled model with its feature sets and
+final transform, and every large numpy array of the model as a raw .npy
+file. The arrays are memory mapped when the bundle is loaded, so only the
+pages that are used are read and nodes on the same host share them
+through the page cache. The members of bootstrapped models are pickled
+separately and only loaded when they are first used, e.g. when
+predicting with fewer members than were trained.
+"""
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Sequence
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+FORMAT = 1
+MANIFEST = 'manifest.json'
+MODEL = 'model.pk'
+ARRAYS = 'arrays'
+MEMBERS = 'members'
+
+MIN_ARRAY_BYTES = 1 << 16
+"""int: arrays smaller than this are pickled with the object holding them.
+"""
+
+
+class _BundlePickler(pickle.Pickler):
+    """
+    Pickles large arrays to separate .npy files, and the `members` list
+    (if any) as a reference to the member files.
+    """
+    def __init__(self, file, directory, prefix, members=None):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._directory = directory
+        self._prefix = prefix
+        self._members = members
+        self._arrays = {}
+        self._keep = []
+
+    def persistent_id(self, obj):
+        if self._members is not None and obj is self._members:
+            return 'members', len(obj)
+        if type(obj) in (np.ndarray, np.memmap) and not obj.dtype.hasobject \
+                and obj.nbytes >= MIN_ARRAY_BYTES:
+            name = self._arrays.get(id(obj))
+            if name is None:
+                name = '{}_{}.npy'.format(self._prefix, len(self._arrays))
+                np.save(os.path.join(self._directory, ARRAYS, name),
+                        np.asarray(obj))
+                self._arrays[id(obj)] = name
+                # ids are only unique while the objects are alive
+                self._keep.append(obj)
+            return 'array', name
+        return None
+
+
+class _BundleUnpickler(pickle.Unpickler):
+    def __init__(self, file, directory, mmap_mode):
+        super().__init__(file)
+        self._directory = directory
+        self._mmap_mode = mmap_mode
+
+    def persistent_load(self, pid):
+        kind, value = pid
+        if kind == 'array':
+            return np.load(os.path.join(self._directory, ARRAYS, value),
+                           mmap_mode=self._mmap_mode)
+        if kind == 'members':
+            return LazyMembers(self._directory, value, self._mmap_mode)
+        raise pickle.UnpicklingError('Unknown bundle reference {}'.format(kind))
+
+
+def _dump(obj, filename, directory, prefix, members=None):
+    with open(filename, 'wb') as f:
+        pickler = _BundlePickler(f, directory, prefix, members)
+        pickler.dump(obj)
+    return len(pickler._arrays)
+
+
+def _load(filename, directory, mmap_mode):
+    with open(filename, 'rb') as f:
+        return _BundleUnpickler(f, directory, mmap_mode).load()
+
+
+class LazyMembers(Sequence):
+    """
+    The members of a bootstrapped model in a bundle, each loaded when it
+    is first accessed. Pickles as a plain list.
+    """
+    def __init__(self, directory, n_members, mmap_mode='c'):
+        self._directory = directory
+        self._n_members = n_members
+        self._mmap_mode = mmap_mode
+        self._loaded = {}
+
+    def __len__(self):
+        return self._n_members
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('member index out of range')
+        if i not in self._loaded:
+            filename = os.path.join(self._directory, MEMBERS,
+                                    'member_{}.pk'.format(i))
+            self._loaded[i] = _load(filename, self._directory, self._mmap_mode)
+        return self._loaded[i]
+
+    @property
+    def n_loaded(self):
+        """Number of members loaded so far."""
+        return len(self._loaded)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def _members(model):
+    # bootstrapped models hold their members in a list
+    if hasattr(model, '__bootstrapped_model__'):
+        return model.models
+    return None
+
+
+def is_bundle(path):
+    """Whether `path` is a model bundle."""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def save_bundle(path, model, feature_sets, final_transform):
+    """
+    Save a model with its feature sets and final transform as a bundle.
+    The bundle is written next to `path` and then moved into place,
+    replacing any model already there.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the bundle.
+    model : object
+        The trained model.
+    feature_sets : list
+        The feature sets of the config, holding the fitted transform
+        sets.
+    final_transform : object
+        The fitted final transform.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp = tempfile.mkdtemp(prefix='.bundle_', dir=parent)
+    try:
+        os.makedirs(os.path.join(tmp, ARRAYS))
+        members = _members(model)
+        n_arrays = 0
+        if members is not None:
+            os.makedirs(os.path.join(tmp, MEMBERS))
+            for i, m in enumerate(members):
+                n_arrays += _dump(m, os.path.join(tmp, MEMBERS, 'member_{}.pk'.format(i)),
+                                  tmp, 'member_{}'.format(i))
+        n_arrays += _dump((model, feature_sets, final_transform),
+                          os.path.join(tmp, MODEL), tmp, 'model', members)
+        manifest = dict(format=FORMAT, model=type(model).__name__,
+                        members=None if members is None else len(members),
+                        arrays=n_arrays)
+        with open(os.path.join(tmp, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    _logger.info("Saved model bundle {} ({} arrays)".format(path, n_arrays))
+
+
+def load_bundle(path, mmap_mode='c'):
+    """
+    Load a bundle written by :func:`save_bundle`.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the bundle.
+    mmap_mode : str, optional
+        Passed to `numpy.load` for the arrays. The default, 'c', maps
+        them copy-on-write so that a model can still modify them in
+        memory. None reads them into memory.
+
+    Returns
+    -------
+    tuple
+        The model, feature sets and final transform.
+    """
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest['format'] > FORMAT:
+        raise ValueError("Model bundle {} has format {}, this version of "
+                         "uncoverml reads up to format {}"
+                         .format(path, manifest['format'], FORMAT))
+    return _load(os.path.join(path, MODEL), path, mmap_mode)
@@ -1,4 +1,5 @@
 import logging
+import time
 
 import numpy as np
 import scipy.spatial
@@ -102,6 +103,36 @@ class KMeans:
                                 training_data=training_data)
         self.centres = C_final
 
+    def learn_minibatch(self, x, batches, max_epochs=10, tolerance=1e-4):
+        """
+        Find the cluster centres with streaming mini-batch k-means
+
+        The centres are initialised with k-means|| on `x`, then refined by
+        passing over the batches, so only one batch needs to be held in
+        memory at a time.
+
+        Parameters
+        ----------
+        x : ndarray
+            (n_samples, n_dimensions) array of a sample of the data, used
+            to initialise the centres
+        batches : callable
+            Returns an iterable of (n_i, n_dimensions) arrays that together
+            cover the data. Every node must yield the same number of
+            batches.
+        max_epochs : int > 0
+            The maximum number of passes over the batches
+        tolerance : float
+            Stop once no centre moves further than this over an epoch
+        """
+        log.info("No class labels found. Using unsupervised mini-batch "
+                 "k-means")
+        C_init = initialise_centres(x, self.k, self.oversample_factor)
+        log.info("Initialising mini-batch K-means with k-means|| output")
+        self.centres = run_minibatch_kmeans(batches, C_init,
+                                            max_epochs=max_epochs,
+                                            tolerance=tolerance)
+
     def predict(self, x, *args, **kwargs):
         y_star, _ = compute_class(x, self.centres)
         # y_star = y_star[:, np.newaxis].astype(float)
@@ -141,6 +172,135 @@ def kmean_distance2(x, C):
     return d2_x
 
 
+def nearest_centre(x, C):
+    """Find the nearest cluster centre for each x, without communication
+
+    Parameters
+    ----------
+    x : ndarray
+        (n, d) array of n d-dimensional points
+    C : ndarray
+        (k, d) array of k cluster centres
+
+    Returns
+    -------
+    classes : ndarray
+        (n,) int array of the index of the nearest centre to each x
+    d2_x : ndarray
+        (n,) array of squared distances from each x to that centre
+    """
+    nsplits = max(1, int(x.shape[0]/distance_partition_size))
+    splits = np.array_split(x, nsplits)
+    classes = np.empty(x.shape[0], dtype=int)
+    d2_x = np.empty(x.shape[0])
+    idx = 0
+    for x_i in splits:
+        n_i = x_i.shape[0]
+        D2_x = scipy.spatial.distance.cdist(x_i, C, metric='sqeuclidean')
+        classes[idx:idx + n_i] = np.argmin(D2_x, axis=1)
+        d2_x[idx:idx + n_i] = D2_x[np.arange(n_i), classes[idx:idx + n_i]]
+        idx += n_i
+    return classes, d2_x
+
+
+def _split_cost(d2_x):
+    """Cost of an assignment as computed by compute_class"""
+    nsplits = max(1, int(d2_x.shape[0]/distance_partition_size))
+    return sum(np.mean(d) for d in np.array_split(d2_x, nsplits))
+
+
+class BoundedAssignment:
+    """
+    Nearest-centre assignment of a fixed set of points to moving centres
+
+    Keeps a lower bound on the distance from each point to its second
+    nearest centre and, when the centres move, only searches all centres
+    for the points whose distance to their current centre exceeds that
+    bound or half the distance from their centre to the nearest other
+    centre (Hamerly's algorithm [1]). The distance to the current centre
+    is recomputed exactly for every point, so the cost is exact. Late in
+    k-means, when few points change cluster, most of the distance
+    evaluations are skipped.
+
+    Parameters
+    ----------
+    X : ndarray
+        (n, d) array of points
+    C : ndarray
+        (k, d) array of initial cluster centres
+
+    References
+    ----------
+    .. [1] Hamerly, Greg. "Making k-means even faster." Proceedings of the
+    2010 SIAM international conference on data mining (2010): 130-140.
+    """
+    def __init__(self, X, C):
+        self.X = X
+        self.C = np.array(C, dtype=float)
+        self.classes = np.empty(X.shape[0], dtype=int)
+        self.lower = np.empty(X.shape[0])
+        self.d2_x = self._search(np.arange(X.shape[0]))
+        self.n_searched = X.shape[0]
+
+    def _search(self, indices):
+        # Find the nearest centre to X[indices] and the distance to the
+        # second nearest, returning the squared distance to the nearest
+        nsplits = max(1, int(indices.shape[0]/distance_partition_size))
+        d2_x = np.empty(indices.shape[0])
+        idx = 0
+        for ind in np.array_split(indices, nsplits):
+            n_i = ind.shape[0]
+            D2_x = scipy.spatial.distance.cdist(self.X[ind], self.C,
+                                                metric='sqeuclidean')
+            classes_i = np.argmin(D2_x, axis=1)
+            rows = np.arange(n_i)
+            d2_x[idx:idx + n_i] = D2_x[rows, classes_i]
+            D2_x[rows, classes_i] = np.inf
+            self.classes[ind] = classes_i
+            self.lower[ind] = np.sqrt(np.amin(D2_x, axis=1, initial=np.inf))
+            idx += n_i
+        return d2_x
+
+    def update(self, C):
+        """
+        Move the centres and reassign the points
+
+        Parameters
+        ----------
+        C : ndarray
+            (k, d) array of the new cluster centres
+
+        Returns
+        -------
+        classes : ndarray
+            (n,) int array of class assignments (0..k-1) for each x in X
+        cost : float
+            The total 'cost' of the assignment, as in compute_class
+        """
+        C = np.array(C, dtype=float)
+        shift = np.sqrt(np.sum((C - self.C)**2, axis=1))
+        self.C = C
+        self.lower -= np.amax(shift, initial=0.)
+
+        # half the distance from each centre to its nearest neighbour
+        D_c = scipy.spatial.distance.cdist(C, C)
+        np.fill_diagonal(D_c, np.inf)
+        half = 0.5 * np.amin(D_c, axis=1, initial=np.inf)
+
+        d2_x = np.empty(self.X.shape[0])
+        nsplits = max(1, int(self.X.shape[0]/distance_partition_size))
+        for ind in np.array_split(np.arange(self.X.shape[0]), nsplits):
+            d2_x[ind] = np.sum((self.X[ind] - C[self.classes[ind]])**2, axis=1)
+        bound = np.maximum(half[self.classes], self.lower)
+        search = np.flatnonzero(np.sqrt(d2_x) > bound)
+        d2_x[search] = self._search(search)
+        self.d2_x = d2_x
+        self.n_searched = search.shape[0]
+
+        cost = mpiops.comm.allreduce(_split_cost(d2_x))
+        return self.classes.copy(), cost
+
+
 def compute_weights(x, C):
     """Number of points in x assigned to each centre c in C
 
@@ -393,7 +553,9 @@ def run_kmeans(X, C, k, weights=None, training_data=None, max_iterations=1000):
 
     This is a distributed implementation of Johnson's algorithm that performs
     a convex optimization to find the locally optimal assignment of points
-    and cluster centres. It depends heavily on the inital cluster centres C
+    and cluster centres. It depends heavily on the inital cluster centres C.
+    Points are reassigned with a BoundedAssignment, so only the points that
+    may have changed cluster are compared against every centre.
 
     Parameters
     ----------
@@ -420,14 +582,23 @@ def run_kmeans(X, C, k, weights=None, training_data=None, max_iterations=1000):
     classes : ndarray
         (n,) array of class assignments (0..k-1) for each x in X
     """
-    classes, cost = compute_class(X, C, training_data)
+    assignment = BoundedAssignment(X, C)
+    classes = assignment.classes.copy()
+    # force assignment of the training data
+    if training_data:
+        classes[training_data.indices] = training_data.classes
     for i in range(max_iterations):
+        start = time.time()
         C_new = kmeans_step(X, C, classes, weights=weights)
-        classes_new, cost = compute_class(X, C_new)
+        classes_new, cost = assignment.update(C_new)
         delta_local = np.sum(classes != classes_new)
-        delta = mpiops.comm.allreduce(delta_local, op=mpiops.MPI.SUM)
-        log.info("kmeans it: {}\tcost:{:.3f}\tdelta: {}".format(
-            i, cost, delta))
+        delta, searched, n = mpiops.comm.allreduce(
+            np.array([delta_local, assignment.n_searched, X.shape[0]]),
+            op=mpiops.MPI.SUM)
+        log.info("kmeans it: {}\tcost:{:.3f}\tdelta: {}\tsearched: {:.1f}%"
+                 "\ttime: {:.2f}s".format(i, cost, delta,
+                                          100 * searched / max(n, 1),
+                                          time.time() - start))
         C = C_new
         classes = classes_new
         if delta == 0:
@@ -435,6 +606,69 @@ def run_kmeans(X, C, k, weights=None, training_data=None, max_iterations=1000):
     return C, classes
 
 
+def run_minibatch_kmeans(batches, C, max_epochs=10, tolerance=1e-4):
+    """Cluster a stream of batches of points using mini-batch K-means
+
+    Each batch moves every centre towards the centroid of its members in
+    the batch, with a step size of the batch members over all members seen
+    so far, i.e. each centre stays the running mean of the points assigned
+    to it [1]. The batches come from the data on every node, so each
+    update costs a single reduction of the per-centre sums and counts.
+
+    Parameters
+    ----------
+    batches : callable
+        Returns an iterable of local (n_i, d) arrays of points. It is called
+        once per epoch, and every node must yield the same number of
+        batches (which may be empty).
+    C : ndarray
+        (k, d) array of initial cluster centres
+    max_epochs : int > 0 (optional)
+        The maximum number of passes over the batches
+    tolerance : float (optional)
+        The algorithm stops after an epoch in which no centre moved further
+        than this
+
+    Returns
+    -------
+    C : ndarray
+        (k, d) array of final cluster centres, ordered (0..k-1)
+
+    References
+    ----------
+    .. [1] Sculley, D. "Web-scale k-means clustering." Proceedings of the
+    19th international conference on World wide web (2010): 1177-1178.
+    """
+    C = np.array(C, dtype=float)
+    k, d = C.shape
+    seen = np.zeros(k)
+    for i in range(max_epochs):
+        C_start = C.copy()
+        local_cost = 0.
+        local_count = 0
+        for x in batches():
+            classes, d2_x = nearest_centre(x, C)
+            local_cost += np.sum(d2_x)
+            local_count += x.shape[0]
+            local_stats = np.column_stack(
+                [np.bincount(classes, weights=x_j, minlength=k) for x_j in x.T]
+                + [np.bincount(classes, minlength=k)]).astype(float)
+            stats = mpiops.comm.allreduce(local_stats, op=mpiops.MPI.SUM)
+            sums, counts = stats[:, :d], stats[:, d]
+            seen += counts
+            hit = counts > 0
+            C[hit] += ((sums[hit] - counts[hit, np.newaxis] * C[hit]) /
+                       seen[hit, np.newaxis])
+        shift = np.sqrt(np.amax(np.sum((C - C_start)**2, axis=1)))
+        cost, count = mpiops.comm.allreduce(
+            np.array([local_cost, local_count]), op=mpiops.MPI.SUM)
+        log.info("minibatch kmeans epoch: {}\tcost: {:.3f}\tshift: {:.3g}"
+                 .format(i, cost / max(count, 1), shift))
+        if shift < tolerance:
+            break
+    return C
+
+
 def initialise_centres(X, k, l, training_data=None, max_iterations=1000):
     """
     Use Kmeans|| to find initial cluster centres
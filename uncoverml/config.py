@@ -233,6 +233,21 @@ class Config(object):
     semi_supervised : bool
         True if semi_supervised clustering is being performed (i.e.
         class_file has been provided).
+    minibatch : bool, optional
+        If True, cluster with streaming mini-batch k-means, which reads
+        the image one partition at a time instead of holding it all in
+        memory. Not available for semi-supervised clustering. Optional,
+        default is False.
+    max_epochs : int, optional
+        Maximum number of passes over the image made by mini-batch
+        k-means. Optional, default is 10.
+    tolerance : float, optional
+        Mini-batch k-means stops once no cluster centre moves further
+        than this during a pass. Optional, default is 1e-4.
+    init_fraction : float, optional
+        Fraction of pixels sampled from every partition to initialise
+        the mini-batch k-means centres.
+        Optional, default is 0.01.
     target_search : bool
         True if `target_search` feature is being used.
     target_search_threshold : float
@@ -261,6 +276,14 @@ class Config(object):
         True if both `pk_covariates` and `pk_targets` are provided
         and these paths exist (it's assumed they contain the correct
         pickled data).
+    intersection_cache : str or bytes, optional
+        Directory for caching the intersection of targets with each
+        covariate file. A covariate is only intersected again if the
+        file, the targets or the patchsize have changed.
+    training_store : str or bytes, optional
+        Directory that nodes write their transformed training data to
+        instead of gathering it on the root node. Learning, cross
+        validation and permutation importance memory map it read-only.
     feature_sets : :class:`~uncoverml.config.FeatureSetConfig`
         The provided features as `FeatureSetConfig` objects. These
         contain paths to the feature files and *importantly* the 
@@ -319,8 +342,13 @@ class Config(object):
         Default is False.
     parallel_validate : bool, optional
         True if 'parallel' is present in 'k-fold' block of
-        config. Turns on parallel k-fold cross validation. Default
-        is False.
+        config. Turns on parallel k-fold cross validation, with folds
+        handed out by a :class:`~uncoverml.mpiops.TaskCounter`, which
+        needs MPI thread support to hand them out while the root node
+        trains. Default is False.
+    crossval_threads : int, optional
+        The 'threads' of the 'k-fold' block: the number of folds each
+        node trains at once. Default is 1.
     cross_validate : bool, optional
         True if 'k-fold' block is present in 'validation' block of 
         config. Turns on k-fold cross validation.
@@ -354,6 +382,15 @@ class Config(object):
     thumbnails : int, optional
         Subsampling factor for thumbnails of output images. Default
         is 10.
+    parallel_write : bool, optional
+        If True, each node writes its own prediction partitions to
+        intermediate files in the background, which are merged into
+        the output geotiffs at the end. Otherwise all partitions are
+        sent to node 0 for writing. Default is False.
+    prefetch : int, optional
+        Number of partitions whose covariates are read ahead in a
+        background thread while the current partition is predicted.
+        Default is 0, which reads each partition when it is needed.
     bootstrap_predictions : int, optional
         Only applies if a bootstrapped algorithm is being used. This is
         the number of predictions to perform, by default will predict 
@@ -372,6 +409,12 @@ class Config(object):
     output_dir : str
         Path to directory where prediciton map and other outputs
         will be written.
+    model_file : str
+        Path the trained model is saved to and loaded from.
+    model_bundle : bool
+        True if 'model_bundle' is True in the 'output' block. Saves
+        the model as a :mod:`~uncoverml.bundle` directory rather than a
+        single pickle. Default is False.
     """
     def __init__(self, yaml_file, clustering=False, learning=False, resampling=False,
                  predicting=False, shiftmap=True):
@@ -417,6 +460,14 @@ class Config(object):
                 self.class_property = _grp(cb, 'property', "'property' must be provided when "
                                            "providing a file for semisupervised clustering.")
             self.semi_supervised = self.class_file is not None
+            self.minibatch = cb.get('minibatch', False)
+            self.max_epochs = cb.get('max_epochs', 10)
+            self.tolerance = cb.get('tolerance', 1e-4)
+            self.init_fraction = cb.get('init_fraction', 0.01)
+            if self.minibatch and self.semi_supervised:
+                raise ValueError("Mini-batch k-means does not support semi-supervised "
+                                 "clustering, remove 'file' or 'minibatch' from the "
+                                 "'clustering' block.")
         elif learning:
             # LEARNING BLOCK
             learn_block = _grp(s, 'learning')
@@ -450,6 +501,8 @@ class Config(object):
         if pk_block:
             self.pk_covariates = pk_block.get('covariates')
             self.pk_targets = pk_block.get('targets')
+            self.intersection_cache = pk_block.get('intersection_cache')
+            self.training_store = pk_block.get('training_store')
 
             # Load from pickle files if covariates and targets exist.
             self.pk_load = self.pk_covariates and os.path.exists(self.pk_covariates) \
@@ -465,6 +518,8 @@ class Config(object):
             self.pk_covariates = None
             self.pk_targets = None
             self.pk_featurevec = None
+            self.intersection_cache = None
+            self.training_store = None
 
         # FEATURES BLOCK
         # Todo: fix get_image_spec so features are optional if using pickled data.
@@ -545,16 +600,19 @@ class Config(object):
                                           "if k-fold cross validation and/or feature ranking is "
                                           "being used.")
                 self.parallel_validate = kfb.get('parallel', False)
+                self.crossval_threads = kfb.get('threads', 1)
             elif self.rank_features:
                 # Feature ranking requires crossval params. Provide defaults if not available.
                 self.folds = 5
                 self.crossval_seed = 1
                 self.parallel_validate = False
+                self.crossval_threads = 1
             self.cross_validate = kfb is not None
         else:
             self.rank_features = False
             self.permutation_importance = False
             self.parallel_validate = False
+            self.crossval_threads = 1
             self.out_of_sample_validation = False
             self.cross_validate = False
 
@@ -571,6 +629,8 @@ class Config(object):
             self.outbands = _grp(pb, 'outbands', "'outbands' must be provided as part of prediction "
                                  "block.")
             self.thumbnails = pb.get('thumbnails', 10)
+            self.parallel_write = pb.get('parallel_write', False)
+            self.prefetch = pb.get('prefetch', 0)
             self.bootstrap_predictions = pb.get('bootstrap')
             mb = s.get('mask')
             if mb:
@@ -597,6 +657,7 @@ class Config(object):
         ob = _grp(s, 'output', "'output' block is required.")
         self.output_dir = _grp(ob, 'directory', "'directory' for output is required.")
         self.model_file = ob.get('model', _outpath('.model'))
+        self.model_bundle = ob.get('model_bundle', False)
 
         if ob.get('plot_feature_ranks', False):
             self.plot_feature_ranks = _outpath('_featureranks.png')
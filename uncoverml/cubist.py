@@ -1,20 +1,24 @@
 # coding: utf-8
 import os
-from os.path import join, abspath
+from os.path import join, abspath, exists
+import json
 import pickle
+import shutil
+import tempfile
 import time
 import random
 import glob
-from copy import deepcopy
 from subprocess import check_output
 from shlex import split as parse
 import logging
 import numpy as np
 from scipy.stats import norm
+from sklearn.utils import check_random_state
 import re
 from collections import OrderedDict
 import operator
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from uncoverml import mpiops
 
 _logger = logging.getLogger(__name__)
@@ -23,6 +27,8 @@ CATEGORICAL = 3
 STR1 = re.compile('^Evaluation on training data', re.MULTILINE)
 STR2 = re.compile('Evaluation on test data')
 CASES = re.compile('cases\):\n')
+ARGUMENT = re.compile(r'(\w+)=((?:"[^"]*",?)+)')
+SCRATCH_DIRS = ['/dev/shm']
 
 
 def save_data(filename, data):
@@ -30,6 +36,27 @@ def save_data(filename, data):
         new_file.write(data)
 
 
+def write_data(filename, data, chunk_size=10000):
+    # Formatting a whole block of rows with a single % operation is
+    # markedly faster than np.savetxt, and '%.17g' round-trips doubles
+    row = ', '.join(['%.17g'] * data.shape[1]) + '\n'
+    with open(filename, 'w') as new_file:
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            new_file.write((row * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def scratch_dir():
+    """
+    Make a private working directory for a single cubist run, preferring a
+    memory backed filesystem when one is available.
+    """
+    for d in SCRATCH_DIRS:
+        if os.path.isdir(d) and os.access(d, os.W_OK):
+            return tempfile.mkdtemp(prefix='cubist_', dir=d)
+    return tempfile.mkdtemp(prefix='cubist_')
+
+
 def read_data(filename):
     with open(filename, 'r') as data:
         return data.read()
@@ -57,10 +84,31 @@ def write_dict(filename, dict_obj):
 
 
 def arguments(p):
-    arguments = [c.split('=', 1)[1] for c in parse(p)]
+    # values are quoted, categorical values are a list: elts="1","2"
+    arguments = [v.replace('"', '') for _, v in ARGUMENT.findall(p)]
     return arguments
 
 
+def parse_model(modelfile, m):
+    """
+    Parse the text of a cubist .model file into a list of committee
+    members, each a list of Rules, i.e. [[<Rule>, <Rule>, ...], ...]
+
+    A member starts with a rules="r" line, and each of its rules is a
+    conds="c" line followed by c condition lines and a coefficient line.
+    """
+    models = []
+    lines = iter(modelfile.splitlines())
+    for line in lines:
+        if line.startswith('rules='):
+            models.append([])
+        elif line.startswith('conds='):
+            n_conds = int(arguments(line)[0])
+            rule = [line] + [next(lines) for _ in range(n_conds + 1)]
+            models[-1].append(Rule(rule, m))
+    return models
+
+
 def mean(numbers):
     mean = float(sum(numbers)) / max(len(numbers), 1)
     return mean
@@ -91,7 +139,7 @@ class Cubist:
                  max_rules=None, committee_members=1, max_categories=5000,
                  sampling=None, seed=None, neighbors=None, feature_type=None,
                  composite_model=False, auto=False, extrapolation=None,
-                 calc_usage=False, bootstrap=None):
+                 calc_usage=False, bootstrap=None, random_state=None):
         """ Instantiate the cubist class with a number of invocation parameters
 
         Parameters
@@ -133,6 +181,13 @@ class Cubist:
             whether to use composite model. False: used rule based model.
         auto: bool
             allow cubist to decide whether to use rule based or composite model
+        bootstrap: float | None
+            If given, train on a bootstrap sample of this percentage of
+            the data.
+        random_state: int | numpy.random.RandomState | None
+            Random state the bootstrap sample is drawn from. Pass a
+            separate RandomState to each model fitted in its own thread.
+            None uses the global numpy random state.
         """
 
         # Setting up the user details
@@ -153,6 +208,7 @@ class Cubist:
         self.composite_model = composite_model
         self.calc_usage = calc_usage
         self.bootstrap = bootstrap
+        self.random_state = random_state
 
         if auto and composite_model:
             self.auto = False
@@ -220,56 +276,36 @@ class Cubist:
                enumerate(types.items())]\
             + ['t: continuous.']
         namefile_string = '\n'.join(names)
-        save_data(self._filename + '.names', namefile_string)
 
         # bootstrap
         if self.bootstrap:
-            chosen = np.random.choice(range(len(y)),
-                                      size=int(self.bootstrap/100.*len(y)),
-                                      replace=True)
+            rnd = check_random_state(self.random_state)
+            chosen = rnd.choice(len(y), size=int(self.bootstrap/100.*len(y)),
+                                replace=True)
             y = y[chosen]
             x = x[chosen, :]
 
-        n, _ = x.shape
-
-        # Write the data as a csv file for cubist's training
-        y_copy = deepcopy(y)
-        y_copy.shape = (n, 1)
-        data = np.concatenate((x, y_copy), axis=1)
-        np.savetxt(self._filename + '.data', data, delimiter=', ')
-
-        # Run cubist and train the models
-        self._run_cubist()
-
-        '''
-        Turn the model into a rule list, which we can evaluate
-        '''
+        # Cubist reads and writes its files next to each other, so every run
+        # gets a private directory and concurrent fits cannot collide
+        workdir = scratch_dir()
+        filestem = join(workdir, 'cubist')
+        try:
+            save_data(filestem + '.names', namefile_string)
 
-        # Get and store the output model and the required data
-        modelfile = read_data(self._filename + '.model')
+            # Write the data as a csv file for cubist's training
+            write_data(filestem + '.data', np.column_stack((x, y)))
 
-        # Define a function that assigns the number of rows to the rule
-        def new_rule(model):
-            return Rule(model, m)
+            # Run cubist and train the models
+            self._run_cubist(filestem)
 
-        # Split the modelfile into an array of models, where each model
-        # contains some number of rules, hence the format:
-        #   [[<Rule>, <Rule>, ...], [<Rule>, <Rule>, ...], ... ]
-        models = map(remove_first_line, modelfile.split('rules')[1:])
-        rules_split = [model.split('conds')[1:] for model in models]
-        self.models = [list(map(new_rule, model)) for model in rules_split]
-
-        '''
-        Complete the training by cleaning up after ourselves
-        '''
+            # Turn the model into a rule list, which we can evaluate
+            self.models = parse_model(read_data(filestem + '.model'), m)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
 
         # Mark that we are now trained
         self._trained = True
-
-        # Delete the files used during training
-        self._remove_files(
-            ['.tmp', '.names', '.data', '.model', '.pred']
-        )
+        self._compiled = None
 
     def predict_dist(self, x, interval=0.95):
         """ Predict the outputs and variances of the inputs
@@ -308,18 +344,9 @@ class Cubist:
             _logger.warning(':mpi:Train first')
             return
 
-        # Determine which rule to run on each row and then run the regression
-        # on each row of x to get the regression output.
-        y_pred = np.zeros((n, len(self.models)))
-        for m, model in enumerate(self.models):
-            for rule in model:
-
-                # Determine which rows satisfy this rule
-                mask = rule.satisfied(x)
-
-                # Make the prediction for the whole matrix, and keep only the
-                # rows that are correctly sized
-                y_pred[mask, m] += rule.regress(x, mask)
+        # Determine which rules are satisfied by each row and then run the
+        # regression on each row of x to get the regression output.
+        y_pred = self.compiled_rules.predict(x)
 
         y_mean = np.mean(y_pred, axis=1)
         y_var = np.var(y_pred, axis=1)
@@ -349,39 +376,72 @@ class Cubist:
         mean, _, _, _ = self.predict_dist(x)
         return mean
 
-    def _run_cubist(self):
+    @property
+    def compiled_rules(self):
+        """
+        The committee models compiled into a :class:`CompiledRules`.
+        Compiled on first use.
+        """
+        compiled = getattr(self, '_compiled', None)
+        if compiled is None:
+            compiled = CompiledRules(self.models)
+            self._compiled = compiled
+        return compiled
+
+    def predict_rules(self, x):
+        """
+        Reference implementation of the committee predictions that
+        evaluates each :class:`Rule` in turn.
+
+        Returns
+        -------
+        y_pred: numpy.array
+            Array of shape (n, committee members).
+        """
+        y_pred = np.zeros((len(x), len(self.models)))
+        for m, model in enumerate(self.models):
+            for rule in model:
+
+                # Determine which rows satisfy this rule
+                mask = rule.satisfied(x)
+
+                # Make the prediction for the whole matrix, and keep only the
+                # rows that are correctly sized
+                y_pred[mask, m] += rule.regress(x, mask)
+        return y_pred
+
+    def _run_cubist(self, filestem):
 
         try:
             from uncoverml.cubist_config import invocation
 
         except ImportError:
-            self._remove_files(['.tmp', '.names', '.data', '.model'])
             _logger.error(':mpi:Cubist not installed, please run makecubist first')
             import sys
             sys.exit()
 
-        # Start the script and wait until it has yielded
-        command = (invocation +
-                   (' -u' if self.unbiased else '') +
-                   (' -r ' + str(self.max_rules)
-                    if self.max_rules else '') +
-                   (' -C ' + str(self.committee_members)
-                    if self.committee_members > 1 else '') +
-                   (' -n ' + str(self.neighbors)
-                    if self.neighbors else '') +
-                   (' -S ' + str(self.sampling)
-                    if self.sampling else '') +
-                   (' -e ' + str(self.extrapolation)
-                    if self.extrapolation else '') +
-                   (' -I ' + str(self.seed)
-                    if self.seed else '') +
-                   (' -i'
-                    if self.composite_model else '') +
-                   (' -a'
-                    if self.auto else '') +
-                   (' -f ' + self._filename))
-
-        results = check_output(command, shell=True).decode()
+        # Start the program and wait until it has yielded
+        command = (parse(invocation) +
+                   (['-u'] if self.unbiased else []) +
+                   (['-r', str(self.max_rules)]
+                    if self.max_rules else []) +
+                   (['-C', str(self.committee_members)]
+                    if self.committee_members > 1 else []) +
+                   (['-n', str(self.neighbors)]
+                    if self.neighbors else []) +
+                   (['-S', str(self.sampling)]
+                    if self.sampling else []) +
+                   (['-e', str(self.extrapolation)]
+                    if self.extrapolation else []) +
+                   (['-I', str(self.seed)]
+                    if self.seed else []) +
+                   (['-i']
+                    if self.composite_model else []) +
+                   (['-a']
+                    if self.auto else []) +
+                   ['-f', filestem])
+
+        results = check_output(command).decode()
 
         # Print the program output directly
         if self.print_output:
@@ -392,11 +452,6 @@ class Cubist:
             matched_str = STR2.split(matched_str)[0]
             save_data(self._filename + '.usg', matched_str)
 
-    def _remove_files(self, extensions):
-        for extension in extensions:
-            if os.path.exists(self._filename + extension):
-                os.remove(self._filename + extension)
-
 
 class MultiCubist:
     """
@@ -408,7 +463,8 @@ class MultiCubist:
                  neighbors=None, feature_type=None,
                  sampling=70, seed=None, extrapolation=None,
                  composite_model=False, auto=False, parallel=False,
-                 calc_usage=False, bootstrap=None):
+                 calc_usage=False, bootstrap=None, n_jobs=1,
+                 mmap_rules=False):
         """
         Instantiate the multicubist class with a number of invocation
         parameters
@@ -419,6 +475,19 @@ class MultiCubist:
             number of Cubist trees
         parallel: bool
             Whether to use mpi for fitting or not
+        seed: int | None
+            Seed of the random seeds of the trees. The trees are then
+            the same however many processes fit them. None seeds them
+            randomly.
+        n_jobs: int
+            The number of trees each process fits concurrently. Every
+            cubist run has its own working directory, so the trees of a
+            process can share one node.
+        mmap_rules: bool
+            Whether to save the rules of the trees to a directory in
+            `outdir` and memory map them instead of holding them in the
+            model, so that processes on the same node share one copy.
+            The directory has to stay readable while the model is used.
 
         Other Parameters definitions can be found in Cubist.
         """
@@ -444,6 +513,10 @@ class MultiCubist:
         self.auto = auto
         self.calc_usage = calc_usage
         self.bootstrap = bootstrap
+        self.n_jobs = n_jobs
+        self.mmap_rules = mmap_rules
+        self._compiled = None
+        self._rules_dir = None
 
     def fit(self, x, y):
         """ Train the Cubist model
@@ -468,9 +541,6 @@ class MultiCubist:
                     "Can not use more than one node during MultiCubist "
                     "training.")
 
-        # set a different random seed for each thread
-        np.random.seed(mpiops.chunk_index + np.random.randint(0, 10000))
-
         if self.parallel:  # during training
             process_trees = np.array_split(range(self.trees),
                                            mpiops.chunks)[mpiops.chunk_index]
@@ -481,7 +551,13 @@ class MultiCubist:
             temp_ = 'temp_x_{}'.format(mpiops.chunk_index)
             temp_calc_usage = False  # dont calc usage stats for x-val
 
-        for t in process_trees:
+        # draw the seeds of all trees up front from the model's own random
+        # state, so they depend neither on the fitting order, the number of
+        # processes, nor on other models fitted at the same time
+        seeds = np.random.RandomState(self.seed).randint(
+            0, 10000, self.trees)[list(process_trees)]
+
+        def fit_tree(t, seed):
             _logger.info(':mpi:training tree {} using process {}'.format(t, mpiops.chunk_index))
 
             cube = Cubist(name=join(self.temp_dir, temp_ + '_{}'.format(t)),
@@ -496,21 +572,23 @@ class MultiCubist:
                           extrapolation=self.extrapolation,
                           auto=self.auto,
                           composite_model=self.composite_model,
-                          seed=np.random.randint(0, 10000),
+                          seed=seed,
                           calc_usage=temp_calc_usage,
-                          bootstrap=self.bootstrap)
+                          bootstrap=self.bootstrap,
+                          random_state=np.random.RandomState(seed))
             cube.fit(x, y)
-            if self.parallel:  # used in training
-                pk_f = join(self.temp_dir,
-                            'cube_{}.pk'.format(t))
-            else:  # used when parallel is false, i.e., during x-val
-                pk_f = join(self.temp_dir,
-                            'cube_x_{}_p_{}.pk'.format(t, mpiops.chunk_index))
-            with open(pk_f, 'wb') as fp:
-                pickle.dump(cube, fp)
+            return t, cube.models
+
+        # the cubist runs are subprocesses, so threads are enough to overlap
+        with ThreadPoolExecutor(max_workers=max(self.n_jobs, 1)) as executor:
+            tree_models = list(executor.map(fit_tree, process_trees, seeds))
+
+        if self.parallel:
+            tree_models = [tm for p in mpiops.comm.allgather(tree_models)
+                           for tm in p]
+        self._compile([models for _, models in sorted(tree_models)])
 
         if self.parallel:
-            mpiops.comm.barrier()
             # calc final usage stats
             if self.calc_usage and mpiops.chunk_index == 0:
                 self.calculate_usage()
@@ -553,30 +631,8 @@ class MultiCubist:
             _logger.warning(':mpi:Train first')
             return
 
-        n, _ = x.shape
-
-        # on each row of x to get the regression output.
-        # we have prediction for each x tree/cubes * len(models) in each tree
-
-        y_pred = np.zeros((n, self.trees * self.committee_members))
-
-        for i in range(self.trees):
-            if self.parallel:  # used in training
-                pk_f = join(self.temp_dir,
-                            'cube_{}.pk'.format(i))
-            else:  # used when parallel is false, i.e., during x-val
-                pk_f = join(self.temp_dir,
-                            'cube_x_{}_p_{}.pk'.format(i, mpiops.chunk_index))
-            with open(pk_f, 'rb') as fp:
-                c = pickle.load(fp)
-                for m, model in enumerate(c.models):
-                    for rule in model:
-                        # Determine which rows satisfy this rule
-                        mask = rule.satisfied(x)
-                        # Make the prediction for the whole matrix,
-                        # and keep only the rows that are correctly sized
-                        y_pred[mask, i * self.committee_members + m] += \
-                            rule.regress(x, mask)
+        # we have a prediction for each committee member of each tree
+        y_pred = self.compiled_rules.predict(x)
 
         y_mean = np.mean(y_pred, axis=1)
         y_var = np.var(y_pred, axis=1)
@@ -605,6 +661,71 @@ class MultiCubist:
         mean, _, _, _ = self.predict_dist(x)
         return mean
 
+    @property
+    def rules_dir(self):
+        """
+        The directory the rules are memory mapped from when `mmap_rules`
+        is set. Every fit creates a new directory in `temp_dir`, so models
+        fitted at the same time do not overwrite each other's rules, and
+        a loaded model finds its rules however many processes it runs on.
+        """
+        return getattr(self, '_rules_dir', None)
+
+    @property
+    def compiled_rules(self):
+        """
+        The committee members of all trees compiled into a single
+        :class:`CompiledRules`. Memory mapped rules are opened on first
+        use.
+        """
+        compiled = getattr(self, '_compiled', None)
+        if compiled is None and self._trained:
+            if getattr(self, 'mmap_rules', False):
+                compiled = CompiledRules.load(self.rules_dir, mmap_mode='r')
+            else:
+                # models saved before the rules were kept in the model
+                # still have their trees pickled in temp_dir
+                compiled = CompiledRules([m for cube in self._pickled_trees()
+                                          for m in cube.models])
+            self._compiled = compiled
+        return compiled
+
+    def _pickled_trees(self):
+        for t in range(self.trees):
+            if self.parallel:
+                pk_f = join(self.temp_dir, 'cube_{}.pk'.format(t))
+            else:
+                pk_f = join(self.temp_dir,
+                            'cube_x_{}_p_{}.pk'.format(t, mpiops.chunk_index))
+            with open(pk_f, 'rb') as fp:
+                yield pickle.load(fp)
+
+    def _compile(self, tree_models):
+        """
+        Compile the committee models of every tree, given in tree order,
+        and save them to `rules_dir` when they are memory mapped.
+        """
+        compiled = CompiledRules([m for models in tree_models
+                                  for m in models])
+        if self.mmap_rules:
+            rules_dir = None
+            if not self.parallel or mpiops.chunk_index == 0:
+                rules_dir = tempfile.mkdtemp(prefix='rules_',
+                                             dir=self.temp_dir)
+                compiled.save(rules_dir)
+            if self.parallel:
+                rules_dir = mpiops.comm.bcast(rules_dir, root=0)
+            self._rules_dir = rules_dir
+            compiled = CompiledRules.load(self.rules_dir, mmap_mode='r')
+        self._compiled = compiled
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # memory mapped rules are reopened rather than pickled
+        if self.mmap_rules:
+            state['_compiled'] = None
+        return state
+
     def calculate_usage(self):
         """
         Averages the Cond and Model statistics of all the cubist runs
@@ -692,8 +813,11 @@ class Rule:
 
     def __init__(self, rule, m):
 
-        # Split the parts of the string so that they can be manipulated
-        header, *conditions, polynomial = rule.split('\n')[:-1]
+        # Split the parts of the string so that they can be manipulated,
+        # rules parsed by parse_model arrive already split into lines
+        if isinstance(rule, str):
+            rule = rule.split('\n')[:-1]
+        header, *conditions, polynomial = rule
 
         # py27 compat
         # rule_splits = rule.split('\n')[:-1]
@@ -770,3 +894,181 @@ class Rule:
 
         prediction = self.bias + x[mask].dot(self.coefficients)
         return prediction
+
+
+class CompiledRules:
+    """
+    Flat array representation of a set of cubist committee models.
+
+    Every rule of every committee member is stored as a row of a
+    coefficient matrix, and every condition as an entry in arrays of
+    operand indices, operators and thresholds (continuous) or allowed
+    values (categorical). Prediction evaluates all conditions and all
+    rule regressions for a chunk of rows at once, which gives the same
+    result as evaluating each :class:`Rule` in turn.
+
+    Parameters
+    ----------
+    models: list of list of :class:`Rule`
+        The committee models, as stored in `Cubist.models`.
+    chunk_size: int, optional
+        Number of rows to evaluate at a time. By default chosen so
+        that the per-chunk rule matrices stay around 128MB.
+    n_jobs: int
+        Number of threads used to evaluate chunks.
+    """
+
+    operators = ["<", ">", "=", ">=", "<="]
+    arrays = ['bias', 'coefficients', 'model_matrix', 'condition_table',
+              'cont_column', 'cont_index', 'cont_operator', 'cont_threshold',
+              'cat_column', 'cat_index', 'cat_values', 'value_table']
+
+    def __init__(self, models, chunk_size=None, n_jobs=1):
+        rules = [(m, rule) for m, model in enumerate(models) for rule in model]
+        self.n_models = len(models)
+        self.n_rules = len(rules)
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+
+        n_features = len(rules[0][1].coefficients) if rules else 0
+        self.bias = np.array([r.bias for _, r in rules], dtype=float)
+        self.coefficients = np.zeros((self.n_rules, n_features))
+        self.model_matrix = np.zeros((self.n_models, self.n_rules))
+        for k, (m, rule) in enumerate(rules):
+            self.coefficients[k] = rule.coefficients
+            self.model_matrix[m, k] = 1.
+
+        # Each rule's conditions are looked up through a (max conditions,
+        # rules) table. Unused entries point at an extra always-true row.
+        n_conds = [len(r.conditions) for _, r in rules]
+        self.n_conditions = sum(n_conds)
+        self.condition_table = np.full((max(n_conds, default=0), self.n_rules),
+                                       self.n_conditions, dtype=int)
+        conditions = []
+        for k, (_, rule) in enumerate(rules):
+            for i, condition in enumerate(rule.conditions):
+                self.condition_table[i, k] = len(conditions)
+                conditions.append(condition)
+
+        cont = [(j, c) for j, c in enumerate(conditions)
+                if c['type'] == CONTINUOUS]
+        self.cont_column = np.array([j for j, _ in cont], dtype=int)
+        self.cont_index = np.array([c['operand_index'] for _, c in cont], dtype=int)
+        self.cont_operator = np.array([self.operators.index(c['operator'])
+                                       for _, c in cont], dtype=int)
+        self.cont_threshold = np.array([c['operand'] for _, c in cont], dtype=float)
+
+        # Likewise the allowed values of each categorical condition are
+        # looked up through a (max values, conditions) table, padded with
+        # an extra never-matching row.
+        cat = [(j, c) for j, c in enumerate(conditions)
+               if c['type'] == CATEGORICAL]
+        self.cat_column = np.array([j for j, _ in cat], dtype=int)
+        lengths = [len(c['values']) for _, c in cat]
+        self.cat_index = np.repeat([c['operand_index'] for _, c in cat],
+                                   lengths).astype(int)
+        self.cat_values = np.array([v for _, c in cat for v in c['values']],
+                                   dtype=float)
+        self.value_table = np.full((max(lengths, default=0), len(cat)),
+                                   len(self.cat_values), dtype=int)
+        offsets = np.cumsum([0] + lengths)
+        for i, n in enumerate(lengths):
+            self.value_table[:n, i] = np.arange(offsets[i], offsets[i + 1])
+
+    def satisfied(self, x):
+        """
+        Returns a boolean array of shape (n, rules) that is True where
+        a row satisfies all of the conditions of a rule.
+        """
+        return self._satisfied(np.ascontiguousarray(x.T)).T
+
+    def _satisfied(self, xt):
+        # Works on features x rows so that gathering a feature is contiguous
+        n = xt.shape[1]
+        passed = np.empty((self.n_conditions + 1, n), dtype=bool)
+        passed[-1] = True
+        for code, name in enumerate(self.operators):
+            sel = self.cont_operator == code
+            if np.any(sel):
+                passed[self.cont_column[sel]] = Rule.comparator[name](
+                    xt[self.cont_index[sel]], self.cont_threshold[sel, np.newaxis])
+        if len(self.cat_column):
+            close = np.zeros((len(self.cat_values) + 1, n), dtype=bool)
+            close[:-1] = np.isclose(self.cat_values[:, np.newaxis], xt[self.cat_index])
+            matched = close[self.value_table[0]]
+            for row in self.value_table[1:]:
+                matched |= close[row]
+            passed[self.cat_column] = matched
+
+        mask = np.ones((self.n_rules, n), dtype=bool)
+        for row in self.condition_table:
+            mask &= passed[row]
+        return mask
+
+    def _predict_chunk(self, x):
+        xt = np.ascontiguousarray(x.T)
+        rule_pred = self.coefficients.dot(xt)
+        rule_pred += self.bias[:, np.newaxis]
+        rule_pred[~self._satisfied(xt)] = 0.
+        return self.model_matrix.dot(rule_pred).T
+
+    def predict(self, x):
+        """
+        Evaluates all committee models on x.
+
+        Returns
+        -------
+        y_pred: numpy.array
+            Array of shape (n, committee members).
+        """
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = max(1, 2**24 // max(self.n_rules, 1))
+        chunks = [x[i:i + chunk_size] for i in range(0, len(x), chunk_size)]
+        if self.n_jobs > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                results = list(executor.map(self._predict_chunk, chunks))
+        else:
+            results = [self._predict_chunk(c) for c in chunks]
+        if not results:
+            return np.zeros((0, self.n_models))
+        return np.concatenate(results, axis=0)
+
+    def save(self, directory):
+        """
+        Save the rule tables to `directory`, one .npy file per array
+        and an index.json with the sizes.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in self.arrays:
+            np.save(join(directory, name + '.npy'), getattr(self, name))
+        index = dict(n_models=self.n_models, n_rules=self.n_rules,
+                     n_conditions=self.n_conditions,
+                     chunk_size=self.chunk_size, n_jobs=self.n_jobs)
+        with open(join(directory, 'index.json'), 'w') as f:
+            json.dump(index, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        """
+        Load rule tables written by :meth:`save`.
+
+        Parameters
+        ----------
+        directory: str
+            The directory the tables were saved to.
+        mmap_mode: str, optional
+            Passed to `numpy.load`. With 'r' the tables are memory mapped
+            and shared by all processes on a node.
+        """
+        index_file = join(directory, 'index.json')
+        if not exists(index_file):
+            raise FileNotFoundError('No compiled rules in {}'.format(directory))
+        with open(index_file) as f:
+            index = json.load(f)
+        compiled = cls.__new__(cls)
+        compiled.__dict__.update(index)
+        for name in cls.arrays:
+            setattr(compiled, name, np.load(join(directory, name + '.npy'),
+                                            mmap_mode=mmap_mode))
+        return compiled
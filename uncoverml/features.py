@@ -146,6 +146,89 @@ def extract_features(image_source, targets, n_subchunks, patchsize):
     return x_all
 
 
+def _block_windows(pixels, block_shape, patchsize, resolution):
+    """
+    Groups pixels by the image block they fall in and yields, for each
+    group, the indices of its pixels and the (exclusive) window that
+    covers their patches, clipped to the image.
+    """
+    block_ids = pixels // np.asarray(block_shape)
+    order = np.lexsort((block_ids[:, 0], block_ids[:, 1]))
+    sorted_ids = block_ids[order]
+    splits = np.flatnonzero(np.any(np.diff(sorted_ids, axis=0) != 0, axis=1)) + 1
+    for group in np.split(order, splits):
+        group_pix = pixels[group]
+        start = np.maximum(group_pix.min(axis=0) - patchsize, 0)
+        stop = np.minimum(group_pix.max(axis=0) + patchsize + 1, resolution[:2])
+        yield group, start, stop
+
+
+def extract_point_features(image_source, targets, patchsize,
+                           min_block_size=256):
+    """
+    Extracts the patches centred on each target by reading only the
+    parts of the image that contain targets.
+
+    Targets are grouped by the image block (or a tile of at least
+    `min_block_size` pixels) they fall in, and a single window covering
+    each group's patches is read. Parts of a patch lying outside the
+    image are masked.
+
+    Parameters
+    ----------
+    image_source : :class:`~uncoverml.geoio.ImageSource`
+        The image to intersect.
+    targets : :class:`~uncoverml.targets.Targets`
+        This node's targets.
+    patchsize : int
+        Half-width of the patches.
+    min_block_size : int
+        Smallest tile width/height to group targets by. Stops striped
+        images from being read one row at a time.
+
+    Returns
+    -------
+    numpy.ma.MaskedArray
+        Array of shape (n_targets, side, side, channels), in the same
+        order as `targets`, where side = 2 * patchsize + 1.
+    """
+    image = Image(image_source)
+    lonlats = targets.positions
+    valid = image.in_bounds(lonlats)
+    if not np.any(valid):
+        raise ValueError(f"Attempting to extract features form {image_source._filename} "
+                          "but all targets lie outside image boundaries")
+    if not np.all(valid):
+        raise ValueError(f"Number of covariate data points ({np.count_nonzero(valid)}) not "
+                         f"equal to target data points ({targets.observations.shape[0]})")
+
+    pixels = image.lonlat2pix(lonlats)
+    side = 2 * patchsize + 1
+    shape = (len(pixels), side, side, image.channels)
+    x_data = np.zeros(shape, dtype=image.dtype)
+    x_mask = np.ones(shape, dtype=bool)
+
+    block_shape = np.maximum(image_source.block_shape, min_block_size)
+    for group, start, stop in _block_windows(pixels, block_shape, patchsize,
+                                             image.resolution):
+        window = image_source.data(start[0], stop[0], start[1], stop[1])
+        # Pad the window so patches overlapping the image edge are masked
+        w_start = pixels[group].min(axis=0) - patchsize
+        w_shape = tuple(pixels[group].max(axis=0) + patchsize + 1 - w_start)
+        offset = start - w_start
+        w_data = np.zeros(w_shape + (image.channels,), dtype=image.dtype)
+        w_mask = np.ones(w_shape + (image.channels,), dtype=bool)
+        w_slice = (slice(offset[0], offset[0] + window.shape[0]),
+                   slice(offset[1], offset[1] + window.shape[1]))
+        w_data[w_slice] = window.data
+        w_mask[w_slice] = np.ma.getmaskarray(window)
+        points = pixels[group] - w_start
+        x_data[group] = patch.point_patches(w_data, patchsize, points)
+        x_mask[group] = patch.point_patches(w_mask, patchsize, points)
+
+    return np.ma.masked_array(x_data, mask=x_mask)
+
+
 def transform_features(feature_sets, transform_sets, final_transform, config):
     # apply feature transforms
     transformed_vectors = [t(c) for c, t in zip(feature_sets, transform_sets)]
@@ -178,6 +261,54 @@ def transform_features(feature_sets, transform_sets, final_transform, config):
     return x, cull_all_null_rows(feature_sets)
 
 
+def fit_transforms(partitions, transform_sets, final_transform, config):
+    """
+    Fits the transforms on data that is read in partitions, so the
+    statistics are exact over all of the data but only one partition is
+    in memory at a time.
+
+    Each pass over the partitions fits one more transform of every
+    transform set, so there are as many passes as the longest chain of
+    transforms (plus those of the final transform).
+
+    Parameters
+    ----------
+    partitions : callable
+        Returns an iterable over the partitions. Each partition is a list
+        of image chunk dictionaries, one for each transform set, as given
+        to :func:`transform_features`.
+    transform_sets : list of :class:`~uncoverml.transforms.ImageTransformSet`
+        Transforms of each feature set.
+    final_transform : :class:`~uncoverml.transforms.TransformSet`
+        Transform of the concatenated features, may be None.
+    config : :class:`~uncoverml.config.Config`
+        Config object.
+    """
+    n_pass = 0
+    while not all(t.fitted for t in transform_sets):
+        n_pass += 1
+        _logger.info("Fitting transforms: pass {}".format(n_pass))
+        for feature_sets in partitions():
+            for c, t in zip(feature_sets, transform_sets):
+                if not t.fitted:
+                    t.accumulate(c)
+        for t in transform_sets:
+            if not t.fitted:
+                t.finalise()
+
+    if config.cubist or config.multicubist or config.krige \
+            or not final_transform:
+        return
+    while not final_transform.fitted:
+        n_pass += 1
+        _logger.info("Fitting transforms: pass {}".format(n_pass))
+        for feature_sets in partitions():
+            x = np.ma.concatenate([t(c) for c, t in
+                                   zip(feature_sets, transform_sets)], axis=1)
+            final_transform.accumulate(x)
+        final_transform.finalise()
+
+
 def save_intersected_features_and_targets(feature_sets, transform_sets, targets, config, 
                                           impute=True):
     """
@@ -278,8 +409,8 @@ def cull_all_null_rows(feature_sets):
                                                    is_categorical=True)
     transformed_vectors = [dummy_transform(c) for c in feature_sets]
 
-    bool_transformed_vectors = np.concatenate([t.mask for t in
-                                               transformed_vectors], axis=1)
+    bool_transformed_vectors = np.concatenate(
+        [np.ma.getmaskarray(t) for t in transformed_vectors], axis=1)
     covaraiates = bool_transformed_vectors.shape[1]
     rows_to_keep = np.sum(bool_transformed_vectors, axis=1) != covaraiates
     return rows_to_keep
@@ -8,8 +8,11 @@ from abc import ABCMeta, abstractmethod
 from collections import OrderedDict, namedtuple
 import json
 import pickle
-import itertools
+import hashlib
 import shutil
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import rasterio
@@ -21,12 +24,12 @@ import shapefile
 import pyproj
 import matplotlib.pyplot as plt
 
+from uncoverml import bundle
 from uncoverml import targets
 from uncoverml import mpiops
 from uncoverml import image
 from uncoverml import features
 from uncoverml import diagnostics
-from uncoverml.transforms import missing_percentage
 
 
 _logger = logging.getLogger(__name__)
@@ -34,6 +37,148 @@ _logger = logging.getLogger(__name__)
 
 _lower_is_better = ['mll', 'mll_transformed', 'smse', 'smse_transformed']
 
+
+class DatasetPool:
+    """
+    Per-process pool of open, read-only rasterio datasets.
+
+    Opening a GeoTIFF (and parsing its header) is expensive on shared
+    filesystems, so rather than opening a covariate for every window
+    read, all :class:`RasterioImageSource` objects borrow handles from
+    this pool. GDAL dataset handles must not be used from two threads at
+    once, so a handle is lent to one borrower at a time, and a file is
+    opened again if all of its handles are borrowed. The handles of the
+    least recently used files are closed once more than `max_open`
+    datasets are open. Handles that are currently borrowed are never
+    closed.
+
+    Parameters
+    ----------
+    max_open : int
+        Maximum number of datasets to keep open. 0 disables pooling
+        (datasets are closed as soon as they are returned).
+    """
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self._idle = OrderedDict()
+        self._in_use = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def dataset(self, filename):
+        """
+        Context manager yielding an open dataset for `filename`, which
+        no other borrower uses until it is returned.
+        """
+        key = os.path.abspath(filename)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle and idle[-1].closed:
+                idle.pop()
+            if idle:
+                self.hits += 1
+                ds = idle.pop()
+            else:
+                self.misses += 1
+                ds = rasterio.open(key, 'r')
+            self._idle[key] = idle
+            self._idle.move_to_end(key)
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            yield ds
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+                if self._in_use[key] == 0:
+                    del self._in_use[key]
+                self._idle.setdefault(key, []).append(ds)
+                self._evict()
+
+    def _evict(self):
+        excess = len(self) - self.max_open
+        for key in list(self._idle.keys()):
+            idle = self._idle[key]
+            while excess > 0 and idle:
+                idle.pop(0).close()
+                excess -= 1
+            if not idle and key not in self._in_use:
+                del self._idle[key]
+            if excess <= 0:
+                break
+
+    def close(self):
+        """
+        Close all idle datasets held by the pool.
+        """
+        with self._lock:
+            for key in list(self._idle.keys()):
+                for ds in self._idle.pop(key):
+                    ds.close()
+
+    def __len__(self):
+        return sum(len(idle) for idle in self._idle.values()) \
+            + sum(self._in_use.values())
+
+
+dataset_pool = DatasetPool()
+"""module-level :class:`DatasetPool` shared by all image sources in
+this process.
+"""
+
+
+io_threads = 1
+"""int: number of covariate files each process reads at once, set with
+:func:`configure_io_threads`.
+"""
+
+
+def configure_io_threads(n_threads):
+    """
+    Set the number of covariate files each process reads at once.
+    """
+    global io_threads
+    io_threads = max(1, n_threads)
+
+
+crop_extents = None
+"""tuple: the (extents, pixel_coordinates) every :class:`RasterioImageSource`
+is cropped to by default, set with :func:`configure_crop`.
+"""
+
+
+def configure_crop(extents, pixel_coordinates=False):
+    """
+    Crop every :class:`RasterioImageSource` opened from now on to
+    `extents`, or stop cropping if `extents` is None. See
+    :func:`crop_window`.
+    """
+    global crop_extents
+    crop_extents = None if extents is None \
+        else (tuple(extents), pixel_coordinates)
+
+
+def configure_dataset_pool(max_open):
+    """
+    Set the maximum number of datasets kept open by :data:`dataset_pool`.
+    """
+    dataset_pool.max_open = max_open
+    with dataset_pool._lock:
+        dataset_pool._evict()
+
+
+def close_dataset_pool():
+    """
+    Log pool hit/miss counts summed over all nodes and close all
+    pooled datasets. Must be called by every node.
+    """
+    hits = mpiops.comm.allreduce(dataset_pool.hits)
+    misses = mpiops.comm.allreduce(dataset_pool.misses)
+    _logger.info("Dataset pool: {} hits, {} misses".format(hits, misses))
+    dataset_pool.close()
+
+
 class ImageSource:
     __metaclass__ = ABCMeta
 
@@ -73,15 +218,44 @@ class ImageSource:
     def crs(self):
         return self._crs
 
+    @property
+    def block_shape(self):
+        """(x, y) shape of the blocks the image is stored in."""
+        return self._block_shape
+
 
 class RasterioImageSource(ImageSource):
+    """
+    An image source reading a geotiff, optionally cropped.
 
-    def __init__(self, filename):
+    Cropping is virtual: the source exposes the cropped window as if it
+    were the whole image and offsets its reads into the file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the geotiff.
+    extents : tuple(float, float, float, float), optional
+        Bounding box to crop to, ordering is (xmin, ymin, xmax, ymax).
+        Defaults to the extents set with :func:`configure_crop`.
+    pixel_coordinates : bool
+        If True, `extents` are pixel coordinates counted from the
+        bottom left corner of the image.
+    """
+    def __init__(self, filename, extents=None, pixel_coordinates=False):
 
         self._filename = filename
+        if extents is None and crop_extents is not None:
+            extents, pixel_coordinates = crop_extents
         assert os.path.isfile(filename), '{} does not exist'.format(filename)
-        with rasterio.open(self._filename, 'r') as geotiff:
-            self._full_res = (geotiff.width, geotiff.height, geotiff.count)
+        with dataset_pool.dataset(self._filename) as geotiff:
+            if extents is None:
+                self._window = ((0, geotiff.height), (0, geotiff.width))
+            else:
+                self._window = crop_window(geotiff, extents, pixel_coordinates)
+            (row_start, row_stop), (col_start, col_stop) = self._window
+            self._full_res = (col_stop - col_start, row_stop - row_start,
+                              geotiff.count)
             self._nodata_value = geotiff.meta['nodata']
             # we don't support different channels with different dtypes
             for d in geotiff.dtypes[1:]:
@@ -90,6 +264,8 @@ class RasterioImageSource(ImageSource):
                                      "with differently typed channels")
             self._dtype = np.dtype(geotiff.dtypes[0])
             self._crs = geotiff.crs
+            # rasterio gives (rows, cols)
+            self._block_shape = tuple(geotiff.block_shapes[0][::-1])
 
             A = geotiff.transform
             # No shearing or rotation allowed!!
@@ -98,8 +274,8 @@ class RasterioImageSource(ImageSource):
                                    "has rotation or shear")
             self._pixsize_x = A[0]
             self._pixsize_y = A[4]
-            self._start_lon = A[2]
-            self._start_lat = A[5]
+            self._start_lon = A[2] + col_start * A[0]
+            self._start_lat = A[5] + row_start * A[4]
 
             self._y_flipped = self._pixsize_y < 0
             if self._y_flipped:
@@ -115,8 +291,10 @@ class RasterioImageSource(ImageSource):
             max_y = max_y_new
 
         # NOTE these are exclusive
-        window = ((min_y, max_y), (min_x, max_x))
-        with rasterio.open(self._filename, 'r') as geotiff:
+        (row_start, _), (col_start, _) = self._window
+        window = ((min_y + row_start, max_y + row_start),
+                  (min_x + col_start, max_x + col_start))
+        with dataset_pool.dataset(self._filename) as geotiff:
             d = geotiff.read(window=window, masked=True)
         d = d[np.newaxis, :, :] if d.ndim == 2 else d
         d = np.ma.transpose(d, [2, 1, 0])  # Transpose and channels at back
@@ -130,18 +308,23 @@ class RasterioImageSource(ImageSource):
         if self._y_flipped:
             d = d[:, ::-1]
 
-        # Otherwise scikit image complains
-        m = np.ma.MaskedArray(data=np.ascontiguousarray(d.data),
-                              mask=np.ascontiguousarray(d.mask))
+        # Windows without missing data have no mask, which saves copying
+        # it into every patch. Otherwise scikit image complains if not
+        # contiguous
+        mask = np.ascontiguousarray(d.mask) \
+            if d.mask.ndim and d.mask.any() else np.ma.nomask
+        m = np.ma.MaskedArray(data=np.ascontiguousarray(d.data), mask=mask)
 
-        # # uniform mask format
-        # if np.ma.count_masked(m) == 0:
-        #     m = np.ma.masked_array(data=m.data,
-        #                            mask=np.zeros_like(m.data, dtype=bool))
         assert m.data.ndim == 3
         assert m.mask.ndim == 3 or m.mask.ndim == 0
         return m
 
+    @property
+    def window(self):
+        """((row_start, row_stop), (col_start, col_stop)) of the file
+        covered by this source."""
+        return self._window
+
 
 class ArrayImageSource(ImageSource):
     """
@@ -167,60 +350,76 @@ class ArrayImageSource(ImageSource):
         self._start_lon = origin[0]
         self._start_lat = origin[1]
         self._crs = crs
+        self._block_shape = A.shape[:2]
 
     def data(self, min_x, max_x, min_y, max_y):
         # MUST BE EXCLUSIVE
         data_window = self._data[min_x:max_x, :][:, min_y:max_y]
         return data_window
 
-def crop_covariates(config, outdir=None):
+def crop_covariates(config):
     """
-    Crops the covariate files listed under `config.feature_sets` using
-    the bounds provided under `config.extents`. The cropped covariates
-    are stored in a temporary directory and the paths in 
-    `config.feature_sets` are redirected to theses files. The caller is
-    responsible for removing the files once they have been created.
-    
+    Crops the covariates and prediction mask to the bounds provided under
+    `config.extents`. Cropping is virtual: every image source opened
+    afterwards in this process reads only the part of its file inside
+    the bounds, so no cropped copies are written.
+
     Parameters
     ----------
     config : `uncoverml.config.Config`
         Parsed UncoverML config.
-    outdir : str
-        Aboslute path to directory to store cropped covariates.
-        If not provided, a tmp directory will be created.
     """
     _logger.info("Cropping covariates...")
-    if outdir is None:
-        def _new_fname(fname):
-            return os.path.join(config.tmpdir, os.path.basename(fname))
-    else:
-        def _new_fname(fname):
-            return os.path.join(outdir, os.path.basename(fname))
+    configure_crop(config.extents, config.extents_are_pixel_coordinates)
 
-    for s in config.feature_sets:
-        proc_files = np.array_split(s.files, mpiops.chunks)[mpiops.chunk_index]
-        new_files = [crop_tif(f, config.extents, 
-                              config.extents_are_pixel_coordinates, _new_fname(f)) 
-                     for f in proc_files]
-        new_files = mpiops.comm.allgather(new_files)
-        mpiops.comm.barrier()
-        s.files = list(itertools.chain(*new_files))
 
-def crop_mask(config, outdir=None):
+def crop_window(dataset, extents, pixel_coordinates=False):
     """
-    Crops the prediction mask listed under `config.mask`.
+    The window of a raster inside a bounding box.
+
+    Parameters
+    ----------
+    dataset : rasterio dataset
+        The open raster.
+    extents : tuple(float, float, float, float)
+        Bounding box to crop by, ordering is (xmin, ymin, xmax, ymax).
+        Any elements that are None are substituted with the bound of
+        the raster, bounds outside the raster are clipped to it.
+    pixel_coordinates : bool
+        If True, `extents` are pixel coordinates counted from the bottom
+        left corner of the raster.
+
+    Returns
+    -------
+    tuple
+        ((row_start, row_stop), (col_start, col_stop)), exclusive. Pixels
+        partly inside the bounding box are included.
     """
-    _logger.info("Cropping prediction mask...")
-    if outdir is None:
-        def _new_fname(fname):
-            return os.path.join(config.tmpdir, os.path.basename(fname))
-    else:
-        def _new_fname(fname):
-            return os.path.join(outdir, os.path.basename(fname))
-    if mpiops.chunk_index == 0:
-        new_mask = crop_tif(config.mask, config.extents, config.extents_are_pixel_coordinates, 
-                            _new_fname(config.mask))
-        config.mask = new_mask
+    bounds = dataset.bounds
+    if pixel_coordinates:
+        rw, rh = dataset.res
+        scale = rw, rh, rw, rh
+        origin = bounds[0], bounds[1], bounds[0], bounds[1]
+        extents = tuple(None if e is None else e * sc + o
+                        for e, sc, o in zip(extents, scale, origin))
+    xmin, ymin, xmax, ymax = \
+        tuple(bounds[i] if extents[i] is None else extents[i] for i in range(4))
+
+    A = dataset.transform
+    cols = sorted([(xmin - A.c) / A.a, (xmax - A.c) / A.a])
+    rows = sorted([(ymin - A.f) / A.e, (ymax - A.f) / A.e])
+
+    def _outward(lower, upper, size):
+        # bounds within rounding error of a pixel edge are on that edge
+        start = max(int(np.floor(lower + 1e-6)), 0)
+        stop = min(int(np.ceil(upper - 1e-6)), size)
+        if stop <= start:
+            raise ValueError("Crop extents {} do not overlap image {}"
+                             .format(extents, dataset.name))
+        return start, stop
+
+    return _outward(*rows, dataset.height), _outward(*cols, dataset.width)
+
 
 def crop_tif(filename, extents, pixel_coordinates=False, outfile=None, strict=False):
     """
@@ -484,9 +683,15 @@ class ImageWriter:
     nodata_value = np.array(-1e20, dtype='float32')
 
     def __init__(self, shape, bbox, crs, n_subchunks, outpath,
-                 outbands, band_tags=None, independent=False, **kwargs):
+                 outbands, band_tags=None, independent=False, parallel=False,
+                 **kwargs):
         """
         pass in additional geotif write options in kwargs
+
+        If `parallel` is True, every node writes its own partitions to
+        intermediate part files in a background thread instead of
+        sending them to node 0. The part files are merged into the
+        output geotiffs (one band per node at a time) on `close`.
         """
         # affine
         self.A, _, _ = image.bbox2affine(bbox[1, 0], bbox[0, 0],
@@ -495,9 +700,11 @@ class ImageWriter:
         self.shape = shape
         self.outbands = outbands
         self.bbox = bbox
+        self.crs = crs
         self.outpath = outpath
         self.n_subchunks = n_subchunks
         self.independent = independent  # mpi control
+        self.parallel = parallel and not independent
         self.sub_starts = [k[0] for k in np.array_split(
                            np.arange(self.shape[1]),
                            mpiops.chunks * self.n_subchunks)]
@@ -517,6 +724,19 @@ class ImageWriter:
         files = []
         file_names = []
 
+        if self.parallel:
+            self.file_names = [self.outpath.format(file_tags[band])
+                               for band in range(self.outbands)]
+            self.band_tags = band_tags
+            self.kwargs = kwargs
+            self.parts_dir = os.path.splitext(self.outpath.format('parts'))[0]
+            if mpiops.chunk_index == 0:
+                os.makedirs(self.parts_dir, exist_ok=True)
+            mpiops.comm.barrier()
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._pending = None
+            return
+
         if mpiops.chunk_index == 0:
             for band in range(self.outbands):
                 output_filename = self.outpath.format(file_tags[band])
@@ -561,6 +781,14 @@ class ImageWriter:
         if x.mask is not False:
             x.data[x.mask] = self.nodata_value
 
+        if self.parallel:
+            subindex = mpiops.chunks * subchunk_index + mpiops.chunk_index
+            data = np.ma.transpose(image, [2, 1, 0])[:self.outbands]  # untranspose
+            # Only one partition is buffered while the next is predicted
+            self._wait_pending()
+            self._pending = self._executor.submit(self._write_part, data.data, subindex)
+            return
+
         mpiops.comm.barrier()
         _logger.info("Writing partition to output file")
 
@@ -588,7 +816,52 @@ class ImageWriter:
 
         mpiops.comm.barrier()
 
+    def _part_name(self, subindex):
+        return os.path.join(self.parts_dir, 'part_{:06d}.tif'.format(subindex))
+
+    def _write_part(self, data, subindex):
+        ystart = self.sub_starts[subindex]
+        A = self.A * Affine.translation(0, ystart)
+        with rasterio.open(self._part_name(subindex), 'w', driver='GTiff',
+                           width=data.shape[2], height=data.shape[1],
+                           dtype=np.float32, count=data.shape[0], crs=self.crs,
+                           transform=A, nodata=self.nodata_value) as f:
+            f.write(data)
+
+    def _wait_pending(self):
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def _merge_parts(self):
+        _logger.info("Merging prediction parts into output files")
+        n_parts = len(self.sub_starts)
+        my_bands = np.array_split(np.arange(self.outbands),
+                                  mpiops.chunks)[mpiops.chunk_index]
+        for band in my_bands:
+            with rasterio.open(self.file_names[band], 'w', driver='GTiff',
+                               width=self.shape[0], height=self.shape[1],
+                               dtype=np.float32, count=1, crs=self.crs,
+                               transform=self.A, nodata=self.nodata_value,
+                               **self.kwargs) as f:
+                f.update_tags(1, image_type=self.band_tags[band])
+                for subindex in range(n_parts):
+                    with rasterio.open(self._part_name(subindex)) as part:
+                        data = part.read(int(band) + 1)
+                    ystart = self.sub_starts[subindex]
+                    window = ((ystart, ystart + data.shape[0]), (0, self.shape[0]))
+                    f.write(data[np.newaxis], window=window)
+
     def close(self):  # we can explicitly close rasters using this
+        if self.parallel:
+            self._wait_pending()
+            self._executor.shutdown()
+            mpiops.comm.barrier()
+            self._merge_parts()
+            mpiops.comm.barrier()
+            if mpiops.chunk_index == 0:
+                shutil.rmtree(self.parts_dir)
+            return
         if mpiops.chunk_index == 0:
             for f in self.files:
                 f.close()
@@ -617,34 +890,71 @@ def feature_names(config):
 
 
 def _iterate_sources(f, config):
+    """
+    Applies `f` to a :class:`RasterioImageSource` of every covariate file,
+    and logs the missing data of each result over all nodes.
+
+    Up to :data:`io_threads` files are read at once (GDAL releases the
+    GIL while decoding), so `f` must not communicate between nodes.
+
+    Returns
+    -------
+    list of OrderedDict
+        For each feature set, the result of `f` for each file keyed by
+        file name, sorted by name.
+    """
+    results = _read_sources(f, config)
+    log_missing(results)
+    return results
+
+
+def _read_sources(f, config):
+    # _iterate_sources without any communication, so it can be run in a
+    # background thread
+    tifs = [tif for s in config.feature_sets for tif in s.files]
+
+    def read(tif):
+        return f(RasterioImageSource(tif))
+
+    if io_threads > 1 and len(tifs) > 1:
+        with ThreadPoolExecutor(max_workers=io_threads) as pool:
+            xs = iter(pool.map(read, tifs))
+    else:
+        xs = (read(tif) for tif in tifs)
 
     results = []
     for s in config.feature_sets:
-        extracted_chunks = {}
-        for tif in s.files:
-            name = os.path.basename(tif)
-            image_source = RasterioImageSource(tif)
-            x = f(image_source)
-            # TODO this may hurt performance. Consider removal
-            if type(x) is np.ma.MaskedArray:
-                count = mpiops.count(x)
-                # if not np.all(count > 0):
-                #     s = ("{} has no data in at least one band.".format(name) +
-                #          " Valid_pixel_count: {}".format(count))
-                #     raise ValueError(s)
-                missing_percent = missing_percentage(x)
-                t_missing = mpiops.comm.allreduce(
-                    missing_percent) / mpiops.chunks
-                _logger.info("{}: {}px {:3.2f}% missing".format(
-                    name, count, t_missing))
-            extracted_chunks[name] = x
+        extracted_chunks = {os.path.basename(tif): next(xs) for tif in s.files}
         extracted_chunks = OrderedDict(sorted(
             extracted_chunks.items(), key=lambda t: t[0]))
-
         results.append(extracted_chunks)
     return results
 
 
+def log_missing(results):
+    """
+    Logs the pixel count and missing percentage of every masked array in
+    the results of :func:`_iterate_sources`, over all nodes. The
+    statistics of all arrays are reduced in a single allreduce. Must be
+    called by every node.
+    """
+    named = [(name, x) for r in results for name, x in r.items()
+             if type(x) is np.ma.MaskedArray]
+    if not named:
+        return
+    # per band pixel counts and the total size of every array, packed
+    # into one vector
+    local_counts = [np.append(np.ma.count(x, axis=0).ravel(), x.size)
+                    for _, x in named]
+    sizes = np.cumsum([len(c) for c in local_counts])[:-1]
+    counts = np.split(mpiops.comm.allreduce(np.concatenate(local_counts)),
+                      sizes)
+    for (name, _), count in zip(named, counts):
+        t_missing = (1.0 - count[:-1].sum() / count[-1]) * 100.0
+        _logger.info("{}: {}px {:3.2f}% missing".format(
+            name, count[:-1], t_missing))
+
+
 def image_resolutions(config):
     def f(image_source):
         r = image_source._full_res
@@ -654,21 +964,77 @@ def image_resolutions(config):
     return result
 
 
-def image_subchunks(subchunk_index, config):
+def image_subchunks(subchunk_index, config, log=True):
+    """
+    Reads partition `subchunk_index` of every covariate. If `log` is
+    False nothing is logged or communicated (see :func:`log_missing`).
+    """
 
     def f(image_source):
         r = features.extract_subchunks(image_source, subchunk_index,
                                        config.n_subchunks, config.patchsize)
         return r
+    if not log:
+        return _read_sources(f, config)
     result = _iterate_sources(f, config)
     return result
 
 
+def _intersection_key(image_source, targets, patchsize):
+    # The intersection depends on the covariate file, the target positions
+    # and the patchsize. The file is identified by its path, size and
+    # modification time rather than hashing its contents.
+    filename = os.path.abspath(image_source._filename)
+    stat = os.stat(filename)
+    h = hashlib.sha1()
+    h.update(filename.encode())
+    h.update('{} {} {} {}'.format(stat.st_size, stat.st_mtime_ns, patchsize,
+                                  image_source.window).encode())
+    h.update(np.ascontiguousarray(targets.positions, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def cached_point_features(image_source, targets, patchsize, cache_dir):
+    """
+    Intersect targets with an image, reusing an earlier intersection of
+    the same targets with the same, unchanged, file if there is one.
+
+    Intersections are stored in `cache_dir` as a pair of .npy files (data
+    and mask) named after the image and a key of the file's path, size and
+    modification time, the target positions and the patchsize. Each node
+    stores the intersection of its own targets.
+    """
+    key = _intersection_key(image_source, targets, patchsize)
+    stem = os.path.join(cache_dir, '{}_{}'.format(
+        os.path.splitext(os.path.basename(image_source._filename))[0], key))
+    data_file, mask_file = stem + '.data.npy', stem + '.mask.npy'
+    if os.path.exists(data_file) and os.path.exists(mask_file):
+        _logger.debug(':mpi:Loading intersection of {} from {}'.format(
+            image_source._filename, data_file))
+        return np.ma.MaskedArray(data=np.load(data_file),
+                                 mask=np.load(mask_file))
+
+    r = features.extract_point_features(image_source, targets, patchsize)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write under temporary names so a partial file is never picked up
+    for filename, a in ((mask_file, np.ma.getmaskarray(r)),
+                        (data_file, np.ma.getdata(r))):
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, a)
+        os.replace(tmp, filename)
+    return r
+
+
 def image_feature_sets(targets, config):
+    cache_dir = getattr(config, 'intersection_cache', None)
 
     def f(image_source):
-        r = features.extract_features(image_source, targets,
-                                      config.n_subchunks, config.patchsize)
+        if cache_dir:
+            return cached_point_features(image_source, targets,
+                                         config.patchsize, cache_dir)
+        r = features.extract_point_features(image_source, targets,
+                                            config.patchsize)
         return r
     result = _iterate_sources(f, config)
     return result
@@ -679,33 +1045,40 @@ def semisupervised_feature_sets(targets, config):
     frac = config.subsample_fraction
 
     def f(image_source):
-        r_t = features.extract_features(image_source, targets, n_subchunks=1,
-                                        patchsize=config.patchsize)
+        r_t = features.extract_point_features(image_source, targets,
+                                              patchsize=config.patchsize)
         r_a = features.extract_subchunks(image_source, subchunk_index=0,
                                          n_subchunks=1,
                                          patchsize=config.patchsize)
         if frac < 1.0:
-            np.random.seed(1)
-            r_a = r_a[np.random.rand(r_a.shape[0]) < frac]
+            rnd = np.random.RandomState(1)
+            r_a = r_a[rnd.rand(r_a.shape[0]) < frac]
 
         r_data = np.concatenate([r_t.data, r_a.data], axis=0)
-        r_mask = np.concatenate([r_t.mask, r_a.mask], axis=0)
+        r_mask = np.concatenate([np.ma.getmaskarray(r_t),
+                                 np.ma.getmaskarray(r_a)], axis=0)
         r = np.ma.masked_array(data=r_data, mask=r_mask)
         return r
     result = _iterate_sources(f, config)
     return result
 
-def unsupervised_feature_sets(config):
-    frac = config.subsample_fraction
+def unsupervised_feature_sets(config, fraction=None):
+    frac = config.subsample_fraction if fraction is None else fraction
+    n_subchunks = getattr(config, 'n_subchunks', 1)
 
     def f(image_source):
-        r = features.extract_subchunks(image_source, subchunk_index=0,
-                                       n_subchunks=1,
-                                       patchsize=config.patchsize)
-        if frac < 1.0:
-            np.random.seed(1)
-            r = r[np.random.rand(r.shape[0]) < frac]
-        return r
+        # the same seed for every source keeps the sampled rows aligned,
+        # and a generator per source keeps it safe to read them at once
+        rnd = np.random.RandomState(1)
+        rs = []
+        for i in range(n_subchunks):
+            r = features.extract_subchunks(image_source, subchunk_index=i,
+                                           n_subchunks=n_subchunks,
+                                           patchsize=config.patchsize)
+            if frac < 1.0:
+                r = r[rnd.rand(r.shape[0]) < frac]
+            rs.append(r)
+        return rs[0] if n_subchunks == 1 else np.ma.concatenate(rs, axis=0)
     result = _iterate_sources(f, config)
     return result
 
@@ -735,8 +1108,38 @@ def export_feature_ranks(measures, feats, scores, config):
             config.feature_ranks_file).savefig(config.plot_feature_rank_curves)
 
 def export_model(model, config):
-    with open(config.model_file, 'wb') as f:
-        pickle.dump((model, config.feature_sets, config.final_transform), f)
+    """
+    Save a trained model with the feature sets and final transform of
+    `config` to `config.model_file`, as a :mod:`~uncoverml.bundle` if
+    `config.model_bundle` is set and as a pickle otherwise.
+    """
+    if config.model_bundle:
+        bundle.save_bundle(config.model_file, model, config.feature_sets,
+                           config.final_transform)
+    else:
+        # the model may be memory mapped from a bundle at the same path, so
+        # it is pickled next to it before the bundle is replaced
+        tmp = config.model_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((model, config.feature_sets, config.final_transform), f)
+        if os.path.isdir(config.model_file):
+            shutil.rmtree(config.model_file)
+        os.replace(tmp, config.model_file)
+
+
+def load_model(model_file):
+    """
+    Load a model saved by :func:`export_model`, either format.
+
+    Returns
+    -------
+    The unpickled contents of the model file: normally a tuple of the
+    model, feature sets and final transform.
+    """
+    if bundle.is_bundle(model_file):
+        return bundle.load_bundle(model_file)
+    with open(model_file, 'rb') as f:
+        return pickle.load(f)
 
 def _make_valid_array_name(label):
     label = "_".join(label.split())
@@ -825,8 +1228,116 @@ def create_shared_training_data(targets_all, x_all):
     return SharedTrainingData(targets_all, x_all, obs_win, pos_win, field_wins, x_win)
 
 def deallocate_shared_training_data(training_data):
-    training_data.obs_win.Free()
-    training_data.pos_win.Free()
-    training_data.x_win.Free()
-    for win in training_data.field_wins:
-        win.Free()
+    # training data opened from a store is memory mapped and has no windows
+    for win in [training_data.obs_win, training_data.pos_win,
+                training_data.x_win] + list(training_data.field_wins):
+        if win is not None:
+            win.Free()
+
+
+_TRAINING_STORE_INDEX = 'index.json'
+
+
+def write_training_store(directory, targets, x, keep):
+    """
+    Writes the training data of all nodes to a memory mapped store.
+
+    Each node writes its own rows (those selected by `keep`) straight
+    into the store, in node order, so the training data is never
+    gathered. The store is a directory with one .npy file per column
+    group (covariate data, covariate mask, observations, positions and
+    each target field) and a small JSON index. It must be on a
+    filesystem shared by all nodes.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write the store to. Existing stores are
+        overwritten.
+    targets : :class:`~uncoverml.targets.Targets`
+        The targets of this node.
+    x : np.ma.MaskedArray
+        The transformed features of this node.
+    keep : np.ndarray
+        Boolean array of the rows of `x` and `targets` to store.
+
+    Returns
+    -------
+    SharedTrainingData
+        The store opened read-only with :func:`open_training_store`.
+    """
+    field_names = sorted(targets.fields.keys())
+    columns = OrderedDict()
+    columns['x_data'] = np.ma.getdata(x[keep])
+    columns['x_mask'] = np.ma.getmaskarray(x[keep])
+    columns['observations'] = np.ma.getdata(targets.observations[keep])
+    columns['positions'] = np.ma.getdata(targets.positions[keep])
+    for i, k in enumerate(field_names):
+        columns['field_{}'.format(i)] = np.ma.getdata(
+            np.asarray(targets.fields[k])[keep])
+    for k, v in columns.items():
+        if v.dtype.hasobject:
+            columns[k] = v.astype(str)
+
+    layouts = mpiops.comm.allgather(
+        [(v.shape, v.dtype.str) for v in columns.values()])
+    counts = [layout[0][0][0] for layout in layouts]
+    offset = sum(counts[:mpiops.chunk_index])
+    names = list(columns.keys())
+    masked = mpiops.comm.allreduce(int(np.ma.isMaskedArray(x))) > 0
+
+    if mpiops.chunk_index == 0:
+        os.makedirs(directory, exist_ok=True)
+        for c, name in enumerate(names):
+            shape = (sum(counts),) + tuple(layouts[0][c][0][1:])
+            dtype = np.result_type(*[np.dtype(l[c][1]) for l in layouts])
+            np.lib.format.open_memmap(os.path.join(directory, name + '.npy'),
+                                      mode='w+', dtype=dtype, shape=shape)
+        index = {'n': sum(counts), 'counts': counts, 'masked': masked,
+                 'fields': field_names}
+        with open(os.path.join(directory, _TRAINING_STORE_INDEX), 'w') as f:
+            json.dump(index, f)
+    mpiops.comm.barrier()
+
+    for name, v in columns.items():
+        store = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r+')
+        store[offset:offset + v.shape[0]] = v
+        store.flush()
+        del store
+    mpiops.comm.barrier()
+    _logger.info("Wrote {} training rows to {}".format(sum(counts), directory))
+    return open_training_store(directory)
+
+
+def open_training_store(directory):
+    """
+    Opens a store written by :func:`write_training_store`.
+
+    All columns are memory mapped read-only, so the store can be opened
+    by every node without copying it.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store.
+
+    Returns
+    -------
+    SharedTrainingData
+        The training targets and features. There are no shared memory
+        windows to free.
+    """
+    with open(os.path.join(directory, _TRAINING_STORE_INDEX)) as f:
+        index = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    x_all = load('x_data')
+    if index['masked']:
+        x_all = np.ma.MaskedArray(data=x_all, mask=load('x_mask'), copy=False)
+    fields = OrderedDict((k, load('field_{}'.format(i)))
+                         for i, k in enumerate(index['fields']))
+    targets_all = targets.Targets(load('positions'), load('observations'),
+                                  othervals=fields)
+    return SharedTrainingData(targets_all, x_all, None, None, [], None)
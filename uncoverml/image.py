@@ -1,6 +1,7 @@
 """
 Contains class and routines for reading chunked portions of images.
 """
+from functools import lru_cache
 import numpy as np
 import logging
 
@@ -33,6 +34,94 @@ def construct_splits(npixels, nchunks, overlap=0):
     return y_bounds
 
 
+class ImageGeometry:
+    """
+    The pixel grid of a raster, mapping between pixel corners and
+    coordinates with the affine relation ``origin + pixel * pixsize``.
+    Pixel k covers the half open interval between the coordinates of
+    corners k and k + 1, except the last pixel which also contains the
+    outer edge of the image.
+
+    Geometries are shared by every chunk of an image, see
+    :func:`image_geometry`.
+
+    Parameters
+    ----------
+    resolution : tuple of int
+        Width and height of the image in pixels.
+    origin : tuple of float
+        Coordinates of the corner of pixel (0, 0).
+    pixsize : tuple of float
+        Positive size of a pixel along each axis.
+    """
+    def __init__(self, resolution, origin, pixsize):
+        self.resolution = np.array(resolution, dtype=int)
+        self.origin = np.array(origin, dtype=float)
+        self.pixsize = np.array(pixsize, dtype=float)
+        # coordinates of the outer corner of the last pixel
+        self.outer = self.origin + self.resolution * self.pixsize
+
+    def pix2lonlat(self, xy):
+        """
+        Coordinates of the corners of the pixels (or pixel corners) `xy`,
+        an array of shape (n, 2) with values in [0, resolution].
+        """
+        xy = np.asarray(xy)
+        if np.any(xy < 0) or np.any(xy > self.resolution):
+            raise ValueError("Pixel is not in the image!")
+        return self.origin + xy * self.pixsize
+
+    def lonlat2pix(self, lonlat):
+        """
+        Pixels containing the points `lonlat`, an array of shape (n, 2).
+        Points outside the image map to -1 or to the resolution along
+        the axis they are outside of.
+        """
+        lonlat = np.asarray(lonlat, dtype=float)
+        xy = np.empty(lonlat.shape, dtype=int)
+        for axis in range(2):
+            xy[:, axis] = self._coord2pix(lonlat[:, axis], axis)
+        return xy
+
+    def _coord2pix(self, coords, axis):
+        origin = self.origin[axis]
+        pixsize = self.pixsize[axis]
+        res = self.resolution[axis]
+        with np.errstate(invalid='ignore'):
+            k = np.floor((coords - origin) / pixsize)
+        # nan sorts after every corner, like it does in searchsorted
+        k = np.clip(np.nan_to_num(k, nan=res), -1, res).astype(int)
+
+        # the division can round across a corner, so settle k against the
+        # corners exactly as they are computed, giving the last corner at or
+        # before each point
+        up = (k < res) & (origin + (k + 1) * pixsize <= coords)
+        k[up] += 1
+        down = (k >= 0) & (origin + k * pixsize > coords)
+        k[down] -= 1
+
+        # We want the *closed* interval, which means moving
+        # points on the end back by 1
+        k[coords == self.outer[axis]] -= 1
+        return k
+
+
+@lru_cache(maxsize=256)
+def _cached_geometry(resolution, origin, pixsize):
+    return ImageGeometry(resolution, origin, pixsize)
+
+
+def image_geometry(source):
+    """
+    The :class:`ImageGeometry` of an image source. Sources with the same
+    grid, such as the chunks of one covariate, share one geometry.
+    """
+    return _cached_geometry(
+        tuple(source.full_resolution[:2]),
+        (source.origin_longitude, source.origin_latitude),
+        (source.pixsize_x, source.pixsize_y))
+
+
 class Image:
     """
     Represents a raster Image. Can use to get a georeferenced chunk
@@ -87,17 +176,8 @@ class Image:
         assert self.pixsize_x > 0
         assert self.pixsize_y > 0
 
-        # construct the canonical pixel<->position map
-        pix_x = range(self._full_res[0] + 1)  # outer corner of last pixel
-        coords_x = [self._start_lon + float(k) * self.pixsize_x
-                    for k in pix_x]
-        self._coords_x = coords_x
-        pix_y = range(self._full_res[1] + 1)  # ditto
-        coords_y = [self._start_lat + float(k) * self.pixsize_y
-                    for k in pix_y]
-        self._coords_y = coords_y
-        self._pix_x_to_coords = dict(zip(pix_x, coords_x))
-        self._pix_y_to_coords = dict(zip(pix_y, coords_y))
+        # the canonical pixel<->position map
+        self._geometry = image_geometry(source)
 
         # exclusive y range of this chunk in full image
         ymin, ymax = construct_splits(self._full_res[1],
@@ -201,8 +281,7 @@ class Image:
         return eff_bbox
 
     def _global_pix2lonlat(self, xy):
-        result = np.array([[self._pix_x_to_coords[x],
-                           self._pix_y_to_coords[y]] for x, y in xy])
+        result = self._geometry.pix2lonlat(xy)
         return result
 
     def pix2lonlat(self, xy):
@@ -210,24 +289,14 @@ class Image:
         return result
 
     def _global_lonlat2pix(self, lonlat):
-        x = np.searchsorted(self._coords_x, lonlat[:, 0], side='right') - 1
-        x = x.astype(int)
-        ycoords = self._coords_y
-        y = np.searchsorted(ycoords, lonlat[:, 1], side='right') - 1
-        y = y.astype(int)
-
-        # We want the *closed* interval, which means moving
-        # points on the end back by 1
-        on_end_x = lonlat[:, 0] == self._coords_x[-1]
-        on_end_y = lonlat[:, 1] == self._coords_y[-1]
-        x[on_end_x] -= 1
-        y[on_end_y] -= 1
+        result = self._geometry.lonlat2pix(lonlat)
+        x = result[:, 0]
+        y = result[:, 1]
         if (not all(np.logical_and(x >= 0, x < self._full_res[0]))) or \
                 (not all(np.logical_and(y >= 0, y < self._full_res[1]))):
             raise ValueError("Queried location is not "
                              "in the image {}!".format(self.source._filename))
 
-        result = np.concatenate((x[:, np.newaxis], y[:, np.newaxis]), axis=1)
         return result
 
     def lonlat2pix(self, lonlat):
@@ -30,9 +30,12 @@ import os
 import pickle
 import warnings
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import chain
 from os.path import join, isdir, abspath
 import numpy as np
+from joblib import effective_n_jobs
 from revrand import StandardLinearModel, GeneralisedLinearModel
 from revrand.basis_functions import LinearBasis, RandomRBF, \
     RandomLaplace, RandomCauchy, RandomMatern32, RandomMatern52
@@ -40,7 +43,7 @@ from revrand.btypes import Parameter, Positive
 from revrand.likelihoods import Gaussian
 from revrand.optimize import Adam
 from revrand.utils import atleast_list
-from scipy.integrate import fixed_quad
+from scipy.special import roots_legendre
 from scipy.stats import norm
 
 from sklearn.svm import SVR, SVC
@@ -500,16 +503,9 @@ class RandomForestRegressor(RFR):
     """
 
     def predict_dist(self, X, interval=0.95):
-        if hasattr(self, "_notransform_predict"):
-            Ey = self._notransform_predict(X)
-        else:
-            Ey = self.predict(X)
-
-        Vy = np.zeros_like(Ey)
-        for dt in self.estimators_:
-            Vy += (dt.predict(X) - Ey)**2
-
-        Vy /= len(self.estimators_)
+        # the mean of the trees is the (untransformed) forest prediction
+        Ey, Vy = _ensemble_moments(self.estimators_, X,
+                                   effective_n_jobs(self.n_jobs))
 
         # FIXME what if elements of Vy are zero?
 
@@ -545,10 +541,10 @@ class RandomForestRegressorMulti():
         for t in process_rfs:
             _logger.info(':mpi:training forest {} using process {}'.format(t, mpiops.chunk_index))
 
-            np.random.seed(self.random_state + t)
-
-            # change random state in each forest
-            self.kwargs['random_state'] = np.random.randint(0, 10000)
+            # change random state in each forest, without touching the global
+            # random state that other models fitted at the same time use
+            rnd = np.random.RandomState(self.random_state + t)
+            self.kwargs['random_state'] = rnd.randint(0, 10000)
             rf = RandomForestTransformed(
                 n_estimators=self.n_estimators, **self.kwargs)
             rf.fit(x, y)
@@ -567,18 +563,16 @@ class RandomForestRegressorMulti():
             _logger.warning(':mpi:Train first')
             return
 
-        y_pred = np.zeros((x.shape[0], self.forests * self.n_estimators))
-
+        estimators = []
         for t in range(self.forests):
             if self.parallel:  # used in training
                 f = self._randomforests['rf_model_{}'.format(t)]
             else:  # used when parallel is false, i.e., during x-val
                 f = self._randomforests['rf_model_{}_{}'.format(t, mpiops.chunk_index)]
-            for m, dt in enumerate(f.estimators_):
-                y_pred[:, t * self.n_estimators + m] = dt.predict(x)
+            estimators.extend(f.estimators_)
 
-        y_mean = np.mean(y_pred, axis=1)
-        y_var = np.var(y_pred, axis=1)
+        y_mean, y_var = _ensemble_moments(
+            estimators, x, effective_n_jobs(self.kwargs.get('n_jobs')))
 
         # Determine quantiles
         ql, qu = norm.interval(interval, loc=y_mean, scale=np.sqrt(y_var))
@@ -751,36 +745,11 @@ def transform_targets(Regressor):
                     return Ey, Vy, ql, qu
 
                 # All other transforms require quadrature
-                Ey = np.empty_like(Ey_t)
-                Vy = np.empty_like(Vy_t)
-
-                # Used fixed order quadrature to transform prob. estimates
-                for i, (Eyi, Vyi) in enumerate(zip(Ey_t, Vy_t)):
-
-                    # Establish bounds
-                    Syi = np.sqrt(Vyi)
-                    a, b = Eyi - 3 * Syi, Eyi + 3 * Syi  # approx 99% bounds
-
-                    # Quadrature
-                    Ey[i], _ = fixed_quad(self.__expec_int, a, b, n=QUADORDER,
-                                          args=(Eyi, Syi))
-                    Vy[i], _ = fixed_quad(self.__var_int, a, b, n=QUADORDER,
-                                          args=(Ey[i], Eyi, Syi))
-
+                Ey, Vy = _quadrature_moments(self.target_transform, Ey_t, Vy_t)
                 ql, qu = norm.interval(interval, loc=Ey, scale=np.sqrt(Vy))
 
                 return Ey, Vy, ql, qu
 
-        def __expec_int(self, x, mu, std):
-            px = _normpdf(x, mu, std)
-            Ex = self.target_transform.itransform(x) * px
-            return Ex
-
-        def __var_int(self, x, Ex, mu, std):
-            px = _normpdf(x, mu, std)
-            Vx = (self.target_transform.itransform(x) - Ex) ** 2 * px
-            return Vx
-
     return TransformedRegressor
 
 
@@ -1191,7 +1160,111 @@ _SQRT2PI = np.sqrt(2 * np.pi)
 # Faster than calling scipy's norm.pdf for quadrature. This is called with HIGH
 # frequency!
 def _normpdf(x, mu, std):
-    if std == 0:
+    if np.isscalar(std) and std == 0:
         _logger.warning("STD of 0 in _normpdf, stabilising with very small value")
         std += np.nextafter(np.float32(0), np.float32(1))
     return 1. / (_SQRT2PI * std) * np.exp(-0.5 * ((x - mu) / std)**2)
+
+
+def _ensemble_moments(estimators, X, n_jobs=1, chunk_size=100000):
+    """
+    Mean and variance of the predictions of an ensemble of estimators
+
+    Every estimator predicts once per chunk of rows, and its predictions
+    are folded into running means and sums of squares (Welford's method),
+    so the memory used does not depend on the number of estimators. The
+    estimators are split between n_jobs threads, whose moments are then
+    merged (Chan et al.).
+
+    Parameters
+    ----------
+    estimators: list
+        Fitted estimators with a predict method, e.g. decision trees
+    X: ndarray
+        (n, d) inputs
+    n_jobs: int
+        Number of threads to predict with
+    chunk_size: int
+        Number of rows predicted at a time
+
+    Returns
+    -------
+    Ey: ndarray
+        (n,) mean prediction of the estimators
+    Vy: ndarray
+        (n,) variance of the predictions of the estimators
+    """
+    groups = [g for g in np.array_split(np.arange(len(estimators)),
+                                        max(n_jobs, 1)) if len(g)]
+
+    def moments(rows, group):
+        count, mean, m2 = 0, 0., 0.
+        for i in group:
+            y = estimators[i].predict(X[rows])
+            count += 1
+            delta = y - mean
+            mean = mean + delta / count
+            m2 = m2 + delta * (y - mean)
+        return count, mean, m2
+
+    Ey = np.empty(X.shape[0])
+    Vy = np.empty(X.shape[0])
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        for start in range(0, X.shape[0], chunk_size):
+            rows = slice(start, start + chunk_size)
+            count, mean, m2 = 0, 0., 0.
+            for n_b, mean_b, m2_b in executor.map(partial(moments, rows), groups):
+                total = count + n_b
+                delta = mean_b - mean
+                mean = mean + delta * n_b / total
+                m2 = m2 + m2_b + delta ** 2 * count * n_b / total
+                count = total
+            Ey[rows] = mean
+            Vy[rows] = m2 / count
+    return Ey, Vy
+
+
+def _quadrature_moments(target_transform, Ey_t, Vy_t, chunk_size=65536):
+    """
+    Mean and variance of the inverse target transform of normal variates
+
+    Integrates the inverse transform over mean +/- 3 standard deviations of
+    each latent normal with fixed order Gauss-Legendre quadrature, i.e. the
+    same as scipy.integrate.fixed_quad with n=QUADORDER, for chunk_size rows
+    at a time.
+
+    Parameters
+    ----------
+    target_transform: uncoverml.transforms.target.Identity
+        A fitted target transform
+    Ey_t: ndarray
+        (n,) latent means
+    Vy_t: ndarray
+        (n,) latent variances
+
+    Returns
+    -------
+    Ey: ndarray
+        (n,) means of the inverse transformed variates
+    Vy: ndarray
+        (n,) variances of the inverse transformed variates
+    """
+    nodes, weights = roots_legendre(QUADORDER)
+    Ey = np.empty_like(Ey_t)
+    Vy = np.empty_like(Vy_t)
+    for start in range(0, len(Ey_t), chunk_size):
+        rows = slice(start, start + chunk_size)
+        mu = Ey_t[rows, np.newaxis]
+        std = np.sqrt(Vy_t[rows, np.newaxis])
+        half = 3 * std  # approx 99% bounds, (b - a) / 2
+        x = mu + half * nodes
+
+        if np.any(std == 0):
+            _logger.warning("STD of 0 in _normpdf, stabilising with very small value")
+            std = np.where(std == 0, np.nextafter(np.float32(0), np.float32(1)), std)
+        px = _normpdf(x, mu, std)
+        fx = np.reshape(target_transform.itransform(x.ravel()), x.shape)
+
+        Ey[rows] = half[:, 0] * (fx * px).dot(weights)
+        Vy[rows] = half[:, 0] * ((fx - Ey[rows, np.newaxis]) ** 2 * px).dot(weights)
+    return Ey, Vy
@@ -1,5 +1,6 @@
 import logging
 import pickle
+import threading
 
 import numpy as np
 from mpi4py import MPI
@@ -23,6 +24,31 @@ chunk_index = comm.Get_rank()
 the rank of the node.
 """
 
+_node_comms = None
+
+# largest message sent at once when copying a shared array between nodes
+_BCAST_BYTES = 1 << 28
+
+
+def node_comms():
+    """
+    Communicators for sharing memory between the nodes on each host.
+
+    Returns
+    -------
+    tuple of MPI communicators
+        The nodes on this host, and the first node of every host (None on
+        the other nodes).
+    """
+    global _node_comms
+    if _node_comms is None:
+        node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=chunk_index)
+        leaders = comm.Split(0 if node.Get_rank() == 0 else MPI.UNDEFINED,
+                             key=chunk_index)
+        _node_comms = node, (None if leaders == MPI.COMM_NULL else leaders)
+    return _node_comms
+
+
 def create_shared_array(data, root=0, writeable=False):
     """
     Create a shared numpy array among MPI nodes. To access the data,
@@ -33,13 +59,18 @@ def create_shared_array(data, root=0, writeable=False):
     When finished with the data, set `shared = None` and call 
     `win.Free()`.
 
+    The array is held once per host: nodes on the same host share one
+    window, and the data is copied in bulk from the root to the first
+    node of every other host. Masked arrays keep their mask, which is
+    shared in the same window as the data.
+
     Caution: any node with a handle on the shared array can modify its
     contents. To be safe, the shared array is set to read-only by 
     default.
 
     Parameters
     ----------
-    data : numpy.ndarray
+    data : numpy.ndarray or numpy.ma.MaskedArray
         The numpy array to share.
     root : int
         Rank of the root node that contains the original data.
@@ -51,37 +82,57 @@ def create_shared_array(data, root=0, writeable=False):
     tuple of numpy.ndarray, MPI window
     """
     if chunk_index == root:
-        shape = data.shape
-        dtype = data.dtype
-        item_size = dtype.itemsize
-        size = np.prod(shape) * item_size
+        masked = np.ma.isMaskedArray(data) and \
+            np.ma.getmask(data) is not np.ma.nomask
+        meta = data.shape, data.dtype, masked
     else:
-        shape = None
-        dtype = None
-        item_size = 1
-        size = 1
+        meta = None
 
     comm.barrier()
 
-    shape = comm.bcast(shape, root=root)
-    dtype = comm.bcast(dtype, root=root)
-    win = MPI.Win.Allocate_shared(size, item_size, comm=comm)
-
-    buf, _ = win.Shared_query(root)
+    shape, dtype, masked = comm.bcast(meta, root=root)
+    node, leaders = node_comms()
+
+    # the mask follows the data, aligned for any dtype
+    data_bytes = int(np.prod(shape)) * dtype.itemsize
+    mask_offset = -(-data_bytes // 8) * 8
+    size = mask_offset + int(np.prod(shape)) if masked else data_bytes
+    win = MPI.Win.Allocate_shared(size if node.Get_rank() == 0 else 0, 1,
+                                  comm=node)
+    buf, _ = win.Shared_query(0)
+    raw = np.ndarray(buffer=buf, dtype=np.uint8, shape=(size,))
     shared = np.ndarray(buffer=buf, dtype=dtype, shape=shape)
+    if masked:
+        mask = np.ndarray(buffer=buf, dtype=bool, shape=shape,
+                          offset=mask_offset)
 
-    # Copy data into shared arrays - is there a better way than 
-    #  iterating the whole thing?
     if chunk_index == root:
-        for index, x in np.ndenumerate(data):
-            shared[index] = x
-        shared.flags.writeable = writeable
+        np.copyto(shared, np.ma.getdata(data))
+        if masked:
+            np.copyto(mask, np.ma.getmaskarray(data))
+    node.Barrier()
+
+    # copy from the root's host to the other hosts
+    has_root = node.allreduce(chunk_index == root, op=MPI.LOR)
+    if leaders is not None and leaders.Get_size() > 1:
+        source = leaders.allreduce(leaders.Get_rank() if has_root else -1,
+                                   op=MPI.MAX)
+        for start in range(0, size, _BCAST_BYTES):
+            leaders.Bcast(raw[start:start + _BCAST_BYTES], root=source)
 
     comm.barrier()
 
+    if masked:
+        shared = np.ma.MaskedArray(data=shared, mask=mask, copy=False)
+    if chunk_index == root:
+        shared.flags.writeable = writeable
+        if masked:
+            shared.mask.flags.writeable = writeable
+
     # Make sure to call `shared = None` and `win.free()` to deallocate 
     #  the shared memory when done with it.
-    return shared, win        
+    return shared, win
+
 
 def run_once(f, *args, **kwargs):
     """Run a function on one node, broadcast result to all
@@ -109,6 +160,70 @@ def run_once(f, *args, **kwargs):
     return result
 
 
+class TaskCounter:
+    """
+    A counter shared by all nodes, for handing out tasks dynamically:
+    every call to :meth:`next` on any node returns a different number,
+    counting up from 0. The counter lives in a window on the root node
+    and is incremented with an atomic fetch-and-add, so nodes claim
+    tasks without waiting for each other.
+
+    Many MPI libraries only serve one-sided operations on a window while
+    its owner is inside an MPI call, and the root node also runs tasks.
+    So while the counter exists, the root polls MPI from a background
+    thread every `progress_interval` seconds, if MPI was initialised
+    with MPI_THREAD_MULTIPLE. Otherwise claims by the other nodes may
+    wait until the root claims its next task.
+
+    Creating and freeing the counter are collective operations.
+    :meth:`next` must only be called from one thread of a node.
+    """
+
+    def __init__(self, root=0, progress_interval=0.01):
+        self._root = root
+        self._win = MPI.Win.Allocate(8 if chunk_index == root else 0, 8,
+                                     comm=comm)
+        if chunk_index == root:
+            self._win.Lock(root, MPI.LOCK_EXCLUSIVE)
+            self._win.Put(np.zeros(1, dtype=np.int64), root)
+            self._win.Unlock(root)
+        self._progress = None
+        self._stop = threading.Event()
+        if chunks > 1 and chunk_index == root:
+            if MPI.Query_thread() == MPI.THREAD_MULTIPLE:
+                self._progress = threading.Thread(
+                    target=self._poll, args=(progress_interval,),
+                    daemon=True)
+                self._progress.start()
+            else:
+                log.warning('MPI does not support threads, so tasks are '
+                            'only handed out while the root node is in MPI')
+        comm.barrier()
+
+    def _poll(self, interval):
+        # Iprobe enters the MPI progress engine, which serves the other
+        # nodes' fetch-and-adds on the window
+        while not self._stop.wait(interval):
+            comm.Iprobe(MPI.ANY_SOURCE, MPI.ANY_TAG)
+
+    def next(self):
+        """The next number of the counter."""
+        value = np.zeros(1, dtype=np.int64)
+        self._win.Lock(self._root, MPI.LOCK_SHARED)
+        self._win.Fetch_and_op(np.ones(1, dtype=np.int64), value, self._root,
+                               0, MPI.SUM)
+        self._win.Unlock(self._root)
+        return int(value[0])
+
+    def free(self):
+        """Free the counter once every node is done with it."""
+        comm.barrier()
+        self._stop.set()
+        if self._progress is not None:
+            self._progress.join()
+        self._win.Free()
+
+
 def sum_axis_0(x, y, dtype):
     s = np.ma.sum(np.ma.vstack((x, y)), axis=0)
     return s
@@ -160,20 +275,189 @@ def outer_count(x):
     return x_n_outer
 
 
-def mean(x):
-    x_n = count(x)
-    x_sum_local = np.ma.sum(x, axis=0)
-    x_sum = comm.allreduce(x_sum_local, op=sum0_op)
-    still_masked = np.ma.count_masked(x_sum)
-    if still_masked != 0:
-        log.info('Reported x_sum: ' + ', '.join([str(s) for s in x_sum]))
+def _local_moments(x, cross):
+    # Count, mean and sum of squared deviations of the unmasked values in
+    # each column. The cross products are of the values less a per column
+    # shift, over the rows where both columns are present.
+    # Only one float copy of x is made, and it is centred in place.
+    mask = np.ma.getmaskarray(x)
+    n = (mask.shape[0] - mask.sum(axis=0)).astype(float)
+    y = np.array(np.ma.getdata(x), dtype=float)
+    np.copyto(y, 0., where=mask)
+    mean = y.sum(axis=0) / np.maximum(n, 1)
+    y -= mean
+    np.copyto(y, 0., where=mask)
+    m2 = np.einsum('ij,ij->j', y, y)
+    if not cross:
+        return n, mean, m2
+    present = np.subtract(1., mask, dtype=float)
+    return (n, mean, m2, mean.copy(), np.dot(present.T, present),
+            np.dot(y.T, present), np.dot(y.T, y))
+
+
+def merge_moments(a, b):
+    """
+    Merge the moments of two sets of rows (Chan et al.). Either set may
+    be None if it has no rows.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    n_a, mean_a, m2_a = a[:3]
+    n_b, mean_b, m2_b = b[:3]
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, mean_a + delta * n_b / n, 0.)
+        m2 = np.where(n > 0, m2_a + m2_b + delta ** 2 * n_a * n_b / n, 0.)
+    if len(a) == 3:
+        return n, mean, m2
+
+    # move b's cross products to a's shift, then add them
+    shift, N_a, A_a, S_a = a[3:]
+    shift_b, N_b, A_b, S_b = b[3:]
+    e = shift_b - shift
+    eA = A_b * e[np.newaxis, :]
+    S = S_a + S_b + eA + eA.T + np.outer(e, e) * N_b
+    A = A_a + A_b + e[:, np.newaxis] * N_b
+    return n, mean, m2, shift, N_a + N_b, A, S
+
+
+def _pack_moments(partial, d, cross):
+    # One contiguous float64 buffer: a header of whether there are any
+    # rows, the number of columns and whether there are cross products,
+    # then every array of the moments flattened.
+    size = 3 + 3 * d + (d + 3 * d * d if cross else 0)
+    buf = np.zeros(size)
+    buf[1:3] = d, cross
+    if partial is not None:
+        buf[0] = 1.
+        np.concatenate([np.ravel(a) for a in partial], out=buf[3:])
+    return buf
+
+
+def _unpack_moments(buf):
+    if buf[0] == 0.:
+        return None
+    d, cross = int(buf[1]), bool(buf[2])
+    shapes = [(d,)] * 3 + ([(d,), (d, d), (d, d), (d, d)] if cross else [])
+    parts = []
+    start = 3
+    for shape in shapes:
+        stop = start + int(np.prod(shape))
+        parts.append(buf[start:stop].reshape(shape))
+        start = stop
+    return tuple(parts)
+
+
+def _merge_packed_moments(inbuf, outbuf, datatype):
+    # MPI reduction of two packed buffers, see `reduce_moments`
+    a = np.frombuffer(inbuf, dtype=np.float64)
+    b = np.frombuffer(outbuf, dtype=np.float64)
+    d, cross = int(b[1]), bool(b[2])
+    b[:] = _pack_moments(merge_moments(_unpack_moments(a),
+                                       _unpack_moments(b)), d, cross)
+
+
+moments_op = MPI.Op.Create(_merge_packed_moments, commute=True)
+
+
+def moments(x, cross=False):
+    """
+    Count, mean and sum of squared deviations of every column of x, over
+    all nodes, ignoring masked values.
+
+    Each node summarises its rows in one traversal, and the summaries are
+    packed in one buffer and merged in one allreduce (Chan et al.'s
+    parallel merge), so this is both cheaper and numerically steadier
+    than separate passes for the mean, the variance and the covariance.
+
+    Parameters
+    ----------
+    x : numpy.ma.MaskedArray
+        (n, d) array of local data
+    cross : bool
+        If True, also return the covariance of the columns, each pair
+        computed over the rows where both are present.
+
+    Returns
+    -------
+    n : numpy.ndarray
+        (d,) number of unmasked values in each column
+    mean : numpy.ndarray
+        (d,) mean of each column
+    m2 : numpy.ndarray
+        (d,) sum of squared deviations from the mean of each column
+    cov : numpy.ndarray
+        (d, d) covariance, only if `cross` is True
+    """
+    return reduce_moments(_local_moments(x, cross), cross)
+
+
+def accumulate_moments(partial, x, cross=False):
+    """
+    Merge the moments of the local rows x into `partial`, the moments of
+    earlier local rows (None for the first rows). Nothing is
+    communicated, so x can be read in as many pieces as needed and the
+    result reduced once with `reduce_moments`.
+    """
+    return merge_moments(partial, _local_moments(x, cross))
+
+
+def reduce_moments(partial, cross=False):
+    """
+    Combine the moments accumulated by every node, and return them as
+    `moments` does. `partial` may be None on nodes without rows.
+
+    The moments of every node are packed into one float64 buffer, which
+    is reduced with a single buffer Allreduce that merges two buffers at
+    a time, so each node only holds a few buffers of O(d^2) values.
+    """
+    d = np.array([0 if partial is None else len(partial[0])])
+    comm.Allreduce(MPI.IN_PLACE, d, op=MPI.MAX)
+    d = int(d[0])
+    buf = _pack_moments(partial, d, cross)
+    # the whole buffer is one element, so MPI never splits it when it
+    # reduces large messages in segments
+    datatype = MPI.DOUBLE.Create_contiguous(len(buf)).Commit()
+    try:
+        comm.Allreduce(MPI.IN_PLACE, [buf, 1, datatype], op=moments_op)
+    finally:
+        datatype.Free()
+    result = _unpack_moments(buf)
+    if result is None:
+        raise ValueError("Can't compute mean: no node has any rows")
+    n, mean, m2 = result[:3]
+    if np.any(n == 0):
+        log.info('Reported counts: ' + ', '.join([str(s) for s in n]))
         raise ValueError("Can't compute mean: At least 1 column has nodata")
-    if hasattr(x_sum, 'mask'):
-        x_sum = x_sum.data
-    mean = x_sum / x_n
+    if not cross:
+        return n, mean, m2
+
+    shift, N, A, S = result[3:]
+    delta = shift - mean
+    dA = A * delta[np.newaxis, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = (S + dA + dA.T + np.outer(delta, delta) * N) / N
+    return n, mean, m2, cov
+
+
+def mean(x):
+    _, mean, _ = moments(x)
     return mean
 
 
+def mean_sd(x):
+    n, mean, m2 = moments(x)
+    return mean, np.sqrt(m2 / n)
+
+
+def mean_covariance(x):
+    _, mean, _, cov = moments(x, cross=True)
+    return mean, cov
+
+
 def minimum(x):
     x_min_local = np.ma.min(x, axis=0)
     x_min = comm.allreduce(x_min_local, op=min0_op)
@@ -187,9 +471,7 @@ def minimum(x):
 
 
 def sd(x):
-    x_mean = mean(x)
-    delta_mean = mean(power((x - x_mean), 2))
-    sd = np.sqrt(delta_mean)
+    _, sd = mean_sd(x)
     return sd
 
 
@@ -218,8 +500,7 @@ def outer(x):
 
 
 def covariance(x):
-    x_mean = mean(x)
-    cov = outer(x - x_mean) / outer_count(x)
+    _, cov = mean_covariance(x)
     return cov
 
 
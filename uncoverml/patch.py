@@ -15,6 +15,9 @@ def grid_patches(image, pwidth):
     Generate (overlapping) patches from an image. This function extracts square
     patches from an image in an overlapping, dense grid.
 
+    With pwidth = 0 every pixel is its own patch, and the result is a view
+    of the image if the image is contiguous.
+
     Parameters
     ----------
         image: ndarray
@@ -32,12 +35,49 @@ def grid_patches(image, pwidth):
     """
     # Check and get image dimensions
     assert image.ndim == 3
+    if pwidth == 0:
+        return image.reshape(-1, 1, 1, image.shape[2])
+    side = 2 * pwidth + 1
+    npatches = (image.shape[0] - side + 1) * (image.shape[1] - side + 1)
+    x = np.empty((npatches, side, side, image.shape[2]), dtype=image.dtype)
+    for start, patches in iter_grid_patches(image, pwidth):
+        x[start:start + len(patches)] = patches
+    return x
+
+
+def iter_grid_patches(image, pwidth, max_patches=65536):
+    """
+    Generate the patches of :func:`grid_patches` in blocks of up to
+    `max_patches`, so that the full patch array is never held in memory.
+    Each block is copied from a strided (windowed) view of the image.
+
+    Parameters
+    ----------
+        image: ndarray
+            an array of shape (x, y, channels).
+        pwidth: int
+            the half-width of the square patches to extract, in pixels.
+        max_patches: int, optional
+            the most patches in a block. Blocks are whole rows of patches
+            (at least one row).
+
+    Yields
+    ------
+        start: int
+            index of the first patch of the block in :func:`grid_patches`
+        patches: ndarray
+            An array of shape (npatches, psize, psize, channels), where
+            psize = pwidth * 2 + 1
+    """
+    assert image.ndim == 3
     window = (2 * pwidth + 1, 2 * pwidth + 1, 1)
     x = skimage.util.view_as_windows(image, window_shape=window, step=1)
     # window_z, img_x, img_y, window_x, window_y, channel
     x = x.transpose((5, 0, 1, 3, 4, 2))[0]
-    x = x.reshape(-1, x.shape[2], x.shape[3], x.shape[4])
-    return x
+    rows_per_block = max(1, max_patches // max(1, x.shape[1]))
+    for row in range(0, x.shape[0], rows_per_block):
+        block = x[row:row + rows_per_block]
+        yield row * x.shape[1], block.reshape((-1,) + block.shape[2:])
 
 
 def point_patches(image, pwidth, points):
@@ -95,13 +135,20 @@ def _image_to_data(image):
 def all_patches(image, patchsize):
     data, mask, data_dtype = _image_to_data(image)
     patches = grid_patches(data, patchsize)
-    patch_mask = grid_patches(mask, patchsize)
+    # images without missing data keep an empty mask
+    if np.ndim(mask) == 0:
+        patch_mask = np.ma.nomask if not mask \
+            else np.ones(patches.shape, dtype=bool)
+    else:
+        patch_mask = grid_patches(mask, patchsize)
     result = np.ma.masked_array(data=patches, mask=patch_mask)
     return result
 
 
 def patches_at_target(image, patchsize, targets):
     data, mask, data_dtype = _image_to_data(image)
+    if np.ndim(mask) == 0:
+        mask = np.full(data.shape, bool(mask))
 
     lonlats = targets.positions
     valid = image.in_bounds(lonlats)
@@ -1,4 +1,9 @@
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from itertools import compress, chain
 import numpy as np
 import csv
@@ -125,9 +130,12 @@ def _fix_for_corrupt_data(x, feature_names):
     return x
 
 
-def _get_data(subchunk, config):
+def _get_data(subchunk, config, extracted_chunk_sets=None):
     transform_sets = [k.transform_set for k in config.feature_sets]
-    extracted_chunk_sets = geoio.image_subchunks(subchunk, config)
+    if extracted_chunk_sets is None:
+        extracted_chunk_sets = geoio.image_subchunks(subchunk, config)
+    else:
+        geoio.log_missing(extracted_chunk_sets)
     _logger.info("Applying feature transforms")
     x = features.transform_features(extracted_chunk_sets, transform_sets,
                                     config.final_transform, config)[0]
@@ -141,13 +149,19 @@ def _get_data(subchunk, config):
     return _mask_rows(x, subchunk, config), features_names
 
 
-def _get_lon_lat(subchunk, config):
+def _get_lon_lat(subchunk, config, imputers=None):
+    # `imputers` holds the lon/lat imputers by covariate file, so that the
+    # partitions of one prediction share the tree built on the first one
+    imputers = {} if imputers is None else imputers
+
     def _impute_lat_lon(cov_file, subchunk, config):
         cov = geoio.RasterioImageSource(cov_file)
         cov_data = features.extract_subchunks(cov, subchunk,
                                               config.n_subchunks,
                                               config.patchsize)
-        nn_imputer = transforms.NearestNeighboursImputer()
+        if cov_file not in imputers:
+            imputers[cov_file] = transforms.NearestNeighboursImputer()
+        nn_imputer = imputers[cov_file]
         cov_data = nn_imputer(cov_data.reshape(cov_data.shape[0], 1))
         return cov_data
     if config.lon_lat:
@@ -197,21 +211,122 @@ def shapefile_prediction(config, model):
 
     geoio.write_shapefile_prediction(y_star, model.get_predict_tags(), positions, config)
     
-def render_partition(model, subchunk, image_out, config):
-    x, feature_names = _get_data(subchunk, config)
+@contextmanager
+def _timed(timings, stage):
+    start = time.time()
+    yield
+    timings[stage] = timings.get(stage, 0.) + time.time() - start
+
+
+def render_partition(model, subchunk, image_out, config,
+                     extracted_chunk_sets=None, timings=None,
+                     lon_lat_imputers=None):
+    """
+    Predicts partition `subchunk` of the image and writes it to
+    `image_out`. The covariates are read unless they are given as
+    `extracted_chunk_sets` (from :func:`geoio.image_subchunks`). The time
+    spent in each stage is added to the `timings` dictionary if given.
+    The lon/lat imputers are taken from (or added to) the
+    `lon_lat_imputers` dictionary if given, and fitted on this partition
+    otherwise.
+    """
+    timings = {} if timings is None else timings
+    with _timed(timings, 'transform'):
+        x, feature_names = _get_data(subchunk, config, extracted_chunk_sets)
     total_gb = mpiops.comm.allreduce(x.nbytes / 1e9)
     _logger.info("Loaded {:2.4f}GB of image data".format(total_gb))
     alg = config.algorithm
     _logger.info("Predicting targets for {}.".format(alg))
     
-    y_star = predict(x, model, interval=config.quantiles,
-                     lon_lat=_get_lon_lat(subchunk, config),
-                     bootstrap_predictions=config.bootstrap_predictions)
+    with _timed(timings, 'predict'):
+        y_star = predict(x, model, interval=config.quantiles,
+                         lon_lat=_get_lon_lat(subchunk, config,
+                                              lon_lat_imputers),
+                         bootstrap_predictions=config.bootstrap_predictions)
 
     if config.clustering and config.cluster_analysis:
         cluster_analysis(x, y_star, subchunk, config, feature_names)
     # cluster_analysis(x, y_star, subchunk, config, feature_names)
-    image_out.write(y_star, subchunk)
+    with _timed(timings, 'write'):
+        image_out.write(y_star, subchunk)
+
+
+def _prefetch_partitions(config, depth, timings):
+    # Reads the covariates of each partition in a background thread,
+    # holding at most `depth` read partitions that are waiting to be used.
+    # Reading does not communicate, so it can't interfere with the
+    # collective operations of the main thread.
+    partitions = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # gives up if the main thread has stopped taking partitions
+        while not stop.is_set():
+            try:
+                partitions.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for i in range(config.n_subchunks):
+                with _timed(timings, 'read'):
+                    chunk_sets = geoio.image_subchunks(i, config, log=False)
+                if not put((chunk_sets, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        for i in range(config.n_subchunks):
+            with _timed(timings, 'wait'):
+                chunk_sets, error = partitions.get()
+            if error is not None:
+                raise error
+            yield i, chunk_sets
+    finally:
+        stop.set()
+        thread.join()
+
+
+def render_partitions(model, image_out, config, prefetch=0):
+    """
+    Predicts every partition of the image and writes them to `image_out`.
+
+    With `prefetch` > 0 the covariates of the next partitions are read
+    in a background thread while the current partition is transformed
+    and predicted (and, with `parallel_write`, the previous one is
+    written), holding at most `prefetch` partitions in memory besides the
+    current one and the one being read. The time spent in each stage,
+    the longest over all nodes, is logged at the end. The lon/lat
+    imputers are fitted on the first partition and reused for the rest.
+    """
+    timings = OrderedDict((k, 0.) for k in
+                          ['read', 'wait', 'transform', 'predict', 'write'])
+    lon_lat_imputers = {}
+    start = time.time()
+    if prefetch > 0:
+        partitions = _prefetch_partitions(config, prefetch, timings)
+    else:
+        partitions = ((i, None) for i in range(config.n_subchunks))
+
+    for i, chunk_sets in partitions:
+        _logger.info("starting to render partition {}".format(i+1))
+        render_partition(model, i, image_out, config, chunk_sets, timings,
+                         lon_lat_imputers)
+
+    timings['total'] = time.time() - start
+    if prefetch <= 0:
+        # reading is part of the transform stage
+        del timings['read'], timings['wait']
+    stages = mpiops.comm.allreduce(np.array(list(timings.values())),
+                                   op=mpiops.max0_op)
+    _logger.info("Prediction stage times (s): " + ", ".join(
+        "{} {:.1f}".format(k, t) for k, t in zip(timings, stages)))
 
 
 def cluster_analysis(x, y, partition_no, config, feature_names):
@@ -10,7 +10,6 @@ import logging
 import pickle
 from os.path import isfile, splitext, exists
 import os
-import shutil
 import warnings
 
 import click
@@ -44,8 +43,15 @@ warnings.filterwarnings(action='ignore', category=DeprecationWarning)
 @click.option('-v', '--verbosity',
               type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR']),
               default='INFO', help='Level of logging')
-def cli(verbosity):
+@click.option('--max-open-files', type=int, default=64, show_default=True,
+              help='Maximum number of covariate files each process keeps open '
+                   'between reads. 0 reopens files for every read')
+@click.option('--io-threads', type=int, default=1, show_default=True,
+              help='Number of covariate files each process reads at once')
+def cli(verbosity, max_open_files, io_threads):
     uncoverml.mllog.configure(verbosity)
+    uncoverml.geoio.configure_dataset_pool(max_open_files)
+    uncoverml.geoio.configure_io_threads(io_threads)
 
 @cli.command()
 @click.argument('config_file')
@@ -146,8 +152,10 @@ def learn(config_file, partitions):
 @click.argument('config_file')
 @click.option('-s', '--subsample_fraction', type=float, default=1.0,
               help="only use this fraction of the data for learning classes")
-def cluster(config_file, subsample_fraction):
-    cluster_cli.main(config_file, subsample_fraction)
+@click.option('-p', '--partitions', type=int, default=1,
+              help='divide each node\'s data into this many partitions')
+def cluster(config_file, subsample_fraction, partitions):
+    cluster_cli.main(config_file, subsample_fraction, partitions)
 
 
 @cli.command()
@@ -173,7 +181,3 @@ def total_gb():
         total_usage = uncoverml.mpiops.comm.allreduce(my_usage)
     return total_usage
 
-
-def _clean_temp_cropfiles(config):
-    shutil.rmtree(config.tmpdir)   
-
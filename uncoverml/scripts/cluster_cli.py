@@ -37,7 +37,7 @@ warnings.filterwarnings(action='ignore', category=FutureWarning)
 warnings.filterwarnings(action='ignore', category=DeprecationWarning)
 
 
-def main(config_file, subsample_fraction):
+def main(config_file, subsample_fraction, partitions=1):
     config = ls.config.Config(config_file, clustering=True)
 
     for f in config.feature_sets:
@@ -48,7 +48,11 @@ def main(config_file, subsample_fraction):
                 raise ValueError("Only standardise transform is allowed for kmeans")
 
     config.subsample_fraction = subsample_fraction
-    if config.subsample_fraction < 1:
+    config.n_subchunks = partitions
+    if config.minibatch:
+        _logger.info("Streaming mini-batch k-means: reading each node's data in {} "
+                     "partitions".format(config.n_subchunks))
+    elif config.subsample_fraction < 1:
         _logger.info("Memory contstraint: using {:2.2f}%"
                      " of pixels".format(config.subsample_fraction * 100))
     else:
@@ -56,8 +60,11 @@ def main(config_file, subsample_fraction):
 
     if config.semi_supervised:
         semisupervised(config)
+    elif config.minibatch:
+        minibatch(config)
     else:
         unsupervised(config)
+    ls.geoio.close_dataset_pool()
     _logger.info("Finished! Total mem = {:.1f} GB".format(ls.scripts.total_gb()))
 
 def semisupervised(config):
@@ -101,4 +108,39 @@ def unsupervised(config):
     model = ls.cluster.KMeans(config.n_classes, config.oversample_factor)
     _logger.info("Clustering image")
     model.learn(features)
-    ls.mpiops.run_once(ls.geoio.export_model, model, config)
\ No newline at end of file
+    ls.mpiops.run_once(ls.geoio.export_model, model, config)
+
+
+def minibatch(config):
+    # make sure we're clear that we're clustering
+    config.cubist = False
+    transform_sets = [k.transform_set for k in config.feature_sets]
+
+    def partitions():
+        for i in range(config.n_subchunks):
+            yield ls.geoio.image_subchunks(i, config)
+
+    # The transforms are fitted on all of the pixels, a partition at a
+    # time, and a sample drawn from every partition seeds the centres
+    ls.features.fit_transforms(partitions, transform_sets, config.final_transform, config)
+    image_chunk_sets = ls.geoio.unsupervised_feature_sets(config, config.init_fraction)
+    features, _ = ls.features.transform_features(image_chunk_sets,
+                                                 transform_sets,
+                                                 config.final_transform,
+                                                 config)
+    features, _ = ls.features.remove_missing(features)
+
+    def batches():
+        for i, image_chunk_sets in enumerate(partitions()):
+            _logger.info("Clustering partition {} of {}".format(i + 1, config.n_subchunks))
+            x, _ = ls.features.transform_features(image_chunk_sets,
+                                                  transform_sets,
+                                                  config.final_transform,
+                                                  config)
+            x, _ = ls.features.remove_missing(x)
+            yield x
+
+    model = ls.cluster.KMeans(config.n_classes, config.oversample_factor)
+    _logger.info("Clustering image")
+    model.learn_minibatch(features, batches, config.max_epochs, config.tolerance)
+    ls.mpiops.run_once(ls.geoio.export_model, model, config)
@@ -58,6 +58,8 @@ def main(verbosity, geotiff, height, absorption, forward, outputdir, noise,
         image_source = geoio.RasterioImageSource(f)
         image = Image(image_source)
         data = image.data()
+        # the filters need a full mask, even if nothing is missing
+        data = np.ma.MaskedArray(data=data.data, mask=np.ma.getmaskarray(data))
 
         # apply transforms here
         log.info("Computing sensor footprint")
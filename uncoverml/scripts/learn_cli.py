@@ -8,7 +8,6 @@ import logging
 import pickle
 from os.path import isfile, splitext, exists
 import os
-import shutil
 import warnings
 
 import click
@@ -59,8 +58,7 @@ def main(config_file, partitions):
         if oos_results:
             oos_results.export_scores(config)
 
-    if config.extents:
-        ls.mpiops.run_once(_clean_temp_cropfiles, config)
+    ls.geoio.close_dataset_pool()
 
     ls.geoio.deallocate_shared_training_data(training_data)
     if oos_data is not None:
@@ -193,8 +191,15 @@ def _load_data(config, partitions):
                                                         config.final_transform,
                                                         config)
 
-        x_all = ls.features.gather_features(features[keep], node=0)
-        targets_all = ls.targets.gather_targets(targets, keep, node=0)
+        if config.training_store:
+            training_data = ls.geoio.write_training_store(
+                config.training_store, targets, features, keep)
+            x_all = training_data.x_all
+            targets_all = training_data.targets_all
+        else:
+            training_data = None
+            x_all = ls.features.gather_features(features[keep], node=0)
+            targets_all = ls.targets.gather_targets(targets, keep, node=0)
 
 
         # Transform out-of-sample features after training data transform is performed so we use
@@ -202,9 +207,15 @@ def _load_data(config, partitions):
         if config.out_of_sample_validation:
             oos_features, keep = ls.features.transform_features(oos_feature_chunks, transform_sets,
                                                                 config.final_transform, config)
-            oos_targets = ls.targets.gather_targets(oos_targets, keep, node=0)
-            oos_features = ls.features.gather_features(oos_features[keep], node=0)
-            oos_data = ls.geoio.create_shared_training_data(oos_targets, oos_features)
+            if config.training_store:
+                oos_data = ls.geoio.write_training_store(
+                    os.path.join(config.training_store, 'out_of_sample'),
+                    oos_targets, oos_features, keep)
+                oos_targets = oos_data.targets_all
+            else:
+                oos_targets = ls.targets.gather_targets(oos_targets, keep, node=0)
+                oos_features = ls.features.gather_features(oos_features[keep], node=0)
+                oos_data = ls.geoio.create_shared_training_data(oos_targets, oos_features)
             if ls.mpiops.chunk_index == 0 and config.oos_percentage:
                 _logger.info(f"{oos_targets.observations.shape[0]} targets withheld for "
                              f"out-of-sample validation. Saved to {config.oos_targets_file}")
@@ -218,10 +229,9 @@ def _load_data(config, partitions):
                 pickle.dump(x_all, open(config.pk_covariates, 'wb'))
             if config.pk_targets and not os.path.exists(config.pk_targets):
                 pickle.dump(targets_all, open(config.pk_targets, 'wb'))
+
+        if training_data is not None:
+            return training_data, oos_data
  
     return ls.geoio.create_shared_training_data(targets_all, x_all), oos_data
 
-
-def _clean_temp_cropfiles(config):
-    shutil.rmtree(config.tmpdir)   
-
@@ -6,7 +6,6 @@ covariate transform fixes were applied.
 """
 from collections import namedtuple
 import logging
-import pickle
 from os.path import isfile, splitext, exists
 import os
 import shutil
@@ -63,8 +62,7 @@ def main(config_file):
     # `feature_sets` and `final_transform` in the pickle file so they
     # can be reused in prediction.
     ls.mpiops.run_once(ls.geoio.export_model, model, config)
-    if config.extents:
-        ls.mpiops.run_once(_clean_temp_cropfiles, config)
+    ls.geoio.close_dataset_pool()
     
     _logger.info(f"Finished! The model has been saved ({config.model_file}) with transform data "
         f"and this config can now be used for predictions. Note a backup of the origin model has "
@@ -116,12 +114,17 @@ def _load_data(config):
             "the model's performance."
         )
 
-def _clean_temp_cropfiles(config):
-    shutil.rmtree(config.tmpdir)   
-
 def _load_model(config):
-    with open(config.model_file, 'rb') as f:
-        return pickle.load(f)
+    return ls.geoio.load_model(config.model_file)
 
 def _backup_model(config):
-    shutil.copyfile(config.model_file, config.model_file + '_backup')
+    backup = config.model_file + '_backup'
+    # replace a backup left by an earlier run, in either format
+    if os.path.isdir(backup):
+        shutil.rmtree(backup)
+    elif os.path.exists(backup):
+        os.remove(backup)
+    if os.path.isdir(config.model_file):
+        shutil.copytree(config.model_file, backup)
+    else:
+        shutil.copyfile(config.model_file, backup)
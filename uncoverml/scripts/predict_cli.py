@@ -4,10 +4,8 @@ Run the uncoverml pipeline for clustering, supervised learning and prediction.
 .. program-output:: uncoverml --help
 """
 import logging
-import pickle
 from os.path import isfile, splitext, exists
 import os
-import shutil
 import warnings
 
 import click
@@ -114,8 +112,6 @@ def main(config_file, partitions, mask, retain):
                 config.mask = ''
                 _logger.info("A mask was provided, but the file does not exist on "
                              "disc or is not a file.")
-            elif config.extents:
-                ls.geoio.crop_mask(config)
 
         config.n_subchunks = partitions
         if config.n_subchunks > 1:
@@ -133,13 +129,14 @@ def main(config_file, partitions, mask, retain):
 
         image_out = ls.geoio.ImageWriter(image_shape, image_bbox, image_crs,
                                          config.n_subchunks, config.prediction_file, config.outbands,
-                                         band_tags=predict_tags, **config.geotif_options)
+                                         band_tags=predict_tags,
+                                         parallel=config.parallel_write,
+                                         **config.geotif_options)
 
-        for i in range(config.n_subchunks):
-            _logger.info("starting to render partition {}".format(i+1))
-            ls.predict.render_partition(model, i, image_out, config)
+        ls.predict.render_partitions(model, image_out, config, config.prefetch)
 
         image_out.close()
+        ls.geoio.close_dataset_pool()
 
         if config.clustering and config.cluster_analysis:
             if ls.mpiops.chunk_index == 0:
@@ -149,10 +146,6 @@ def main(config_file, partitions, mask, retain):
         if config.thumbnails:
             image_out.output_thumbnails(config.thumbnails)
 
-        
-        if config.extents:
-            ls.mpiops.run_once(_clean_temp_cropfiles, config)
-
     ls.mpiops.run_once(
             write_prediction_metadata,
             model, config, config.metadata_file)
@@ -173,9 +166,5 @@ def write_prediction_metadata(model, config, out_filename="metadata.txt"):
     return out_filename
 
 def _load_model(config):
-    with open(config.model_file, 'rb') as f:
-        return pickle.load(f)
-
-def _clean_temp_cropfiles(config):
-    shutil.rmtree(config.tmpdir)   
+    return ls.geoio.load_model(config.model_file)
 
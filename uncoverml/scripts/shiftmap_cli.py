@@ -7,7 +7,6 @@ import logging
 import pickle
 from os.path import isfile, splitext, exists
 import os
-import shutil
 import warnings
 
 import click
@@ -121,6 +120,7 @@ def main(config_file, partitions):
     image_out = ls.geoio.ImageWriter(image_shape, image_bbox, image_crs,
                                      config.n_subchunks, config.shiftmap_file, config.outbands,
                                      band_tags=predict_tags,
+                                     parallel=config.parallel_write,
                                      **config.geotif_options)
 
     for i in range(config.n_subchunks):
@@ -128,14 +128,8 @@ def main(config_file, partitions):
         ls.predict.render_partition(model, i, image_out, config)
 
     image_out.close()
+    ls.geoio.close_dataset_pool()
 
     if config.thumbnails:
         image_out.output_thumbnails(config.thumbnails)
 
-    if config.extents:
-        ls.mpiops.run_once(_clean_temp_cropfiles, config)
-
-
-def _clean_temp_cropfiles(config):
-    shutil.rmtree(config.tmpdir)   
-
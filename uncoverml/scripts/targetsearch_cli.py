@@ -105,6 +105,7 @@ def main(config_file, partitions):
 
     x_all = ls.features.gather_features(features[keep], node=0)
     targets_all = ls.targets.gather_targets(targets, keep, node=0)
+    ls.geoio.close_dataset_pool()
 
     if ls.mpiops.chunk_index == 0:
         # Write out targets for debug purpses
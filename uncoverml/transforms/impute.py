@@ -1,4 +1,5 @@
 import logging
+from collections import OrderedDict
 
 import numpy as np
 from scipy.linalg import pinv, solve
@@ -21,6 +22,24 @@ def impute_with_mean(x, mean):
     return x
 
 
+def _mask_patterns(mask):
+    """
+    The distinct rows of a boolean mask, and the index of each row's
+    pattern. Rows of up to 64 columns are compared as integers, which is
+    much faster than np.unique on rows.
+    """
+    packed = np.packbits(mask, axis=1)
+    if packed.shape[1] <= 8:
+        codes = np.zeros((len(mask), 8), dtype=np.uint8)
+        codes[:, :packed.shape[1]] = packed
+        _, first, inverse = np.unique(codes.view(np.uint64).ravel(),
+                                      return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(packed, axis=0, return_index=True,
+                                      return_inverse=True)
+    return mask[first], inverse.ravel()
+
+
 class MeanImputer:
     """
     Simple mean imputation.
@@ -32,9 +51,22 @@ class MeanImputer:
     def __init__(self):
         self.mean = None
 
+    @property
+    def fitted(self):
+        return self.mean is not None
+
+    def accumulate(self, x):
+        self._partial = mpiops.accumulate_moments(
+            getattr(self, '_partial', None), x)
+
+    def finalise(self):
+        _, self.mean, _ = mpiops.reduce_moments(
+            self.__dict__.pop('_partial', None))
+
     def __call__(self, x):
-        if self.mean is None:
-            self.mean = mpiops.mean(x)
+        if not self.fitted:
+            self.accumulate(x)
+            self.finalise()
         x = impute_with_mean(x, self.mean)
         return x
 
@@ -54,48 +86,91 @@ class GaussImputer:
     We use the precision (inverse covariance) form of the Gaussian for
     computational efficiency.
 
+    Rows are grouped by their pattern of missing columns, and the
+    conditional regression for each pattern is solved once and applied to
+    the whole group. The most recently used `cache_size` solutions are
+    kept between calls, so images with a few distinct patterns are cheap
+    to impute partition after partition.
+
+    Parameters
+    ----------
+    cache_size: int, optional
+        number of missing-column patterns to keep conditionals for.
+
     """
 
-    def __init__(self):
+    def __init__(self, cache_size=256):
         self.mean = None
         self.prec = None
+        self.cache_size = cache_size
 
-    def __call__(self, x):
+    @property
+    def fitted(self):
+        return self.mean is not None and self.prec is not None
+
+    def accumulate(self, x):
+        self._partial = mpiops.accumulate_moments(
+            getattr(self, '_partial', None), x, cross=True)
+
+    def finalise(self):
+        _, mean, _, cov = mpiops.reduce_moments(
+            self.__dict__.pop('_partial', None), cross=True)
+        self._make_impute_stats(mean, cov)
 
-        if self.mean is None or self.prec is None:
-            self._make_impute_stats(x)
+    def __call__(self, x):
 
-        for i in range(len(x)):
-            x.data[i] = self._gaus_condition(x[i])
+        if not self.fitted:
+            self.accumulate(x)
+            self.finalise()
+
+        missing = np.ma.getmaskarray(x)
+        rows = np.flatnonzero(missing.any(axis=1))
+        if len(rows) > 0:
+            patterns, inverse = _mask_patterns(missing[rows])
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.cumsum(np.bincount(inverse))[:-1]
+            for a, group in zip(patterns, np.split(rows[order], bounds)):
+                b = ~a
+                K = self._conditional(a)
+                xb = x.data[np.ix_(group, b)]
+                x.data[np.ix_(group, a)] = \
+                    self.mean[a] - (xb - self.mean[b]).dot(K.T)
 
         return np.ma.MaskedArray(data=x.data, mask=False)
 
-    def _make_impute_stats(self, x):
+    def __getstate__(self):
+        # the solutions are cheap to recompute, so they are not pickled
+        state = self.__dict__.copy()
+        state.pop('_conditionals', None)
+        return state
+
+    def _make_impute_stats(self, mean, cov):
 
-        self.mean = mpiops.mean(x)
-        cov = mpiops.covariance(x)
+        self.mean = mean
         self.prec, rank = pinv(cov, return_rank=True)  # stable pseudo inverse
+        self._conditionals = OrderedDict()
 
         # if rank < len(self.mean):
         #     raise RuntimeError("This imputation method does not work on low "
         #                        "rank problems!")
 
-    def _gaus_condition(self, xi):
-
-        if np.ma.count_masked(xi) == 0:
-            return xi
+    def _conditional(self, a):
+        # Laa^-1 Lab for the missing columns a, the missing values of a row
+        # are then mean[a] - Laa^-1 Lab (x[b] - mean[b])
+        conditionals = self.__dict__.setdefault('_conditionals', OrderedDict())
+        key = a.tobytes()
+        if key in conditionals:
+            conditionals.move_to_end(key)
+            return conditionals[key]
 
-        a = xi.mask
-        b = ~xi.mask
-
-        xb = xi[b].data
+        b = ~a
         Laa = self.prec[np.ix_(a, a)]
         Lab = self.prec[np.ix_(a, b)]
-
-        xfill = np.empty_like(xi)
-        xfill[b] = xb
-        xfill[a] = self.mean[a] - solve(Laa, Lab.dot(xb - self.mean[b]))
-        return xfill
+        K = solve(Laa, Lab)
+        conditionals[key] = K
+        if len(conditionals) > getattr(self, 'cache_size', 256):
+            conditionals.popitem(last=False)
+        return K
 
 
 class NearestNeighboursImputer:
@@ -106,25 +181,55 @@ class NearestNeighboursImputer:
     fills in the missing data in query points with values from thier average
     nearest neighbours.
 
+    The tree is built on the first call, or from the points sampled by
+    `accumulate`, and reused for every later call, and the query points are
+    looked up in batches of `chunk_size` rows using all available cores.
+
     Parameters
     ----------
     nodes: int, optional
         maximum number of points to use as nearest neightbours.
     k: int, optional
         number of neighbours to average for missing values.
+    chunk_size: int, optional
+        number of query points looked up at once, bounds the memory used
+        for the neighbour distances and indices.
     """
 
-    def __init__(self, nodes=500, k=3):
+    def __init__(self, nodes=500, k=3, chunk_size=100000):
         self.k = k
         self.nodes = nodes
+        self.chunk_size = chunk_size
         self.kdtree = None
 
+    @property
+    def fitted(self):
+        return self.kdtree is not None
+
+    def accumulate(self, x):
+        # Keeps the full rows with the smallest random keys, which are a
+        # uniform sample of all the full rows accumulated so far
+        full = np.ma.getdata(x)[np.ma.count_masked(x, axis=1) == 0]
+        keys = np.random.rand(len(full))
+        if getattr(self, '_partial', None) is not None:
+            keys = np.concatenate((self._partial[0], keys))
+            full = np.concatenate((self._partial[1], full))
+        sample = np.argsort(keys)[:self.nodes]
+        self._partial = keys[sample], full[sample]
+
+    def finalise(self):
+        partials = [p for p in mpiops.comm.allgather(
+            self.__dict__.pop('_partial', None)) if p is not None]
+        keys = np.concatenate([p[0] for p in partials])
+        points = np.concatenate([p[1] for p in partials])
+        self._build_kdtree(points[np.argsort(keys)[:self.nodes]])
+
     def __call__(self, x):
 
         # impute with neighbours
         missing_ind = np.ma.count_masked(x, axis=1) > 0
 
-        if self.kdtree is None:
+        if not self.fitted:
             self._make_kdtree(x)
 
         if missing_ind.sum() > 0:
@@ -134,8 +239,13 @@ class NearestNeighboursImputer:
         return np.ma.MaskedArray(data=x.data, mask=False)
 
     def _make_kdtree(self, x):
-        self.kdtree = cKDTree(mpiops.random_full_points(x, Napprox=self.nodes))
-        if not np.isfinite(self.kdtree.query(x, k=self.k)[0]).all():
+        self._build_kdtree(mpiops.random_full_points(x, Napprox=self.nodes))
+
+    def _build_kdtree(self, points):
+        self.kdtree = cKDTree(points)
+        # queries only return infinite distances if there are fewer points
+        # in the tree than neighbours asked for
+        if self.kdtree.n < self.k:
             log.warning('Kdtree computation encountered problem. '
                         'Not enough neighbors available to compute '
                         'kdtree. Printing kdtree for debugging purpose')
@@ -146,8 +256,20 @@ class NearestNeighboursImputer:
         _, neighbourind = self.kdtree.query(xq)
         return self.kdtree.data[neighbourind]
 
+    def _query(self, xq, k):
+        try:
+            return self.kdtree.query(xq, k=k, workers=-1)
+        except TypeError:  # scipy < 1.6
+            return self.kdtree.query(xq, k=k, n_jobs=-1)
+
     def _av_neigbours(self, xq):
 
-        xnn = [self.kdtree.data[self.kdtree.query(x, k=self.k)[1]].mean(axis=0)
-               for x in xq]
-        return np.vstack(xnn)
+        # the query uses all of the data, including the masked values
+        xq = np.ma.getdata(xq)
+        xnn = np.empty(xq.shape, dtype=self.kdtree.data.dtype)
+        for start in range(0, len(xq), self.chunk_size):
+            stop = start + self.chunk_size
+            _, neighbourind = self._query(xq[start:stop], self.k)
+            neighbourind = neighbourind.reshape(len(neighbourind), -1)
+            xnn[start:stop] = self.kdtree.data[neighbourind].mean(axis=1)
+        return xnn
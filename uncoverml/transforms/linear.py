@@ -1,4 +1,3 @@
-
 import numpy as np
 
 from uncoverml import mpiops
@@ -8,10 +7,23 @@ class CentreTransform:
     def __init__(self):
         self.mean = None
 
+    @property
+    def fitted(self):
+        return self.mean is not None
+
+    def accumulate(self, x):
+        self._partial = mpiops.accumulate_moments(
+            getattr(self, '_partial', None), x)
+
+    def finalise(self):
+        _, self.mean, _ = mpiops.reduce_moments(
+            self.__dict__.pop('_partial', None))
+
     def __call__(self, x):
         x = x.astype(float)
-        if self.mean is None:
-            self.mean = mpiops.mean(x)
+        if not self.fitted:
+            self.accumulate(x)
+            self.finalise()
         x -= self.mean
         return x
 
@@ -21,11 +33,24 @@ class StandardiseTransform:
         self.mean = None
         self.sd = None
 
+    @property
+    def fitted(self):
+        return self.sd is not None and self.mean is not None
+
+    def accumulate(self, x):
+        self._partial = mpiops.accumulate_moments(
+            getattr(self, '_partial', None), x)
+
+    def finalise(self):
+        n, self.mean, m2 = mpiops.reduce_moments(
+            self.__dict__.pop('_partial', None))
+        self.sd = np.sqrt(m2 / n)
+
     def __call__(self, x):
         x = x.astype(float)
-        if self.sd is None or self.mean is None:
-            self.mean = mpiops.mean(x)
-            self.sd = mpiops.sd(x)
+        if not self.fitted:
+            self.accumulate(x)
+            self.finalise()
 
         # Centre
         x -= self.mean
@@ -47,10 +72,34 @@ class PositiveTransform:
         self.min = None
         self.stabilizer = stabilizer
 
+    @property
+    def fitted(self):
+        return self.min is not None
+
+    def accumulate(self, x):
+        if len(x) == 0:
+            return
+        x_min = np.ma.min(x, axis=0).astype(float)
+        partial = getattr(self, '_partial', None)
+        # masked minima (columns with no data so far) are ignored
+        self._partial = x_min if partial is None \
+            else np.ma.min(np.ma.vstack((partial, x_min)), axis=0)
+
+    def finalise(self):
+        partials = [p for p in mpiops.comm.allgather(
+            self.__dict__.pop('_partial', None)) if p is not None]
+        x_min = np.ma.min(np.ma.vstack(partials), axis=0) if partials \
+            else np.ma.masked
+        if np.ma.count_masked(x_min) != 0:
+            raise ValueError("Can't compute minimum: At least 1 column has "
+                             "nodata")
+        self.min = np.ma.getdata(x_min)
+
     def __call__(self, func, x):
         x = x.astype(float)
-        if self.min is None:
-            self.min = mpiops.minimum(x)
+        if not self.fitted:
+            self.accumulate(x)
+            self.finalise()
 
         # remove min
         x -= self.min
@@ -85,11 +134,25 @@ class WhitenTransform:
         self.eigvecs = None
         self.keep_fraction = keep_fraction
 
+    @property
+    def fitted(self):
+        return self.mean is not None and self.eigvals is not None \
+            and self.eigvecs is not None
+
+    def accumulate(self, x):
+        self._partial = mpiops.accumulate_moments(
+            getattr(self, '_partial', None), x, cross=True)
+
+    def finalise(self):
+        _, self.mean, _, cov = mpiops.reduce_moments(
+            self.__dict__.pop('_partial', None), cross=True)
+        self.eigvals, self.eigvecs = np.linalg.eigh(cov)
+
     def __call__(self, x):
         x = x.astype(float)
-        if self.mean is None or self.eigvals is None or self.eigvecs is None:
-            self.mean = mpiops.mean(x)
-            self.eigvals, self.eigvecs = mpiops.eigen_decomposition(x)
+        if not self.fitted:
+            self.accumulate(x)
+            self.finalise()
 
         ndims = x.shape[1]
         # make sure 1 <= keepdims <= ndims
@@ -1,3 +1,4 @@
+import functools
 import logging
 
 import numpy as np
@@ -41,7 +42,47 @@ def compute_unique_values(x):
     return full_sets
 
 
-def one_hot(x, x_set, matrices=None):
+def _lookup(values, value_set):
+    """
+    Column of each value in a sorted set of values, and whether it was
+    found in the set at all.
+    """
+    if len(value_set) == 0:
+        return (np.zeros(values.shape, dtype=int),
+                np.zeros(values.shape, dtype=bool))
+    columns = np.searchsorted(value_set, values)
+    np.minimum(columns, len(value_set) - 1, out=columns)
+    found = value_set[columns] == values
+    return columns, found
+
+
+def one_hot(x, x_set, matrices=None, dtype=float):
+    """
+    One-hot encode each channel of a 4-D masked array of patches.
+
+    Each value of a channel is looked up in that channel's (sorted) set
+    of values, and the output column it selects is set in a single pass.
+    Values not in the set are encoded as zeros.
+
+    Parameters
+    ----------
+    x : np.ma.MaskedArray
+        Integer array of shape (points, patch_x, patch_y, channel).
+    x_set : list of ndarray
+        The sorted unique values of each channel.
+    matrices : list of ndarray, optional
+        Projection matrix for each channel, with a row for each value in
+        its set. If given, the row of each value is output instead of its
+        one-hot encoding.
+    dtype : data-type, optional
+        Type of the output array.
+
+    Returns
+    -------
+    np.ma.MaskedArray
+        Array of shape (points, patch_x, patch_y, encoded dimensions). An
+        output column is masked wherever its input channel is masked.
+    """
     assert x.ndim == 4  # points, patch_x, patch_y, channel
     if matrices:
         out_dim_sizes = np.array([m.shape[1] for m in matrices])
@@ -51,30 +92,23 @@ def one_hot(x, x_set, matrices=None):
     indices = np.hstack((np.array([0]), np.cumsum(out_dim_sizes)))
     total_dims = np.sum(out_dim_sizes)
     out_shape = x.shape[0:3] + (total_dims,)
-    out = np.zeros(out_shape, dtype=float)
+    out = np.zeros(out_shape, dtype=dtype)
+    # rows of the output with one row per input pixel
+    flat_out = out.reshape(-1, total_dims)
 
     for dim_idx, dim_set in enumerate(x_set):
-        # input data
-        dim_in = x.data[..., dim_idx]
-
-        # appropriate parts of the output_array
-        dim_out = out[..., indices[dim_idx]:indices[dim_idx + 1]]
-
-        # compute the one-hot values
-        for i, val in enumerate(dim_set):
-            if matrices:
-                proj = matrices[dim_idx]
-                dim_out[dim_in == val] = proj[i]
-            else:
-                dim_out[..., i][dim_in == val] = 0.5
+        dim_in = np.ma.getdata(x)[..., dim_idx].ravel()
+        columns, found = _lookup(dim_in, dim_set)
+        rows = np.flatnonzero(found)
+        if matrices:
+            flat_out[rows, indices[dim_idx]:indices[dim_idx + 1]] = \
+                matrices[dim_idx][columns[rows]]
+        else:
+            flat_out[rows, indices[dim_idx] + columns[rows]] = 0.5
 
     if x.mask.ndim != 0:  # all false
-        out_mask = np.zeros(out_shape, dtype=bool)
-        for dim_idx, dim_set in enumerate(x_set):
-            dim_mask = x.mask[..., dim_idx]
-            dim_out_mask = out_mask[..., indices[dim_idx]:indices[dim_idx + 1]]
-            # broadcast the mask
-            dim_out_mask[:] = dim_mask[..., np.newaxis]
+        # broadcast the mask of each channel over its output columns
+        out_mask = np.repeat(x.mask, out_dim_sizes, axis=-1)
     else:
         out_mask = False
 
@@ -82,38 +116,81 @@ def one_hot(x, x_set, matrices=None):
     return result
 
 
+def _merge_sets(partial, x):
+    # merge the per-dimension sets of local values x into `partial`
+    if x.dtype == np.dtype('float32') or x.dtype == np.dtype('float64'):
+        raise ValueError("Can't do one-hot on float data")
+    local_sets = sets(x)
+    if partial is None:
+        return local_sets
+    return mpiops.unique(partial, local_sets, None)
+
+
+def _reduce_sets(partial):
+    partials = [p for p in mpiops.comm.allgather(partial) if p is not None]
+    return functools.reduce(lambda a, b: mpiops.unique(a, b, None), partials)
+
+
 class OneHotTransform:
-    def __init__(self):
+    def __init__(self, dtype='float64'):
         self.x_sets = None
+        self.dtype = dtype
+
+    @property
+    def fitted(self):
+        return self.x_sets is not None
+
+    def accumulate(self, x):
+        self._partial = _merge_sets(getattr(self, '_partial', None),
+                                    x.astype(int))
+
+    def finalise(self):
+        self.x_sets = _reduce_sets(self.__dict__.pop('_partial', None))
 
     def __call__(self, x):
         x = x.astype(int)
-        if self.x_sets is None:
+        if not self.fitted:
             self.x_sets = compute_unique_values(x)
 
         for s in self.x_sets:
             log.info("One-hot encoding to d={}".format(len(s)))
-        x = one_hot(x, self.x_sets)
+        x = one_hot(x, self.x_sets, dtype=getattr(self, 'dtype', float))
         return x
 
 
 class RandomHotTransform:
-    def __init__(self, n_features, seed):
+    def __init__(self, n_features, seed, dtype='float64'):
         self.n_features = n_features
         self.seed = seed
         self.matrices = None
+        self.dtype = dtype
+
+    @property
+    def fitted(self):
+        return self.matrices is not None
+
+    def accumulate(self, x):
+        self._partial = _merge_sets(getattr(self, '_partial', None),
+                                    x.astype(int))
+
+    def finalise(self):
+        self._make_matrices(_reduce_sets(self.__dict__.pop('_partial', None)))
+
+    def _make_matrices(self, x_sets):
+        np.random.seed(self.seed)
+        self.x_sets = x_sets
+        nbands = [len(s) for s in self.x_sets]
+        self.matrices = [np.random.randn(k, self.n_features)
+                         for k in nbands]
 
     def __call__(self, x):
         x = x.astype(int)
-        if self.matrices is None:
-            np.random.seed(self.seed)
-            self.x_sets = compute_unique_values(x)
-            nbands = [len(s) for s in self.x_sets]
-            self.matrices = [np.random.randn(k, self.n_features)
-                             for k in nbands]
+        if not self.fitted:
+            self._make_matrices(compute_unique_values(x))
         for s in self.x_sets:
             log.info("One-hot encoding to "
                      "d={} space then projecting to d={}".format(
                          len(s), self.n_features))
-        x = one_hot(x, self.x_sets, self.matrices)
+        x = one_hot(x, self.x_sets, self.matrices,
+                    dtype=getattr(self, 'dtype', float))
         return x
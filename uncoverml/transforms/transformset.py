@@ -11,26 +11,74 @@ log = logging.getLogger(__name__)
 def build_feature_vector(image_chunks, is_categorical):
     dtype = int if is_categorical else float
     for k, im in image_chunks.items():
-        image_chunks[k] = im.reshape(im.shape[0], -1).astype(dtype)
-    x_data = np.concatenate([a.data for a in image_chunks.values()], axis=1)
-    x_mask = np.concatenate([a.mask for a in image_chunks.values()], axis=1)
+        image_chunks[k] = im.reshape(im.shape[0], -1)
+    chunks = list(image_chunks.values())
+    # the columns of every image are cast while they are copied into place
+    bounds = np.cumsum([0] + [a.shape[1] for a in chunks])
+    x_data = np.empty((chunks[0].shape[0], bounds[-1]), dtype=dtype)
+    for a, start, stop in zip(chunks, bounds[:-1], bounds[1:]):
+        x_data[:, start:stop] = np.ma.getdata(a)
+    if all(np.ma.getmask(a) is np.ma.nomask for a in chunks):
+        x_mask = np.ma.nomask
+    else:
+        x_mask = np.concatenate([np.ma.getmaskarray(a) for a in chunks],
+                                axis=1)
     x = np.ma.masked_array(data=x_data, mask=x_mask)
     return x
 
 
 def missing_percentage(x):
     x_n = np.sum(mpiops.count(x))
-    x_full_local = np.product(x.shape)
+    x_full_local = np.prod(x.shape)
     x_full = mpiops.comm.allreduce(x_full_local)
     missing = (1.0 - x_n / x_full) * 100.0
     return missing
 
 
 class TransformSet:
+    """
+    An imputer and a list of transforms, applied in turn.
+
+    Each transform computes its statistics from the first data it is
+    called on. To fit them on more data than fits in memory, stream the
+    data through `accumulate` and call `finalise` (on every node) after
+    each pass, until `fitted` is True. Each pass fits one more transform,
+    as a transform's statistics depend on the output of the transforms
+    before it.
+    """
     def __init__(self, imputer=None, transforms=None):
         self.global_transforms = (transforms if transforms else [])
         self.imputer = imputer
 
+    def _transforms(self):
+        return ([self.imputer] if self.imputer else []) + \
+            self.global_transforms
+
+    @property
+    def fitted(self):
+        return all(t.fitted for t in self._transforms())
+
+    def accumulate(self, x):
+        """
+        Applies the fitted transforms to x, and accumulates the statistics
+        of the first transform that is not fitted from the result.
+        """
+        for t in self._transforms():
+            if not t.fitted:
+                t.accumulate(x)
+                return
+            x = t(x)
+
+    def finalise(self):
+        """
+        Fits the transform `accumulate` has been collecting statistics for.
+        Must be called on every node.
+        """
+        for t in self._transforms():
+            if not t.fitted:
+                t.finalise()
+                return
+
     def __call__(self, x):
         # impute
         if self.imputer:
@@ -53,6 +101,34 @@ class ImageTransformSet(TransformSet):
         self.is_categorical = is_categorical
         super().__init__(imputer, global_transforms)
 
+    @property
+    def fitted(self):
+        return all(ti.fitted for t in self.image_transforms for ti in t) \
+            and super().fitted
+
+    def accumulate(self, image_chunks):
+        transformed_chunks = copy.copy(image_chunks)
+        for t in self.image_transforms:
+            if not all(ti.fitted for ti in t):
+                for i, lbl in enumerate(image_chunks):
+                    if not t[i].fitted:
+                        t[i].accumulate(transformed_chunks[lbl])
+                return
+            for i, lbl in enumerate(image_chunks):
+                transformed_chunks[lbl] = t[i](transformed_chunks[lbl])
+
+        x = build_feature_vector(transformed_chunks, self.is_categorical)
+        super().accumulate(x)
+
+    def finalise(self):
+        for t in self.image_transforms:
+            if not all(ti.fitted for ti in t):
+                for ti in t:
+                    if not ti.fitted:
+                        ti.finalise()
+                return
+        super().finalise()
+
     def __call__(self, image_chunks):
         transformed_chunks = copy.copy(image_chunks)
         # apply the per-image transforms
@@ -3,10 +3,11 @@
 from __future__ import division
 import logging
 import copy
+import itertools
 import json
 import os
-import pickle
 
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 import numpy as np
 from sklearn.metrics import (explained_variance_score, r2_score,
@@ -335,8 +336,7 @@ def out_of_sample_validation(model, targets, features, config):
         f"Performing out-of-sample validation with {targets.observations.shape[0]} targets...")
     mpiops.comm.barrier()
     if mpiops.chunk_index != 0:
-        with open(config.model_file, 'rb') as f:
-            model, _, _ = pickle.load(f)
+        model, _, _ = geoio.load_model(config.model_file)
     model = mpiops.comm.bcast(model, root=0)
     classification = hasattr(model, 'predict_proba')
     pos = np.array_split(targets.positions, mpiops.chunks)[mpiops.chunk_index]
@@ -460,6 +460,116 @@ def _join_dicts(dicts):
     return d
 
 
+def fold_indices(cv_assigns, folds):
+    """
+    Index arrays of the training and testing samples of each fold.
+
+    Parameters
+    ----------
+    cv_assigns: ndarray
+        The fold of each sample, as returned by :func:`split_cfold`.
+    folds: int
+        The number of folds.
+
+    Returns
+    -------
+    list of tuple
+        (train, test) index arrays for each fold, in sample order.
+    """
+    return [(np.flatnonzero(cv_assigns != k), np.flatnonzero(cv_assigns == k))
+            for k in range(folds)]
+
+
+def _schedule(run, n_tasks, claim, n_threads=1):
+    """
+    Runs `run` on the tasks numbered by `claim` until it returns a number
+    past the last task, with up to `n_threads` tasks at a time. Tasks are
+    claimed from the calling thread only.
+
+    Returns
+    -------
+    dict
+        The result of each task this node ran, by task number.
+    """
+    results = {}
+    if n_threads <= 1:
+        task = claim()
+        while task < n_tasks:
+            results[task] = run(task)
+            task = claim()
+        return results
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        running = {}
+        task = claim()
+        while task < n_tasks or running:
+            while task < n_tasks and len(running) < n_threads:
+                running[pool.submit(run, task)] = task
+                task = claim()
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+
+def _crossval_fold(fold, train, test, x_all, targets_all, config, predict_fold):
+    """
+    Trains a model on the training samples of a fold and, if
+    `predict_fold`, predicts and scores its testing samples.
+    """
+    timings = {}
+    args = dict(config.algorithm_args)
+    if args.get('mmap_rules'):
+        # fold models are never exported, so memory mapping their rules
+        # would only leave a rules directory behind for every fold
+        args['mmap_rules'] = False
+    model = modelmaps[config.algorithm](**args)
+    y = targets_all.observations
+    lon_lat = targets_all.positions
+    fields = targets_all.fields
+    if config.target_weight_property:
+        y_k_weight = fields[config.target_weight_property][train]
+    else:
+        y_k_weight = None
+
+    # Train on this fold
+    with predict._timed(timings, 'fit'):
+        apply_multiple_masked(model.fit, data=(x_all[train], y[train]),
+                              fields={f: v[train] for f, v in fields.items()},
+                              lon_lat=lon_lat[train],
+                              sample_weight=y_k_weight)
+    if not predict_fold:
+        return None
+
+    # Testing
+    with predict._timed(timings, 'predict'):
+        x_test = x_all[test]
+        y_k_pred = predict.predict(x_test, model,
+                                   fields={f: v[test] for f, v in fields.items()},
+                                   lon_lat=lon_lat[test])
+
+    y_pred_dict = dict(zip(model.get_predict_tags(), y_k_pred.T))
+    if hasattr(model, '_notransform_predict'):
+        y_pred_dict['transformedpredict'] = \
+            model.target_transform.transform(y_k_pred[:, 0])
+
+    # Regression
+    if not hasattr(model, 'predict_proba'):
+        y_k_test = y[test]
+        scores = regression_validation_scores(
+            y_k_test, y_k_pred, x_test.shape[1], model)
+
+    # Classification
+    else:
+        y_k_test = model.le.transform(y[test])
+        y_k_hard, p_k = y_k_pred[:, 0], y_k_pred[:, 1:]
+        scores = classification_validation_scores(y_k_test, y_k_hard, p_k)
+
+    _logger.info(":mpi:Fold {} trained in {:.1f}s and predicted in {:.1f}s"
+                 .format(fold + 1, timings['fit'], timings['predict']))
+    return y_pred_dict, y_k_test, lon_lat[test], scores, timings
+
+
 def local_crossval(x_all, targets_all, config):
     """ Performs K-fold cross validation to test the applicability of a model.
     Given a set of inputs and outputs, this function will evaluate the
@@ -468,6 +578,14 @@ def local_crossval(x_all, targets_all, config):
     this model is used to predict all of the unseen targets, its performance
     can provide a benchmark to evaluate the effectiveness of a model.
 
+    The fold indices are computed once and each fold gathers its rows
+    from `x_all` directly. With `config.parallel_validate` the folds are
+    handed out to the nodes dynamically, so a node that finishes a fold
+    takes the next one; otherwise the root node trains every fold. Each
+    node trains `config.crossval_threads` folds at a time. Parallel
+    models (bootstrap models) that are not validated in parallel are
+    trained by all nodes together, one fold at a time.
+
     Parameters
     ----------
     x_all: numpy.array
@@ -484,117 +602,62 @@ def local_crossval(x_all, targets_all, config):
         on the unseen data subset.
     """
     parallel_model = config.multicubist or config.multirandomforest or config.bootstrap
-    if config.bootstrap and config.parallel_validate:
-        config.alrgorithm_args['parallel'] = False
-    elif not config.bootstrap and not config.parallel_validate and mpiops.chunk_index != 0:
+    # bootstrap models are trained by all nodes together unless the folds
+    # are spread over the nodes
+    collective = config.bootstrap and not config.parallel_validate
+    if not collective and not config.parallel_validate and mpiops.chunk_index != 0:
         return
 
-    if config.multicubist or config.multirandomforest:
-        config.algorithm_args['parallel'] = False
-   
     _logger.info("Validating with {} folds".format(config.folds))
-    model = modelmaps[config.algorithm](**config.algorithm_args)
-    classification = hasattr(model, 'predict_proba')
     y = targets_all.observations
-    lon_lat = targets_all.positions
     _, cv_indices = split_cfold(y.shape[0], config.folds, config.crossval_seed)
+    folds = fold_indices(cv_indices, config.folds)
 
-    # Split folds over workers
-    fold_list = np.arange(config.folds)
-    if config.parallel_validate:
-        fold_node = \
-            np.array_split(fold_list, mpiops.chunks)[mpiops.chunk_index]
-    else:
-        fold_node = fold_list
-
-    y_pred = {}
-    y_true = {}
-    fold_scores = {}
-    pos = {}
-
-    # Train and score on each fold
-    for fold in fold_node:
-        _logger.info(":mpi:Training fold {} of {}".format(
-            fold + 1, config.folds, mpiops.chunk_index))
+    def run(fold):
+        train, test = folds[fold]
+        _logger.info(":mpi:Training fold {} of {}".format(fold + 1, config.folds))
+        return _crossval_fold(fold, train, test, x_all, targets_all, config,
+                              predict_fold=not collective or mpiops.chunk_index == 0)
 
-        train_mask = cv_indices != fold
-        test_mask = ~ train_mask
-    
-        y_k_train = y[train_mask]
-        if config.target_weight_property:
-            y_k_weight = targets_all.fields[config.target_weight_property][train_mask]
+    if parallel_model and not collective:
+        config.algorithm_args['parallel'] = False
+    try:
+        if config.parallel_validate:
+            counter = mpiops.TaskCounter()
+            results = _schedule(run, config.folds, counter.next,
+                                config.crossval_threads)
+            counter.free()
+            results = _join_dicts(mpiops.comm.gather(results, root=0))
+        elif collective:
+            results = {fold: run(fold) for fold in range(config.folds)}
         else:
-            y_k_weight = None
-        lon_lat_train = lon_lat[train_mask]
-        lon_lat_test = lon_lat[test_mask]
-
-        # Extra fields
-        fields_train = {f: v[train_mask]
-                        for f, v in targets_all.fields.items()}
-        fields_pred = {f: v[test_mask] for f, v in targets_all.fields.items()}
-
-        # Train on this fold
-        x_train = x_all[train_mask]
-        apply_multiple_masked(model.fit, data=(x_train, y_k_train), fields=fields_train,
-                              lon_lat=lon_lat_train, 
-                              sample_weight=y_k_weight)
-
-        # Testing
-        if not config.parallel_validate and mpiops.chunk_index != 0:
-            continue
-        else:
-            y_k_pred = predict.predict(x_all[test_mask], model,
-                                       fields=fields_pred,
-                                       lon_lat=lon_lat_test)
-            y_pred[fold] = y_k_pred
-            n_covariates = x_all[test_mask].shape[1]
-
-            # Regression
-            if not classification:
-                y_k_test = y[test_mask]
-                fold_scores[fold] = regression_validation_scores(
-                    y_k_test, y_k_pred, n_covariates, model)
-
-            # Classification
-            else:
-                y_k_test = model.le.transform(y[test_mask])
-                y_k_hard, p_k = y_k_pred[:, 0], y_k_pred[:, 1:]
-                fold_scores[fold] = classification_validation_scores(
-                    y_k_test, y_k_hard, p_k
-                )
-            
-            y_true[fold] = y_k_test
-            pos[fold] = lon_lat_test
-
-    if config.parallel_validate:
-        y_pred = _join_dicts(mpiops.comm.gather(y_pred, root=0))
-        y_true = _join_dicts(mpiops.comm.gather(y_true, root=0))
-        pos = _join_dicts(mpiops.comm.gather(pos, root=0))
-        scores = _join_dicts(mpiops.comm.gather(fold_scores, root=0))
-    else:
-        scores = fold_scores
+            results = _schedule(run, config.folds, itertools.count().__next__,
+                                config.crossval_threads)
+    finally:
+        if parallel_model:
+            config.algorithm_args['parallel'] = True
 
     result = None
     if mpiops.chunk_index == 0:
-        y_true = np.concatenate([y_true[i] for i in range(config.folds)])
-        y_pred = np.concatenate([y_pred[i] for i in range(config.folds)])
-        pos = np.concatenate([pos[i] for i in range(config.folds)])
+        y_pred, y_true, pos, scores, timings = \
+            zip(*[results[i] for i in range(config.folds)])
+        y_true = np.concatenate(y_true)
+        y_pred_dict = {k: np.concatenate([d[k] for d in y_pred])
+                       for k in y_pred[0]}
+        pos = np.concatenate(pos)
         valid_metrics = scores[0].keys()
-        scores = {m: np.mean([d[m] for d in scores.values()], axis=0)
+        scores = {m: np.mean([d[m] for d in scores], axis=0)
                   for m in valid_metrics}
         score_string = "Validation complete:\n"
         for metric, score in scores.items():
             score_string += "{}\t= {}\n".format(metric, score)
         _logger.info(score_string)
+        _logger.info("Time spent training folds: {:.1f}s, predicting folds: "
+                     "{:.1f}s".format(sum(t['fit'] for t in timings),
+                                      sum(t['predict'] for t in timings)))
 
-        result_tags = model.get_predict_tags()
-        y_pred_dict = dict(zip(result_tags, y_pred.T))
-        if hasattr(model, '_notransform_predict'):
-            y_pred_dict['transformedpredict'] = \
-                model.target_transform.transform(y_pred[:, 0])
+        classification = hasattr(
+            modelmaps[config.algorithm](**config.algorithm_args), 'predict_proba')
         result = CrossvalInfo(scores, y_true, y_pred_dict, classification, pos)
 
-    if parallel_model:
-        config.algorithm_args['parallel'] = True
-
     return result